@@ -13,21 +13,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import csv, json, logging, logging.config, sys, unicodedata
-from argparse import ArgumentParser
-from itertools import zip_longest
-from random import shuffle
+import contextlib, logging, logging.config, os, sys
+from argparse import ArgumentParser, Namespace
+from itertools import chain, zip_longest
 from textwrap import TextWrapper
-from typing import Any, Callable, Dict, List, Optional, Tuple, Sequence
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Sequence
 
 logging.config.fileConfig('logging.cfg', disable_existing_loggers=False)
 
 from flashcards_lib.console_ui import WinAnsiMode
 from flashcards_lib.editor_app import EditorApp
-from flashcards_lib.practice_app import PracticeApp, QuestionResult, RESULT_PASS, RESULT_FAIL
-from flashcards_lib.database import Database
+from flashcards_lib.practice import normalize_answer, schedule, PracticeRound, QuestionResult
+from flashcards_lib.practice_app import PracticeApp, FRONT_LAYOUT
+from flashcards_lib.server import serve
+from flashcards_lib.terminal import ConsoleTerminal
+from flashcards_lib.terminal_server import serve_terminals
+from flashcards_lib.backup import backup, BackupError, PeriodicBackup
+from flashcards_lib.database import AUTO_VACUUM_INCREMENTAL, Cursor, Database, PROFILES
+from flashcards_lib.render_cache import prefetch_layouts, LayoutPrefetch
+from flashcards_lib.maintenance import maintain, storage_stats, StorageStats
+from flashcards_lib.deck_io import import_cards, open_output, COMPRESSION, READERS, WRITERS
 from flashcards_lib.util import unicode_ljust
-from flashcards_lib.markup import Macro
+from flashcards_lib.write_behind import AnswerBuffer
+from flashcards_lib.markup import Macro, LAYOUT_CACHE
 
 LOG = logging.getLogger(__name__)
 
@@ -54,7 +62,7 @@ def load_macros(db: Database):
     for macro_id, name, definition in macros:
         Macro.create(name, definition)
 
-def print_table(cols: Sequence[Tuple[str, int]], rows: Sequence[Sequence[Any]]):
+def print_table(cols: Sequence[Tuple[str, int]], rows: Iterable[Sequence[Any]]):
     cols_ = [(name, TextWrapper(width), width) for name, width in cols]
     print('╔═' + '═╤═'.join(['═' * width for _, _, width in cols_]) + '═╗')
     print('║ ' + ' │ '.join([name.ljust(width) for name, _, width in cols_]) + ' ║')
@@ -66,14 +74,22 @@ def print_table(cols: Sequence[Tuple[str, int]], rows: Sequence[Sequence[Any]]):
     print('╚═' + '═╧═'.join(['═' * width for _, _, width in cols_]) + '═╝')
 
 def cmd_list(
-    db_path: str,
+    db: Database,
     list_type: str,
     session_name: Optional[str],
     deck_name: Optional[str],
-    contains_text: Optional[str]
+    contains_text: Optional[str],
+    after_id: Optional[int],
+    limit: Optional[int],
+    page_size: int
 ) -> int:
     cols: Tuple[Tuple[str, int], ...]
-    with Database(db_path) as cur:
+    rows: Iterable[Sequence[Any]]
+    with db as cur:
+        if list_type != 'cards' and (after_id is not None or limit is not None):
+            sys.stderr.write(f'"--after" and "--limit" unsupported for "list {list_type}" queries\n')
+            sys.stderr.flush()
+            return -1
         if list_type == 'sessions':
             if session_name:
                 sys.stderr.write('"--in-session" unsupported for "list sessions" queries\n')
@@ -95,21 +111,29 @@ def cmd_list(
                 session=(cur.get_session_id(session_name) if session_name else None))
         elif list_type == 'cards':
             cols = ('id', 5), ('deck_id', 7), ('front', 40), ('back', 40)
-            rows = cur.list_cards(
-                session_id=(cur.get_session_id(session_name) if session_name else None),
-                deck_id   =(cur.get_deck_id   (deck_name   ) if deck_name    else None),
-                contains_text=contains_text)
+            session_id = cur.get_session_id(session_name) if session_name else None
+            deck_id    = cur.get_deck_id   (deck_name   ) if deck_name    else None
+            if contains_text is not None and after_id is None and limit is None:
+                # ranked by relevance
+                rows = cur.search_cards(contains_text, session_id=session_id, deck_id=deck_id)
+            else:
+                # streamed one page at a time, in id order
+                rows = chain.from_iterable(cur.iter_cards(
+                    session_id=session_id,
+                    deck_id=deck_id,
+                    contains_text=contains_text,
+                    after_id=after_id,
+                    limit=limit,
+                    page_size=page_size))
         elif list_type == 'macros':
             cols = ('id', 5), ('name', 20), ('definition', 60)
             rows = cur.list_macros()
         else:
             return -1
-    print_table(cols, rows)
+        print_table(cols, rows)
     return 0
 
-def cmd_modify(db_path: str, item_type: str, item_id: int) -> int:
-    db = Database(db_path)
-
+def cmd_modify(db: Database, item_type: str, item_id: int) -> int:
     if item_type == 'session':
         with db as cur:
             all_decks = cur.list_decks()
@@ -129,7 +153,7 @@ def cmd_modify(db_path: str, item_type: str, item_id: int) -> int:
                 break
 
         if new_decks:
-            with db as cur:
+            with db.write() as cur:
                 cur.update_session_decks(item_id, new_decks)
 
     elif item_type == 'card':
@@ -137,9 +161,7 @@ def cmd_modify(db_path: str, item_type: str, item_id: int) -> int:
 
     return 0
 
-def cmd_create(db_path: str, item_type: str) -> int:
-    db = Database(db_path)
-
+def cmd_create(db: Database, item_type: str) -> int:
     if item_type == 'session':
         name = input('New session name: ')
 
@@ -156,7 +178,7 @@ def cmd_create(db_path: str, item_type: str) -> int:
             else:
                 break
 
-        with db as cur:
+        with db.write() as cur:
             session_id = cur.create_session(name)
             cur.add_session_decks(session_id, deck_ids)
 
@@ -166,7 +188,7 @@ def cmd_create(db_path: str, item_type: str) -> int:
     elif item_type == 'deck' or item_type == 'cards':
         name = input('Deck name: ')
         if item_type == 'deck':
-            with db as cur:
+            with db.write() as cur:
                 deck_id = cur.create_deck(name)
             print(f'Created deck "{name}"')
         else:
@@ -178,55 +200,51 @@ def cmd_create(db_path: str, item_type: str) -> int:
     elif item_type == 'macro':
         name       = input('New macro name: ')
         definition = input('New macro definition: ')
-        with db as cur:
+        with db.write() as cur:
             macro_id = cur.create_macro(name, definition)
         print(f'created macro {macro_id}: {name} => {definition}')
 
     return 0
 
-def cmd_delete(db_path: str, item_type: str, item_id: int) -> int:
-    db = Database(db_path)
-
+def cmd_delete(db: Database, item_type: str, item_id: int) -> int:
     if item_type == 'card':
-        with db as cur:
+        with db.write() as cur:
             cur.delete_card(item_id)
         print(f'Deleted card {item_id}')
 
     elif item_type == 'macro':
-        with db as cur:
+        with db.write() as cur:
             cur.delete_macro(item_id)
         print(f'Deleted macro {item_id}')
 
     return 0
 
-def cmd_import(db_path: str, deck_name: str, in_path: str, format: str) -> int:
-    with open(in_path, 'r', encoding='utf-8') as f:
-        if format == 'json':
-            cards = json.load(f)
-        elif format == 'csv':
-            cards = [(card['front'], card['back']) for card in csv.DictReader(f)]
+def cmd_import(db: Database, deck_name: str, in_path: str, format: str, batch_size: int) -> int:
+    with open(in_path, 'r', encoding='utf-8', newline='') as f:
+        size = os.fstat(f.fileno()).st_size
 
-    db = Database(db_path)
+        def on_progress(count: int):
+            percent = 100 * f.buffer.tell() // size if size else 100
+            sys.stderr.write(f'\rimported {count} cards ({percent}%)')
+            sys.stderr.flush()
 
-    with db as cur:
-        deck_id = cur.create_deck(deck_name)
-        cur.add_cards(deck_id, cards)
-    return 0
+        with db.write() as cur:
+            deck_id = cur.create_deck(deck_name)
+            count = import_cards(cur, deck_id, READERS[format](f), batch_size, on_progress)
 
-def cmd_export(db_path: str, deck_name: str, out_path: str, format: str) -> int:
-    db = Database(db_path)
+    sys.stderr.write('\n')
+    print(f'Imported {count} cards into "{deck_name}"')
+    return 0
 
+def cmd_export(db: Database, deck_name: str, out_path: str, format: str, compression: Optional[str]) -> int:
+    # a single read transaction gives a consistent snapshot of the deck,
+    # without blocking writers in WAL mode; the deck is looked up before the
+    # output is opened, so a missing deck doesn't truncate an existing file
     with db as cur:
         deck_id = cur.get_deck_id(deck_name)
-        cards = [(front, back) for _, _, front, back in cur.list_cards(deck_id=deck_id)]
-
-    with open(out_path, 'w', encoding='utf-8') as f:
-        if format == 'json':
-            json.dump(cards, f, ensure_ascii=False, indent='\t')
-        elif format == 'csv':
-            writer = csv.DictWriter(f, ('front', 'back'))
-            writer.writeheader()
-            writer.writerows({'front': front, 'back': back} for front, back in cards)
+        with open_output(out_path, compression) as f:
+            count = WRITERS[format](f, cur.iter_deck_cards(deck_id))
+    print(f'Exported {count} cards from "{deck_name}"')
     return 0
 
 def run_editor(db: Database, deck_id: Optional[int] = None, card_id: Optional[int] = None) -> int:
@@ -276,7 +294,7 @@ def run_editor(db: Database, deck_id: Optional[int] = None, card_id: Optional[in
 
         LOG.info('on_submit %s, %s, %s', card_id, front, back)
 
-        with db as cur:
+        with db.write() as cur:
             if card_id is not None:
                 assert isinstance(card_id, int)
                 LOG.info('\tupdate existing card')
@@ -326,7 +344,7 @@ def run_editor(db: Database, deck_id: Optional[int] = None, card_id: Optional[in
             return -1
 
         with WinAnsiMode():
-            app = EditorApp(on_submit, on_scroll)
+            app = EditorApp(ConsoleTerminal(), on_submit, on_scroll)
             if card_id is not None:
                 scroll_to(card_id)
                 app.edit(card_id, front, back)
@@ -337,104 +355,188 @@ def run_editor(db: Database, deck_id: Optional[int] = None, card_id: Optional[in
 
     return main()
 
-def cmd_start(db_path: str, session_name: str, round_cards: int) -> int:
-    db = Database(db_path)
-
+def cmd_start(
+    db: Database,
+    session_name: str,
+    round_cards: int,
+    write_behind: bool,
+    flush_interval_s: float
+) -> int:
     load_macros(db)
 
+    # answers left over from a write-behind session that didn't exit cleanly
+    AnswerBuffer.replay(db)
+
     with db as cur:
         session_id = cur.get_session_id(session_name)
 
     app: Optional[PracticeApp] = None
-    ready: List[Tuple[int, str, str, str, int]] = []
-    current = None
-    done: List[Tuple[int, int]] = []
+    round_ = PracticeRound(session_id, round_cards)
+    buffer = AnswerBuffer(db, flush_interval_s) if write_behind else None
 
     def next_question():
-        nonlocal app, ready, current, done
+        nonlocal app, round_
         assert app is not None
 
-        current = None
-
-        if ready:
-            current = ready.pop()
-            card_id, deck_name, front, back, streak = current
-            prefix = f'[{card_id}, {deck_name}] '
-            app.update_question(prefix + front, len(done) + 1, len(ready) + len(done) + 1)
-        elif done:
+        card = round_.next()
+        if card:
+            card_id, deck_name, front, back, streak = card
+            app.update_question(front, round_.number, round_.total, f'[{card_id}, {deck_name}]')
+        elif round_.done:
             app.update_question('Continue? [Y/N]', 0, 0)
         else:
             app.update_question('No cards to review.\n(Add more! :D)', 0, 0)
 
     def start_round():
-        nonlocal app, ready, current, done
+        nonlocal app, round_
         assert app is not None
 
-        ready   = []
-        current = None
-        done    = []
+        if buffer:
+            buffer.flush()
 
         app.clear_history()
-        with db as cur:
-            cur.increment_session_counter(session_id)
-            review_cards = cur.get_review_cards(session_id, round_cards)
-            new_cards = cur.get_new_cards(session_id, round_cards - len(review_cards))
-        ready += [(card_id, deck_name, front, back, streak) for card_id, deck_name, front, back, streak in review_cards]
-        ready += [(card_id, deck_name, front, back,      0) for card_id, deck_name, front, back         in new_cards   ]
-        shuffle(ready)
+        db.retry(round_.start)
+        # outside the round's write transaction
+        prefetch_layouts(db, (front for _, _, front, _, _ in round_.ready), *FRONT_LAYOUT)
 
         next_question()
 
-    def normalize(s: str) -> str:
-        return ' '.join(unicodedata.normalize('NFKD', s).lower().split())
-
     def update_card(card_id: int, streak: int, result: QuestionResult):
-        with db as cur:
-            if result == RESULT_PASS:
-                streak += 1
-                if streak > 31:
-                    streak = 31
-                counter = cur.get_session_counter(session_id)
-                review_at = counter + 2**streak
-            else:
-                streak = 0
-                review_at = None
-            cur.update_session_card(session_id, card_id, streak, review_at)
+        if buffer:
+            # the counter only changes in start_round, which flushes first
+            buffer.add(session_id, card_id, *schedule(round_.counter, streak, result))
+            return
+
+        def update(cur: Cursor):
+            streak_, review_at = schedule(cur.get_session_counter(session_id), streak, result)
+            cur.update_session_card(session_id, card_id, streak_, review_at)
+
+        db.retry(update)
 
     def on_submit(answer: str) -> bool:
-        nonlocal app, ready, current, done
+        nonlocal app, round_
         assert app is not None
 
-        if current:
-            card_id, deck_name, front, back, streak = current
-            done.append((card_id, streak))
-            result = RESULT_PASS if normalize(back) == normalize(answer) else RESULT_FAIL
+        if round_.current:
+            (card_id, deck_name, front, back, streak), result = round_.answer(answer)
             app.push_history(card_id, result, front, back, answer)
             update_card(card_id, streak, result)
             next_question()
-        elif normalize(answer) in ('y', 'yes'):
+        elif normalize_answer(answer) in ('y', 'yes'):
             start_round()
-        elif normalize(answer) in ('n', 'no'):
+        elif normalize_answer(answer) in ('n', 'no'):
             return False
         return True
 
     def on_revise(card_id: Any, result: QuestionResult):
-        nonlocal app, ready, current, done
+        nonlocal app, round_
         assert app is not None
 
         assert isinstance(card_id, int)
-        streak = next(streak for card_id_, streak in done if card_id_ == card_id)
-        update_card(card_id, streak, result)
+        update_card(card_id, round_.streak(card_id), result)
+
+    try:
+        with WinAnsiMode():
+            term = ConsoleTerminal()
+            app = PracticeApp(term, on_submit, on_revise)
+            start_round()
+            term.flush()
+            return app.main()
+    finally:
+        if buffer:
+            buffer.close()
+
+def cmd_backup(db: Database, dest_path: str, pages: int, sleep_s: float, full_check: bool) -> int:
+    def on_progress(copied: int, total: int):
+        sys.stderr.write(f'\rcopied {copied} of {total} pages')
+        sys.stderr.flush()
+
+    try:
+        backup(db, dest_path, pages, sleep_s, full_check, on_progress)
+    except BackupError as e:
+        sys.stderr.write(f'\n{e}\n')
+        return -1
+    sys.stderr.write('\n')
+    print(f'Backed up to "{dest_path}" (verified)')
+    return 0
+
+def print_storage_stats(stats: StorageStats):
+    def kib(size: Optional[int]) -> str:
+        return '' if size is None else f'{size / 1024:.1f}'
+    print_table(
+        (('table', 20), ('name', 36), ('rows', 9), ('pages', 7), ('KiB', 10), ('unused KiB', 10)),
+        ((t.table, t.name, '' if t.rows is None else t.rows, '' if t.pages is None else t.pages,
+            kib(t.size), kib(t.unused)) for t in stats.tables))
+    mode = ('none', 'full', 'incremental')[stats.auto_vacuum]
+    print(f'{stats.page_count} pages of {stats.page_size} bytes ({kib(stats.size)} KiB), '
+        f'{stats.freelist_count} free ({kib(stats.free_size)} KiB), auto_vacuum={mode}')
+
+def cmd_maintain(db: Database, dry_run: bool, analyze: bool) -> int:
+    before = storage_stats(db)
+    print_storage_stats(before)
+    if before.auto_vacuum != AUTO_VACUUM_INCREMENTAL:
+        print('Converting to incremental auto_vacuum takes a full VACUUM (once)')
+    if dry_run:
+        print(f'Maintenance would reclaim up to {before.reclaimable() / 1024:.1f} KiB')
+        return 0
+    maintain(db, analyze)
+    after = storage_stats(db)
+    print(f'Database size {before.size / 1024:.1f} KiB -> {after.size / 1024:.1f} KiB '
+        f'({after.page_count} pages)')
+    return 0
 
-    with WinAnsiMode():
-        app = PracticeApp(on_submit, on_revise)
-        start_round()
-        sys.stdout.flush()
-        return app.main()
+def cmd_render(db: Database, deck_name: Optional[str], batch_size: int) -> int:
+    load_macros(db)
+    # see cmd_serve
+    logging.getLogger('flashcards_lib.markup').setLevel(logging.INFO)
+
+    deck_id = None
+    if deck_name:
+        with db as cur:
+            deck_id = cur.get_deck_id(deck_name)
+
+    # short transactions per batch, and none while laying out, so practice
+    # can go on in the meantime
+    after_id = None
+    count = 0
+    laid_out = 0
+    while True:
+        with db as cur:
+            cards = cur.list_cards(deck_id=deck_id, after_id=after_id, limit=batch_size, cached=False)
+            prefetch = LayoutPrefetch([front for _, _, front, _ in cards], *FRONT_LAYOUT)
+            prefetch.load(cur)
+        if not cards:
+            break
+        new_layouts = prefetch.compute()
+        if new_layouts:
+            laid_out += new_layouts
+            db.retry(prefetch.store)
+        count += len(cards)
+        after_id = cards[-1][0]
+        sys.stderr.write(f'\r{count} cards')
+        sys.stderr.flush()
+    sys.stderr.write('\n')
+    print(f'Laid out {laid_out} of {count} card fronts ({count - laid_out} were already stored)')
+    return 0
+
+def cmd_serve(path: str, profile: str, busy_timeout_s: float, host: str, port: int, max_readers: int) -> int:
+    # layout debug logs are buffered per call; with many threads sharing the
+    # buffer they'd be interleaved (and slow), so only keep warnings and up
+    logging.getLogger('flashcards_lib.markup').setLevel(logging.INFO)
+    return serve(path, profile, busy_timeout_s, host, port, max_readers)
+
+def cmd_serve_terminal(path: str, profile: str, busy_timeout_s: float, host: str, port: int) -> int:
+    # see cmd_serve
+    logging.getLogger('flashcards_lib.markup').setLevel(logging.INFO)
+    return serve_terminals(path, profile, busy_timeout_s, host, port)
 
 def main(argv: List[str]) -> int:
     parse = ArgumentParser()
     parse.add_argument('--db', required=True)
+    parse.add_argument('--db-profile', choices=tuple(PROFILES), default='durable',
+        help='sqlite performance profile (durable: fsync every commit, balanced: WAL, bulk: no fsync, for imports)')
+    parse.add_argument('--busy-timeout', type=float, default=5.0,
+        help='seconds to wait for other processes to release the database before giving up')
     commands = parse.add_subparsers(dest='cmd')
 
     list_args   = commands.add_parser('list'  , help='list items')
@@ -444,11 +546,19 @@ def main(argv: List[str]) -> int:
     import_args = commands.add_parser('import', help='import a deck')
     export_args = commands.add_parser('export', help='export a deck')
     start_args  = commands.add_parser('start' , help='start a session')
+    serve_args  = commands.add_parser('serve' , help='serve practice sessions over HTTP')
+    telnet_args = commands.add_parser('serve-terminal', help='serve the practice UI to telnet clients')
+    backup_args = commands.add_parser('backup', help='back up the database (while it is in use)')
+    render_args = commands.add_parser('render', help='lay out card fronts ahead of time, so practice starts faster')
+    maint_args  = commands.add_parser('maintain', help='reclaim free space and update query planner statistics')
 
     list_args.add_argument('type', choices=('sessions', 'decks', 'cards', 'macros'))
     list_args.add_argument('--in-session')
     list_args.add_argument('--in-deck')
     list_args.add_argument('--contains-text')
+    list_args.add_argument('--after', type=int, help='only list cards with IDs greater than this')
+    list_args.add_argument('--limit', type=int, help='maximum number of cards to list')
+    list_args.add_argument('--page-size', type=int, default=100, help='number of cards fetched per query')
 
     modify_args.add_argument('type', choices=('card', 'session'))
     modify_args.add_argument('--id', required=True, type=int)
@@ -462,29 +572,90 @@ def main(argv: List[str]) -> int:
 
     import_args.add_argument('deck')
     import_args.add_argument('path')
-    import_args.add_argument('--format', choices=('csv', 'json'), default='json')
+    import_args.add_argument('--format', choices=tuple(READERS), default='json')
+    import_args.add_argument('--batch-size', type=int, default=1000)
 
     export_args.add_argument('deck')
     export_args.add_argument('path')
-    export_args.add_argument('--format', choices=('csv', 'json'), default='json')
+    export_args.add_argument('--format', choices=tuple(WRITERS), default='json')
+    export_args.add_argument('--compress', choices=tuple(COMPRESSION))
 
     start_args.add_argument('session')
+    start_args.add_argument('--write-behind', action='store_true',
+        help='buffer answers in memory (and a journal file), writing them to the database in batches')
+    start_args.add_argument('--flush-interval', type=float, default=30.0,
+        help='maximum seconds between write-behind flushes')
+
+    serve_args.add_argument('--host', default='127.0.0.1')
+    serve_args.add_argument('--port', type=int, default=8080)
+    serve_args.add_argument('--readers', type=int, default=8,
+        help='maximum number of reader connections')
+
+    telnet_args.add_argument('--host', default='127.0.0.1')
+    telnet_args.add_argument('--port', type=int, default=2323)
+
+    backup_args.add_argument('path')
+    backup_args.add_argument('--pages', type=int, default=256,
+        help='pages copied at a time; other connections can use the database in between')
+    backup_args.add_argument('--sleep', type=float, default=0.01, help='seconds to pause between steps')
+    backup_args.add_argument('--full-check', action='store_true',
+        help='verify the backup with integrity_check rather than quick_check')
+
+    render_args.add_argument('--deck', help='only cards in this deck')
+    render_args.add_argument('--batch-size', type=int, default=500)
+
+    maint_args.add_argument('--dry-run', action='store_true',
+        help='only report storage use and estimate how much space would be reclaimed')
+    maint_args.add_argument('--analyze', action='store_true',
+        help='run a full ANALYZE rather than PRAGMA optimize')
+
+    for args_ in (start_args, serve_args, telnet_args):
+        args_.add_argument('--backup', metavar='PATH', help='periodically back up the database to this file')
+        args_.add_argument('--backup-interval', type=float, default=3600.0, help='seconds between backups')
 
     args = parse.parse_args(args=argv[1:])
+    if args.cmd is None:
+        return -1
+
+    with contextlib.ExitStack() as stack:
+        stack.callback(lambda: LOG.info('markup layout cache %s (hit rate %.2f)', LAYOUT_CACHE, LAYOUT_CACHE.hit_rate))
+        if getattr(args, 'backup', None):
+            stack.enter_context(PeriodicBackup(args.db, args.db_profile, args.backup, args.backup_interval))
+
+        if args.cmd == 'serve':
+            # the server manages its own connections
+            return cmd_serve(args.db, args.db_profile, args.busy_timeout, args.host, args.port, args.readers)
+        if args.cmd == 'serve-terminal':
+            return cmd_serve_terminal(args.db, args.db_profile, args.busy_timeout, args.host, args.port)
+
+        db = Database(args.db, args.db_profile, busy_timeout_s=args.busy_timeout)
+        try:
+            return run_command(db, args)
+        finally:
+            db.close()
+
+def run_command(db: Database, args: Namespace) -> int:
     if args.cmd == 'list':
-        return cmd_list(args.db, args.type, args.in_session, args.in_deck, args.contains_text)
+        return cmd_list(db, args.type, args.in_session, args.in_deck, args.contains_text,
+            args.after, args.limit, args.page_size)
     if args.cmd == 'modify':
-        return cmd_modify(args.db, args.type, args.id)
+        return cmd_modify(db, args.type, args.id)
     elif args.cmd == 'create':
-        return cmd_create(args.db, args.type)
+        return cmd_create(db, args.type)
     elif args.cmd == 'delete':
-        return cmd_delete(args.db, args.type, args.id)
+        return cmd_delete(db, args.type, args.id)
     elif args.cmd == 'import':
-        return cmd_import(args.db, args.deck, args.path, args.format)
+        return cmd_import(db, args.deck, args.path, args.format, args.batch_size)
     elif args.cmd == 'export':
-        return cmd_export(args.db, args.deck, args.path, args.format)
+        return cmd_export(db, args.deck, args.path, args.format, args.compress)
+    elif args.cmd == 'backup':
+        return cmd_backup(db, args.path, args.pages, args.sleep, args.full_check)
+    elif args.cmd == 'render':
+        return cmd_render(db, args.deck, args.batch_size)
+    elif args.cmd == 'maintain':
+        return cmd_maintain(db, args.dry_run, args.analyze)
     elif args.cmd == 'start':
-        return cmd_start(args.db, args.session, 10)
+        return cmd_start(db, args.session, 10, args.write_behind, args.flush_interval)
     else:
         return -1
     return 0
@@ -0,0 +1,205 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio, logging, queue, threading
+from concurrent.futures import Future
+from typing import Any, Callable, Iterator, List, Optional, Tuple, TypeVar
+
+from flashcards_lib.database import Cursor, Database
+
+LOG = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+Request = Tuple[Callable[[Cursor], Any], Future]
+QueuedRequest = Optional[Request] # None stops the worker
+
+# Cursor methods exposed as coroutines on AsyncDatabase
+CURSOR_METHODS = frozenset((
+    'list_sessions',
+    'list_decks',
+    'list_cards',
+    'iter_cards',
+    'search_cards',
+    'iter_deck_cards',
+    'get_deck_id',
+    'create_deck',
+    'get_card',
+    'update_card',
+    'add_card',
+    'add_cards',
+    'delete_card',
+    'get_session_id',
+    'create_session',
+    'get_session_counter',
+    'add_session_decks',
+    'get_session_decks',
+    'cleanup_session_cards',
+    'remove_session_decks',
+    'update_session_decks',
+    'get_new_cards',
+    'get_review_cards',
+    'increment_session_counter',
+    'update_session_card',
+    'update_session_cards',
+    'get_macro',
+    'create_macro',
+    'delete_macro',
+    'list_macros',
+    'get_render_cache',
+    'put_render_cache',
+    'invalidate_render_cache',
+    'clear_render_cache',
+))
+
+def fail(future: Future, e: BaseException):
+    if not future.done():
+        future.set_exception(e)
+
+class AsyncDatabase:
+    '''
+    asyncio facade for Database
+
+    All database work runs on one dedicated thread.  Requests queued while
+    it's busy are run together in a single transaction (each in its own
+    savepoint, so one failing request doesn't affect the others), which
+    amortizes commits across concurrent callers.
+
+        adb = AsyncDatabase(path)
+        cards = await adb.get_review_cards(session_id, 10)
+        counter = await adb.run(lambda cur: cur.get_session_counter(session_id))
+    '''
+
+    __slots__ = 'requests', 'thread', 'max_batch', 'lock', 'stopped'
+
+    requests: 'queue.Queue[QueuedRequest]'
+
+    def __init__(self, path: str, profile: str = 'balanced', max_batch: int = 64, **kwargs: Any):
+        self.requests  = queue.Queue()
+        self.max_batch = max_batch
+        # held to queue requests, and by the worker when it stops, so none are left behind
+        self.lock      = threading.Lock()
+        self.stopped   = False
+        opened: Future = Future()
+        self.thread = threading.Thread(
+            target=self.worker,
+            args=(path, profile, kwargs, opened),
+            name='AsyncDatabase',
+            daemon=True)
+        self.thread.start()
+        # surface errors opening the database here, rather than on first use
+        opened.result()
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        if name not in CURSOR_METHODS:
+            raise AttributeError(name)
+        async def method(*args: Any, **kwargs: Any) -> Any:
+            return await self.run(lambda cur: getattr(cur, name)(*args, **kwargs))
+        method.__name__ = name
+        return method
+
+    async def run(self, f: Callable[[Cursor], T]) -> T:
+        '''runs f(cursor) in a transaction on the database thread'''
+        future: Future = Future()
+        with self.lock:
+            if self.stopped:
+                raise Exception('the database thread has stopped')
+            self.requests.put((f, future))
+        return await asyncio.wrap_future(future)
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        if not self.thread.is_alive():
+            return
+        self.requests.put(None)
+        self.thread.join()
+
+    def worker(self, path: str, profile: str, kwargs: Any, opened: Future):
+        try:
+            db = Database(path, profile, **kwargs)
+        except BaseException as e:
+            opened.set_exception(e)
+            return
+        opened.set_result(None)
+
+        try:
+            while True:
+                request = self.requests.get()
+                if request is None:
+                    break
+                batch = [request]
+                while len(batch) < self.max_batch:
+                    try:
+                        request = self.requests.get_nowait()
+                    except queue.Empty:
+                        break
+                    if request is None:
+                        self.requests.put(None)
+                        break
+                    batch.append(request)
+                self.run_batch(db, batch)
+        finally:
+            db.close()
+            with self.lock:
+                self.stopped = True
+            while True:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not None:
+                    fail(request[1], Exception('the database thread has stopped'))
+
+    @staticmethod
+    def run_batch(db: Database, batch: List[Request]):
+        results: List[Tuple[Future, bool, Any]] = []
+        try:
+            try:
+                with db.write() as cur:
+                    for f, future in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        cur.cur.execute('SAVEPOINT request')
+                        try:
+                            result = f(cur)
+                            if isinstance(result, Iterator):
+                                # generators can't be consumed outside this thread (or transaction)
+                                result = [*result]
+                        except Exception as e:
+                            cur.cur.execute('ROLLBACK TO request')
+                            if db.cache is not None:
+                                # the cache may hold values from the rolled back request
+                                db.cache.clear()
+                            results.append((future, False, e))
+                        else:
+                            results.append((future, True, result))
+                        cur.cur.execute('RELEASE request')
+            except Exception as e:
+                LOG.exception('failed to commit batch of %d requests', len(batch))
+                for _, future in batch:
+                    fail(future, e)
+                return
+            for future, ok, value in results:
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+        finally:
+            # a BaseException (e.g. KeyboardInterrupt from a request) stops the
+            # worker, and rolled back the whole batch
+            for _, future in batch:
+                fail(future, Exception('the database thread was interrupted'))
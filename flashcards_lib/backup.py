@@ -0,0 +1,149 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging, os, sqlite3, threading, time
+from typing import Callable, Optional
+
+from flashcards_lib.database import Database
+
+LOG = logging.getLogger(__name__)
+
+class BackupError(Exception):
+    __slots__ = ()
+
+class BackupRestarted(Exception):
+    __slots__ = ()
+
+# incremental copies restarted this many times (because other connections
+# kept writing) are finished in one step instead
+MAX_RESTARTS = 3
+
+def verify(path: str, full: bool = False) -> None:
+    '''raises BackupError unless the database at path passes quick_check (or integrity_check, if full)'''
+    db = sqlite3.connect(path)
+    try:
+        check = 'integrity_check' if full else 'quick_check'
+        problems = [row[0] for row in db.execute(f'PRAGMA {check}')]
+    finally:
+        db.close()
+    if problems != ['ok']:
+        raise BackupError(f'{check} failed for {path}: ' + '; '.join(problems[:10]))
+
+def backup(
+    db: Database,
+    dest_path: str,
+    pages: int = 256,
+    sleep_s: float = 0.01,
+    full_check: bool = False,
+    on_progress: Optional[Callable[[int, int], None]] = None
+) -> None:
+    '''
+    copies db to dest_path while it stays in use
+
+    The copy is made "pages" pages at a time, sleeping sleep_s in between so
+    other connections get a turn at the database.  sqlite restarts the copy
+    whenever another connection writes to the database in between, so after
+    MAX_RESTARTS the rest is copied in one step: in WAL mode that doesn't
+    block writers, otherwise they wait (up to their busy timeout) for it.
+
+    The copy is written next to dest_path and checked before it replaces
+    dest_path, so dest_path is always either the previous backup or a
+    complete, verified new one.
+    '''
+    tmp_path = dest_path + '.tmp'
+    copied = 0
+    restarts = 0
+
+    def progress(status: int, remaining: int, total: int):
+        nonlocal copied, restarts
+        # a restarted copy makes no progress
+        if total - remaining <= copied:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise BackupRestarted()
+        copied = total - remaining
+        if on_progress:
+            on_progress(copied, total)
+        if remaining and sleep_s > 0:
+            time.sleep(sleep_s)
+
+    def copy(pages: int):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        dest = sqlite3.connect(tmp_path)
+        try:
+            db.db.backup(dest, pages=pages, progress=progress)
+        finally:
+            dest.close()
+
+    start_s = time.perf_counter()
+    try:
+        try:
+            copy(pages)
+        except BackupRestarted:
+            LOG.info('backup restarted %d times, copying the rest in one step', restarts)
+            copy(-1)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    try:
+        verify(tmp_path, full_check)
+    except:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, dest_path)
+    LOG.info('backed up %s to %s in %.3fs', db.path, dest_path, time.perf_counter() - start_s)
+
+class PeriodicBackup:
+    '''
+    backs up a database every interval_s seconds from a background thread,
+    on its own connection
+
+        with PeriodicBackup(path, 'balanced', dest_path, 3600.0):
+            ...
+    '''
+
+    __slots__ = 'path', 'profile', 'dest_path', 'interval_s', 'kwargs', 'stop', 'thread'
+
+    def __init__(self, path: str, profile: str, dest_path: str, interval_s: float, **kwargs):
+        self.path       = path
+        self.profile    = profile
+        self.dest_path  = dest_path
+        self.interval_s = interval_s
+        self.kwargs     = kwargs # for backup()
+        self.stop       = threading.Event()
+        self.thread     = threading.Thread(target=self.run, name='PeriodicBackup', daemon=True)
+
+    def __enter__(self) -> 'PeriodicBackup':
+        self.thread.start()
+        return self
+
+    def __exit__(self, type_, value, tb):
+        self.stop.set()
+        self.thread.join()
+
+    def run(self):
+        db = Database(self.path, self.profile, cache_size=0)
+        try:
+            while not self.stop.wait(self.interval_s):
+                try:
+                    backup(db, self.dest_path, **self.kwargs)
+                except (sqlite3.Error, OSError, BackupError):
+                    # keep trying; the previous backup is still in place
+                    LOG.exception('periodic backup to %s failed', self.dest_path)
+        finally:
+            db.close()
@@ -15,7 +15,6 @@
 
 import ctypes, logging, sys, time
 from ctypes.wintypes import DWORD
-from msvcrt import getwch, kbhit # type: ignore
 from typing import Callable, List, Optional, Tuple, Union
 
 LOG = logging.getLogger(__name__)
@@ -24,12 +23,14 @@ Box = Tuple[int, int, int, int]
 
 import flashcards_lib.markup as markup
 from flashcards_lib.ansi_esc import *
+from flashcards_lib.terminal import Terminal, is_special_key
 from flashcards_lib.util import char_width, unicode_width, line_break_opportunities
 
 STD_OUTPUT_HANDLE = -11
 ENABLE_VIRTUAL_TERMINAL_PROCESSING = 4
 
-kernel32 = ctypes.windll.kernel32
+if sys.platform == 'win32':
+    kernel32 = ctypes.windll.kernel32
 
 class WinAnsiMode:
     __slots__ = 'outdev', 'mode'
@@ -46,8 +47,6 @@ class WinAnsiMode:
 
 ASCII_BACKSPACE = '\x08'
 ASCII_ESC    = '\x1b'
-MS_KEY_ESC0  = '\x00'
-MS_KEY_ESC1  = '\xe0'
 MS_KEY_UP    = '\x48'
 MS_KEY_LEFT  = '\x4b'
 MS_KEY_RIGHT = '\x4d'
@@ -59,6 +58,7 @@ MS_KEY_PAGE_DOWN = '\x51'
 
 class Formatter:
     __slots__ = (
+        'term',
         '__row',
         '__col',
         '__rows',
@@ -75,6 +75,7 @@ class Formatter:
     __error_ranges: List[Tuple[int, bool]]
 
     def __init__(self,
+        term: Terminal,
         row: int,
         col: int,
         rows: int,
@@ -83,6 +84,7 @@ class Formatter:
         center_v: bool,
         style: str = ''
     ):
+        self.term = term
         self.__row = row
         self.__col = col
         self.__rows = rows
@@ -123,7 +125,7 @@ class Formatter:
         line_break = 0
         line_width = 0
 
-        maybe_break_after = line_break_opportunities(self.__text)
+        maybe_break_after = line_break_opportunities(self.__text).flags(len(self.__text))
         while line_start < len(self.__text):
             line_end = line_start + 1
             while line_end < len(self.__text):
@@ -201,7 +203,8 @@ class Formatter:
         return out_row, out_col
 
     def redraw(self):
-        sys.stdout.write(ANSI_SAVE + self.style)
+        write = self.term.write
+        write(ANSI_SAVE + self.style)
 
         n = len(self.lines)
 
@@ -212,11 +215,11 @@ class Formatter:
         error_index = 0
         error_depth = 0
         for i in range(self.__rows):
-            sys.stdout.write(ansi_pos(self.__row + i, self.__col))
+            write(ansi_pos(self.__row + i, self.__col))
 
             j = i - row_offset
             if j < 0 or j >= n:
-                sys.stdout.write(' ' * self.__cols)
+                write(' ' * self.__cols)
                 continue
 
             start, end, width = self.lines[j]
@@ -227,9 +230,9 @@ class Formatter:
                 lpad = 0
             rpad = self.__cols - lpad - width
 
-            sys.stdout.write(' '*lpad)
+            write(' '*lpad)
             if error_depth > 0:
-                sys.stdout.write(ANSI_RED + ANSI_UNDERLINE)
+                write(ANSI_RED + ANSI_UNDERLINE)
 
             while error_index < len(self.error_ranges):
                 k, is_error_start = self.error_ranges[error_index]
@@ -238,36 +241,36 @@ class Formatter:
 
                 error_index += 1
 
-                sys.stdout.write(self.__text[start:k])
+                write(self.__text[start:k])
                 start = k
 
                 if is_error_start:
                     error_depth += 1
                     if error_depth == 1:
-                        sys.stdout.write(ANSI_RED + ANSI_UNDERLINE)
+                        write(ANSI_RED + ANSI_UNDERLINE)
                 else:
                     error_depth -= 1
                     if error_depth == 0:
-                        sys.stdout.write(ANSI_RESET + self.style)
+                        write(ANSI_RESET + self.style)
 
-            sys.stdout.write(self.__text[start:end])
+            write(self.__text[start:end])
             if error_depth > 0:
-                sys.stdout.write(ANSI_RESET + self.style)
-            sys.stdout.write(' '*rpad)
+                write(ANSI_RESET + self.style)
+            write(' '*rpad)
 
         if self.__rows < n:
             m = min(self.__cols, 3)
-            sys.stdout.write(
+            write(
                 ansi_pos(
                     self.__row + self.__rows - 1,
                     self.__col + self.__cols - m
                 ) + '.'*m)
 
-        sys.stdout.write(ANSI_RESET + ANSI_RESTORE)
-        sys.stdout.flush()
+        write(ANSI_RESET + ANSI_RESTORE)
 
 class MarkupDrawer:
     __slots__ = (
+        'term',
         '__row',
         '__col',
         '__rows',
@@ -284,6 +287,7 @@ class MarkupDrawer:
     __quirks: List[Tuple[str, Optional[str], Optional[Tuple[int, int]]]]
 
     def __init__(self,
+        term: Terminal,
         row: int,
         col: int,
         rows: int,
@@ -291,6 +295,7 @@ class MarkupDrawer:
         center_h: bool,
         center_v: bool
     ):
+        self.term = term
         self.__row = row
         self.__col = col
         self.__rows = rows
@@ -317,9 +322,7 @@ class MarkupDrawer:
 
         self.__modified = False
 
-        tokens = markup.tokenize(self.__text)
-        tokens = markup.normalize(tokens)
-        self.__quirks, group = markup.layout(tokens, self.__cols, self.__center_h)
+        self.__quirks, group = markup.layout_text(self.__text, self.__cols, self.__center_h)
 
         x_offset = 0
         y_offset = self.__rows - group.box.height
@@ -343,15 +346,15 @@ class MarkupDrawer:
         return [range_ for description, scope, range_ in self.__quirks if scope is None and range_]
 
     def redraw(self):
-        sys.stdout.write(ANSI_SAVE + self.style)
+        write = self.term.write
+        write(ANSI_SAVE + self.style)
         for row in range(self.__rows):
-            sys.stdout.write(ansi_pos(row + self.__row, self.__col) + ' ' * self.__cols)
+            write(ansi_pos(row + self.__row, self.__col) + ' ' * self.__cols)
         for item in self.draw_list:
             row = self.__row + self.__rows - item.y - 1
             col = self.__col + item.x
-            sys.stdout.write(ansi_pos(row, col) + item.text)
-        sys.stdout.write(ANSI_RESTORE + ANSI_RESET)
-        sys.stdout.flush()
+            write(ansi_pos(row, col) + item.text)
+        write(ANSI_RESTORE + ANSI_RESET)
 
 class Input:
     class Event:
@@ -365,17 +368,18 @@ class Input:
     TAB       = Event()
     TIMEOUT   = Event()
 
-    __slots__ = '__text', 'cursor', 'formatter'
+    __slots__ = 'term', '__text', 'cursor', 'formatter'
 
-    def __init__(self, box: Box):
+    def __init__(self, term: Terminal, box: Box):
+        self.term        = term
         self.__text       = u''
         self.cursor      = 0
-        self.formatter   = Formatter(*box, False, False)
+        self.formatter   = Formatter(term, *box, False, False)
 
     def update_cursor(self):
         self.formatter.text = self.__text
         row, col = self.formatter.global_cursor_pos(self.cursor)
-        sys.stdout.write(ansi_pos(row, col))
+        self.term.write(ansi_pos(row, col))
 
     def redraw_input(self):
         self.formatter.text = self.__text
@@ -384,12 +388,10 @@ class Input:
     def focus(self):
         self.formatter.style = ansi_rgb24_bg(40, 40, 40)
         self.redraw_input()
-        sys.stdout.flush()
 
     def unfocus(self):
         self.formatter.style = ''
         self.redraw_input()
-        sys.stdout.flush()
 
     @property
     def text(self) -> str:
@@ -407,28 +409,33 @@ class Input:
         on_timeout: Optional[Callable[[str], bool]] = None
     ) -> Union[Event, str]:
         self.focus()
+        self.term.flush()
         last_key_s: Optional[float] = None
         while True:
             if timeout_s is not None:
                 time.sleep(0.0001)
                 time_s = time.perf_counter()
-                if kbhit():
+                if self.term.kbhit():
                     last_key_s = time_s
-                    result = self.process_char()
+                    result = self.process_key(self.term.getkey())
+                    self.term.flush()
                     if result is not None:
                         return result
                 elif last_key_s is not None and time_s > last_key_s + timeout_s:
                     assert on_timeout is not None
                     if on_timeout(self.text):
                         return Input.TIMEOUT
+                    self.term.flush()
                     last_key_s = None
             else:
-                result = self.process_char()
+                result = self.process_key(self.term.getkey())
+                self.term.flush()
                 if result is not None:
                     return result
 
-    def process_char(self) -> Optional[Union[Event, str]]:
-        char = getwch()
+    def process_key(self, key: str) -> Optional[Union[Event, str]]:
+        '''handles one key (as returned by Terminal.getkey); returns an event, the submitted text, or None'''
+        char = key[0]
         if char == ASCII_ESC:
             self.unfocus()
             return Input.UNFOCUS
@@ -445,7 +452,6 @@ class Input:
             self.text = ''
             self.update_cursor()
             self.redraw_input()
-            sys.stdout.flush()
             return result
         elif char == ASCII_BACKSPACE:
             if self.cursor > 0:
@@ -453,8 +459,8 @@ class Input:
                 self.text = self.text[:self.cursor] + self.text[self.cursor + 1:]
                 self.update_cursor()
                 self.redraw_input()
-        elif char == MS_KEY_ESC0 or char == MS_KEY_ESC1:
-            char2 = getwch()
+        elif is_special_key(key):
+            char2 = key[1:]
             if char2 == MS_KEY_UP:
                 self.unfocus()
                 return Input.KEY_UP
@@ -490,5 +496,4 @@ class Input:
             self.cursor += 1
             self.update_cursor()
             self.redraw_input()
-        sys.stdout.flush()
         return None
\ No newline at end of file
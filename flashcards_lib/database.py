@@ -13,10 +13,58 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import contextlib, os, sqlite3
-from typing import Any, Dict, List, Optional, Tuple, Sequence
+import contextlib, hashlib, logging, os, random, sqlite3, threading, time
+from itertools import product
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Sequence, TypeVar, Union
 
-DB_SCHEMA = ('''
+from flashcards_lib.lru import LruCache
+
+LOG = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+CARDS_FTS_INSERT_TRIGGER = '''
+CREATE TRIGGER cards_fts_insert AFTER INSERT ON cards BEGIN
+    INSERT INTO cards_fts (rowid, front, back) VALUES (new.id, new.front, new.back);
+END'''
+
+CARDS_FTS_SCHEMA = ('''
+CREATE VIRTUAL TABLE cards_fts USING fts5(
+    front,
+    back,
+    content='cards',
+    content_rowid='id',
+    tokenize='trigram'
+)''', CARDS_FTS_INSERT_TRIGGER, '''
+CREATE TRIGGER cards_fts_delete AFTER DELETE ON cards BEGIN
+    INSERT INTO cards_fts (cards_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back);
+END''', '''
+CREATE TRIGGER cards_fts_update AFTER UPDATE OF front, back ON cards BEGIN
+    INSERT INTO cards_fts (cards_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back);
+    INSERT INTO cards_fts (rowid, front, back) VALUES (new.id, new.front, new.back);
+END''', '''
+INSERT INTO cards_fts (cards_fts) VALUES ('rebuild')''')
+
+# FTS5 (and its trigram tokenizer, sqlite >= 3.34) is an optional sqlite
+# feature; without it, text searches fall back to LIKE
+def create_cards_fts(cur: sqlite3.Cursor):
+    try:
+        cur.execute("CREATE VIRTUAL TABLE temp.fts_probe USING fts5(x, tokenize='trigram')")
+        cur.execute('DROP TABLE temp.fts_probe')
+    except sqlite3.OperationalError as e:
+        LOG.warning('full-text search unavailable: %s', e)
+        return
+    for statement in CARDS_FTS_SCHEMA:
+        cur.execute(statement)
+
+Migration = Union[str, Callable[[sqlite3.Cursor], None]]
+
+# Each entry upgrades the schema by one version; the current version is stored
+# in PRAGMA user_version.  Append new entries, never edit existing ones.
+# (Version 1 uses "IF NOT EXISTS" since it predates versioning.)
+MIGRATIONS: Tuple[Tuple[Migration, ...], ...] = (
+# 1: initial schema
+('''
 CREATE TABLE IF NOT EXISTS decks (
     id   INTEGER NOT NULL PRIMARY KEY,
     name TEXT NOT NULL UNIQUE
@@ -53,13 +101,170 @@ CREATE TABLE IF NOT EXISTS macros (
     id         INTEGER NOT NULL PRIMARY KEY,
     name       TEXT    NOT NULL UNIQUE,
     definition TEXT    NOT NULL
-)''')
+)'''),
+# 2: indexes
+('''
+CREATE INDEX IF NOT EXISTS cards_deck_id
+    ON cards (deck_id, id)''', '''
+CREATE INDEX IF NOT EXISTS session_cards_review_at
+    ON session_cards (session_id, review_at)''', '''
+CREATE INDEX IF NOT EXISTS session_cards_card_id
+    ON session_cards (card_id)'''),
+# 3: full-text index (optional)
+(create_cards_fts,),
+# 4: new-card frontier; every card in the deck with id <= new_after has been
+#    seen in the session, so new cards can be found with a range query.
+#    new_after is always 0 or one of the deck's own cards (see
+#    Cursor.advance_new_card_frontier)
+('''
+ALTER TABLE session_decks ADD COLUMN new_after INTEGER NOT NULL DEFAULT 0''', '''
+CREATE INDEX session_decks_deck_id
+    ON session_decks (deck_id)'''),
+# 5: incremental auto_vacuum; this only takes effect on existing databases
+#    with the next VACUUM, which "maintain" runs (see maintenance.maintain)
+('''
+PRAGMA auto_vacuum = INCREMENTAL''',),
+# 6: laid out markup (see render_cache.py), by text_hash(text); macro_hash
+#    identifies the macros (and layout code) it was laid out with
+('''
+CREATE TABLE render_cache (
+    text_hash  BLOB    NOT NULL,
+    width      INTEGER NOT NULL,
+    center     INTEGER NOT NULL,
+    macro_hash BLOB    NOT NULL,
+    layout     TEXT    NOT NULL,
+    PRIMARY KEY (text_hash, width, center, macro_hash)
+) WITHOUT ROWID''',),
+)
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# PRAGMA auto_vacuum value
+AUTO_VACUUM_INCREMENTAL = 2
+
+class Profile:
+    __slots__ = 'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store'
+
+    def __init__(self,
+        journal_mode: Optional[str], # None keeps the database's own
+        synchronous : str,
+        mmap_size   : int,
+        cache_size  : int,
+        temp_store  : str
+    ):
+        self.journal_mode = journal_mode
+        self.synchronous  = synchronous
+        self.mmap_size    = mmap_size
+        self.cache_size   = cache_size
+        self.temp_store   = temp_store
+
+    def apply(self, db: sqlite3.Connection):
+        # the journal mode is persistent, and changing it needs an exclusive
+        # lock, so profiles that don't care leave it alone (a database that
+        # was once opened as WAL stays WAL)
+        if self.journal_mode is not None:
+            journal_mode = db.execute(f'PRAGMA journal_mode = {self.journal_mode}').fetchone()[0]
+            # in-memory databases always report "memory"
+            if journal_mode.lower() not in (self.journal_mode.lower(), 'memory'):
+                LOG.warning('failed to set journal_mode %s (using %s)', self.journal_mode, journal_mode)
+        db.execute(f'PRAGMA synchronous = {self.synchronous}')
+        db.execute(f'PRAGMA mmap_size = {self.mmap_size}')
+        db.execute(f'PRAGMA cache_size = {self.cache_size}')
+        db.execute(f'PRAGMA temp_store = {self.temp_store}')
+
+# cache_size is given in KiB when negative (see sqlite docs)
+PROFILES: Dict[str, Profile] = {
+    # fsync on every commit (sqlite defaults); keeps the journal mode, so new databases use a rollback journal
+    'durable' : Profile(None    , 'FULL'  ,         0,  -2000, 'DEFAULT'),
+    # WAL only syncs on checkpoint; a power loss may drop the last commits, but not corrupt
+    'balanced': Profile('WAL'   , 'NORMAL', 256 << 20, -16000, 'MEMORY' ),
+    # for large imports; no syncs at all
+    'bulk'    : Profile('WAL'   , 'OFF'   , 256 << 20, -64000, 'MEMORY' ),
+}
+
+# text search modes
+CONTAINS_LIKE = 'like'
+CONTAINS_FTS  = 'fts'
+
+# the trigram tokenizer can't match fewer than 3 characters
+FTS_MIN_LENGTH = 3
+
+# statements with one parameter per item take at most this many items at a
+# time; older sqlite builds allow no more than 999 parameters per statement
+MAX_IN_PARAMS = 500
+
+def in_chunks(items: Sequence[T]) -> Iterator[Sequence[T]]:
+    for i in range(0, len(items), MAX_IN_PARAMS):
+        yield items[i:i + MAX_IN_PARAMS]
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode('utf-8')).digest()[:16]
+
+def fts_phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+def list_cards_query(
+    session_id: bool,
+    deck_id: bool,
+    contains_text: Optional[str],
+    before_id: bool,
+    after_id: bool,
+    limit: bool,
+    get_tail: bool
+) -> str:
+    query = 'SELECT * FROM cards'
+    ordering = 'ORDER BY id DESC' if get_tail else 'ORDER BY id ASC'
+    where: List[str] = []
+    if session_id:
+        where += ['(id IN (SELECT card_id FROM session_cards WHERE session_id=:session_id))']
+    if deck_id:
+        where += ['(deck_id=:deck_id)']
+    if contains_text == CONTAINS_FTS:
+        where += ['(id IN (SELECT rowid FROM cards_fts WHERE cards_fts MATCH :contains_text))']
+    elif contains_text == CONTAINS_LIKE:
+        where += ['(front LIKE :contains_text OR back LIKE :contains_text)']
+    if before_id:
+        ordering = 'ORDER BY id DESC'
+        where += ['(id < :before_id)']
+    if after_id:
+        ordering = 'ORDER BY id ASC'
+        where += ['(id > :after_id)']
+
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    query += ' ' + ordering
+
+    if limit:
+        query += ' LIMIT :limit'
+    return query
+
+# one query string per combination of list_cards filters, so the same
+# (cached) prepared statement is reused rather than re-formatting the query
+LIST_CARDS_QUERIES: Dict[Tuple[Any, ...], str] = {
+    (session_id, deck_id, contains_text, *flags): list_cards_query(session_id, deck_id, contains_text, *flags)
+    for session_id, deck_id, contains_text, flags in product(
+        (False, True),
+        (False, True),
+        (None, CONTAINS_LIKE, CONTAINS_FTS),
+        product((False, True), repeat=4))}
 
 class Cursor:
-    __slots__ = 'cur'
+    '''
+    If a cache is given, card rows, deck and session IDs, session counters,
+    and pages of a deck's cards (other than iter_cards') are cached; writes
+    made through this cursor invalidate the affected entries.
+    '''
+
+    __slots__ = 'cur', 'fts', 'cache', 'deck_generations'
+
+    deck_generations: Dict[int, int]
 
-    def __init__(self, cur: sqlite3.Cursor):
+    def __init__(self, cur: sqlite3.Cursor, fts: bool = False, cache: Optional[LruCache] = None):
         self.cur = cur
+        self.fts = fts
+        self.cache = cache
+        # bumped to invalidate every cached page of a deck at once; stale pages age out of the cache
+        self.deck_generations = {}
 
     def __del__(self):
         self.close()
@@ -92,50 +297,139 @@ class Cursor:
         before_id: Optional[int] = None,
         after_id: Optional[int] = None,
         limit: Optional[int] = None,
-        get_tail: Optional[bool] = None
+        get_tail: Optional[bool] = None,
+        cached: bool = True
     ) -> List[Tuple[int, int, str, str]]:
-        query = 'SELECT * FROM cards'
-        ordering = 'ORDER BY id DESC' if get_tail else 'ORDER BY id ASC'
-        where: List[str] = []
-        args: Dict[str, Any] = {}
-        if session_id is not None:
-            where += ['(id IN (SELECT card_id FROM session_cards WHERE session_id=:session_id))']
-            args = {**args, 'session_id': session_id}
-        if deck_id is not None:
-            where += ['(deck_id=:deck_id)']
-            args = {**args, 'deck_id': deck_id}
-        if contains_text is not None:
-            where += ['(front LIKE :contains_text OR back LIKE :contains_text)']
-            args = {**args, 'contains_text': '%'+contains_text+'%'}
-        if before_id is not None:
+        if before_id is not None or after_id is not None:
             assert get_tail is None
-            ordering = 'ORDER BY id DESC'
-            where += ['(id < :before_id)']
-            args = {**args, 'before_id': before_id}
-        if after_id is not None:
-            assert get_tail is None
-            ordering = 'ORDER BY id ASC'
-            where += ['(id > :after_id)']
-            args = {**args, 'after_id': after_id}
-
-        if where:
-            query += ' WHERE ' + ' AND '.join(where)
-        query += ' ' + ordering
 
-        if limit is not None:
-            query += ' LIMIT :limit'
-            args = {**args, 'limit': limit}
+        # only pages of a single deck are cached, since other queries depend on more than cards
+        key = None
+        if cached and self.cache is not None and deck_id is not None and session_id is None and contains_text is None:
+            key = ('cards', deck_id, self.deck_generations.get(deck_id, 0), before_id, after_id, limit, bool(get_tail))
+            cached = self.cache.get(key)
+            if cached is not LruCache.MISSING:
+                return [*cached]
 
-        self.cur.execute(query, args)
+        contains_mode, contains_arg = self.contains_text_mode(contains_text)
+        query = LIST_CARDS_QUERIES[
+            session_id    is not None,
+            deck_id       is not None,
+            contains_mode,
+            before_id     is not None,
+            after_id      is not None,
+            limit         is not None,
+            bool(get_tail)]
+        self.cur.execute(query, {
+            'session_id'   : session_id,
+            'deck_id'      : deck_id,
+            'contains_text': contains_arg,
+            'before_id'    : before_id,
+            'after_id'     : after_id,
+            'limit'        : limit})
         cards = self.cur.fetchall()
-        cards.sort(key = lambda card: card[0])
+        if after_id is None and (before_id is not None or get_tail):
+            cards.reverse()
+        if key is not None:
+            self.cache.put(key, (*cards,))
         return cards
 
+    def iter_cards(self,
+        session_id: Optional[int] = None,
+        deck_id: Optional[int] = None,
+        contains_text: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        page_size: int = 100
+    ) -> Iterator[List[Tuple[int, int, str, str]]]:
+        '''
+        yields pages of list_cards results in id order, using keyset
+        pagination on id
+
+        Pages aren't cached: a scan of a large deck would otherwise fill the
+        cache with pages that won't be read again.
+        '''
+        while limit is None or limit > 0:
+            n = page_size if limit is None else min(page_size, limit)
+            page = self.list_cards(
+                session_id=session_id,
+                deck_id=deck_id,
+                contains_text=contains_text,
+                after_id=after_id,
+                limit=n,
+                cached=False)
+            if not page:
+                break
+            yield page
+            if len(page) < n:
+                break
+            after_id = page[-1][0]
+            if limit is not None:
+                limit -= len(page)
+
+    def contains_text_mode(self, text: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+        if text is None:
+            return None, None
+        if self.fts and len(text) >= FTS_MIN_LENGTH:
+            return CONTAINS_FTS, fts_phrase(text)
+        return CONTAINS_LIKE, '%'+text+'%'
+
+    def search_cards(self,
+        text: str,
+        session_id: Optional[int] = None,
+        deck_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> List[Tuple[int, int, str, str]]:
+        '''like list_cards(contains_text=text), but ordered by relevance when full-text search is available'''
+        mode, arg = self.contains_text_mode(text)
+        if mode != CONTAINS_FTS:
+            return self.list_cards(session_id=session_id, deck_id=deck_id, contains_text=text, limit=limit)
+        self.cur.execute('''
+            SELECT cards.* FROM cards_fts
+                INNER JOIN cards ON
+                    cards.id = cards_fts.rowid
+                WHERE cards_fts MATCH :text
+                AND (:deck_id IS NULL OR cards.deck_id = :deck_id)
+                AND (:session_id IS NULL OR cards.id IN
+                    (SELECT card_id FROM session_cards WHERE session_id=:session_id))
+                ORDER BY cards_fts.rank
+                LIMIT coalesce(:limit, -1)''',
+            {'text': arg, 'session_id': session_id, 'deck_id': deck_id, 'limit': limit})
+        return self.cur.fetchall()
+
+    def iter_deck_cards(self, deck_id: int, batch_size: int = 1000) -> Iterator[Tuple[str, str]]:
+        '''streams (front, back) for every card in a deck, in id order'''
+        cur = self.cur.connection.cursor()
+        try:
+            cur.execute('SELECT front, back FROM cards WHERE deck_id=? ORDER BY id', (deck_id,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+
+    def invalidate_deck(self, deck_id: Optional[int]):
+        if self.cache is not None and deck_id is not None:
+            self.deck_generations[deck_id] = self.deck_generations.get(deck_id, 0) + 1
+
+    def invalidate_card(self, card_id: int, deck_id: Optional[int]):
+        if self.cache is None:
+            return
+        self.cache.discard(('card', card_id))
+        self.invalidate_deck(deck_id)
+
     def get_deck_id(self, name: str) -> int:
+        cached = self.cache.get(('deck', name)) if self.cache is not None else LruCache.MISSING
+        if cached is not LruCache.MISSING:
+            return cached
         self.cur.execute('SELECT id FROM decks WHERE name=?', (name,))
         deck = self.cur.fetchone()
         if not deck:
             raise Exception(f'no deck named {name} exists')
+        if self.cache is not None:
+            self.cache.put(('deck', name), deck[0])
         return deck[0]
 
     def create_deck(self, name: str) -> int:
@@ -143,10 +437,20 @@ class Cursor:
         return self.cur.lastrowid
 
     def get_card(self, card_id: int) -> Tuple[int, int, str, str]:
+        cached = self.cache.get(('card', card_id)) if self.cache is not None else LruCache.MISSING
+        if cached is not LruCache.MISSING:
+            return cached
         self.cur.execute('SELECT * FROM cards WHERE id == ?', (card_id,))
-        return self.cur.fetchone()
+        card = self.cur.fetchone()
+        if card and self.cache is not None:
+            self.cache.put(('card', card_id), card)
+        return card
 
     def update_card(self, card_id: int, front: str, back: str):
+        card = self.get_card(card_id)
+        if card:
+            self.invalidate_render_cache(card[2:])
+        self.invalidate_card(card_id, card[1] if card else None)
         self.cur.execute(
             'UPDATE cards SET front=:front, back=:back WHERE id=:card_id',
             {'card_id': card_id, 'front': front, 'back': back})
@@ -159,6 +463,7 @@ class Cursor:
             (deck_id, front, back))
         if self.cur.rowcount != 1:
             raise Exception('failed to create card')
+        self.invalidate_card(self.cur.lastrowid, deck_id)
         return self.cur.lastrowid
 
     def add_cards(self, deck: int, cards: Sequence[Tuple[str, str]]):
@@ -167,18 +472,64 @@ class Cursor:
             [(deck, front, back) for (front, back) in cards])
         if self.cur.rowcount != len(cards):
             raise Exception('failed to create card')
+        self.invalidate_deck(deck)
+
+    @contextlib.contextmanager
+    def deferred_fts_index(self, deck_id: int):
+        '''
+        indexes cards added to a deck within this block all at once at the end,
+        which is much faster than indexing one row at a time for large imports
+        (must be used inside a transaction, which is rolled back on error)
+        '''
+        if not self.fts:
+            yield
+            return
+        self.cur.execute('SELECT coalesce(max(id), 0) FROM cards')
+        max_id = self.cur.fetchone()[0]
+        self.cur.execute('DROP TRIGGER cards_fts_insert')
+        yield
+        self.cur.execute('''
+            INSERT INTO cards_fts (rowid, front, back)
+                SELECT id, front, back FROM cards
+                    WHERE deck_id=? AND id>?''',
+            (deck_id, max_id))
+        self.cur.execute(CARDS_FTS_INSERT_TRIGGER)
 
     def delete_card(self, card_id: int):
+        card = self.get_card(card_id)
+        if card:
+            self.invalidate_render_cache(card[2:])
+        self.invalidate_card(card_id, card[1] if card else None)
+        # ids may be reused after a delete, so the card can't stay behind any
+        # frontier: move them back to the deck's previous card.  (Frontiers
+        # are always 0 or one of their deck's cards, see
+        # advance_new_card_frontier, so other decks' aren't affected.)
+        self.cur.execute('''
+            UPDATE session_decks SET new_after = coalesce(
+                (
+                    SELECT max(cards.id) FROM cards
+                        WHERE cards.deck_id = session_decks.deck_id
+                        AND cards.id < :card_id
+                ),
+                0)
+                WHERE deck_id = (SELECT deck_id FROM cards WHERE id=:card_id)
+                AND new_after >= :card_id''',
+            {'card_id': card_id})
         self.cur.execute('DELETE FROM session_cards WHERE card_id=?', (card_id,))
         self.cur.execute('DELETE FROM cards WHERE id=?', (card_id,))
         if self.cur.rowcount != 1:
             raise Exception('failed to delete card')
 
     def get_session_id(self, name: str) -> int:
+        cached = self.cache.get(('session', name)) if self.cache is not None else LruCache.MISSING
+        if cached is not LruCache.MISSING:
+            return cached
         self.cur.execute('SELECT id FROM sessions WHERE name=?', (name,))
         session = self.cur.fetchone()
         if not session:
             raise Exception(f'no session named {name} exists')
+        if self.cache is not None:
+            self.cache.put(('session', name), session[0])
         return session[0]
 
     def create_session(self, name: str) -> int:
@@ -188,8 +539,14 @@ class Cursor:
         return self.cur.lastrowid
 
     def get_session_counter(self, session: int) -> int:
+        cached = self.cache.get(('counter', session)) if self.cache is not None else LruCache.MISSING
+        if cached is not LruCache.MISSING:
+            return cached
         self.cur.execute('SELECT counter FROM sessions WHERE id=?', (session,))
-        return self.cur.fetchone()[0]
+        counter = self.cur.fetchone()[0]
+        if self.cache is not None:
+            self.cache.put(('counter', session), counter)
+        return counter
 
     def add_session_decks(self, session: int, decks: List[int]):
         self.cur.executemany(
@@ -208,45 +565,99 @@ class Cursor:
         return [row[0] for row in rows]
 
     def cleanup_session_cards(self, session_id: int):
+        '''deletes progress on cards which aren't in any of the session's decks'''
         self.cur.execute(
             '''DELETE FROM session_cards
-                WHERE session_id=?
-                AND NOT EXISTS (
-                    SELECT 1
-                        FROM cards
-                        INNER JOIN session_decks ON
-                            session_cards.card_id = cards.id AND
-                            session_decks.deck_id = cards.deck_id AND
-                            session_decks.session_id = session_cards.session_id
+                WHERE session_id=:session
+                AND card_id NOT IN (
+                    SELECT cards.id
+                        FROM session_decks
+                        INNER JOIN cards ON
+                            cards.deck_id = session_decks.deck_id
+                        WHERE session_decks.session_id=:session
                 )''',
-            (session_id,))
+            {'session': session_id})
         if self.cur.rowcount < 0:
             raise Exception('failed to cleanup session card info')
 
+    def remove_session_decks(self, session_id: int, deck_ids: List[int]):
+        '''removes decks from a session, along with its progress on their cards'''
+        for chunk in in_chunks(deck_ids):
+            params = ', '.join('?' * len(chunk))
+            self.cur.execute(
+                f'''DELETE FROM session_cards
+                    WHERE session_id=?
+                    AND card_id IN (SELECT id FROM cards WHERE deck_id IN ({params}))''',
+                (session_id, *chunk))
+            if self.cur.rowcount < 0:
+                raise Exception('failed to cleanup session card info')
+            self.cur.execute(
+                f'DELETE FROM session_decks WHERE session_id=? AND deck_id IN ({params})',
+                (session_id, *chunk))
+            if self.cur.rowcount != len(chunk):
+                raise Exception('failed to remove decks from session')
+
     def update_session_decks(self, session_id: int, deck_ids: List[int]):
+        '''
+        changes the session's decks to deck_ids
+
+        Only the decks added or removed are touched: kept decks keep their
+        new-card frontier, and progress is deleted only for removed decks.
+        '''
         self.cur.execute(
-            'DELETE FROM session_decks WHERE session_id=?',
+            'SELECT deck_id FROM session_decks WHERE session_id=?',
             (session_id,))
-        if self.cur.rowcount < 0:
-            raise Exception('failed to remove decks from session')
+        old_decks = {row[0] for row in self.cur.fetchall()}
+        new_decks = dict.fromkeys(deck_ids)
 
-        self.add_session_decks(session_id, deck_ids)
-        self.cleanup_session_cards(session_id)
+        self.remove_session_decks(session_id, [deck for deck in old_decks if deck not in new_decks])
+        added = [deck for deck in new_decks if deck not in old_decks]
+        if added:
+            self.add_session_decks(session_id, added)
+
+    def advance_new_card_frontier(self, session: int):
+        # the frontier moves to the deck's last card before its first unseen
+        # card (or its last card), never past it: the ids in between may
+        # belong to other decks, and be reused by this deck once deleted
+        self.cur.execute('''
+            UPDATE session_decks SET new_after = coalesce(
+                (
+                    SELECT max(cards.id) FROM cards
+                        WHERE cards.deck_id = session_decks.deck_id
+                        AND cards.id <= coalesce(
+                            (
+                                SELECT cards.id - 1 FROM cards
+                                    WHERE cards.deck_id = session_decks.deck_id
+                                    AND cards.id > session_decks.new_after
+                                    AND NOT EXISTS (
+                                        SELECT 1 FROM session_cards
+                                            WHERE session_cards.session_id = session_decks.session_id
+                                            AND session_cards.card_id = cards.id
+                                    )
+                                    ORDER BY cards.id
+                                    LIMIT 1
+                            ),
+                            9223372036854775807)
+                ),
+                new_after)
+                WHERE session_id=?''',
+            (session,))
 
     def get_new_cards(self,
         session: int,
         limit: int
     ) -> List[Tuple[int, str, str, str]]:
+        self.advance_new_card_frontier(session)
         self.cur.execute('''
             SELECT cards.id, decks.name, cards.front, cards.back
-                FROM cards
+                FROM session_decks
+                INNER JOIN cards ON
+                    session_decks.deck_id = cards.deck_id
+                    AND cards.id > session_decks.new_after
                 LEFT JOIN decks ON
                     cards.deck_id == decks.id
-                WHERE EXISTS (
-                    SELECT 1 FROM session_decks
-                        WHERE session_decks.session_id=:session
-                        AND session_decks.deck_id=cards.deck_id
-                ) AND NOT EXISTS (
+                WHERE session_decks.session_id=:session
+                AND NOT EXISTS (
                     SELECT 1 FROM session_cards
                         WHERE session_cards.session_id=:session
                         AND session_cards.card_id=cards.id
@@ -261,41 +672,61 @@ class Cursor:
     ) -> List[Tuple[int, str, str, str, int]]:
         counter = self.get_session_counter(session)
         self.cur.execute(
-            '''SELECT cards.id, decks.name, cards.front, cards.back, session_cards.streak
-                FROM session_cards
+            # split into two index ranges; "review_at IS NULL OR review_at <= :counter"
+            # would visit every card in the session not yet due for review
+            '''SELECT cards.id, decks.name, cards.front, cards.back, due.streak
+                FROM (
+                    SELECT card_id, streak, review_at FROM session_cards
+                        WHERE session_id = :session
+                        AND review_at IS NULL
+                    UNION ALL
+                    SELECT card_id, streak, review_at FROM session_cards
+                        WHERE session_id = :session
+                        AND review_at <= :counter
+                    ORDER BY review_at ASC
+                    LIMIT :limit
+                ) AS due
                 INNER JOIN cards ON
-                    session_cards.session_id = :session
-                    AND (
-                        session_cards.review_at IS NULL OR
-                        session_cards.review_at <= :counter)
-                    AND session_cards.card_id = cards.id
+                    due.card_id = cards.id
                 LEFT JOIN decks ON
                     cards.deck_id == decks.id
-                ORDER BY session_cards.review_at ASC
-                LIMIT :limit''',
+                ORDER BY due.review_at ASC''',
             {'session': session, 'counter': counter, 'limit': limit})
         return self.cur.fetchall()
 
     def increment_session_counter(self, session: int):
+        if self.cache is not None:
+            self.cache.discard(('counter', session))
         self.cur.execute('UPDATE sessions SET counter = counter + 1 WHERE id=?', (session,))
 
-    def update_session_card(self, session: int, card: int, streak: int, review_at: int):
-        self.cur.execute('''
-            INSERT INTO session_cards
-                (session_id, card_id, streak, review_at)
-                VALUES (:session_id, :card_id, :streak, :review_at)
-                ON CONFLICT(session_id, card_id) DO UPDATE SET
-                    streak=:streak,
-                    review_at=coalesce(:review_at, review_at)''',
+    UPSERT_SESSION_CARD = '''
+        INSERT INTO session_cards
+            (session_id, card_id, streak, review_at)
+            VALUES (:session_id, :card_id, :streak, :review_at)
+            ON CONFLICT(session_id, card_id) DO UPDATE SET
+                streak=:streak,
+                review_at=coalesce(:review_at, review_at)'''
+
+    def update_session_card(self, session: int, card: int, streak: int, review_at: Optional[int]):
+        self.cur.execute(Cursor.UPSERT_SESSION_CARD,
             {'session_id': session, 'card_id': card, 'streak': streak, 'review_at': review_at})
         if self.cur.rowcount != 1:
             raise Exception('failed to update session card info')
 
+    def update_session_cards(self, updates: Sequence[Tuple[int, int, int, Optional[int]]]):
+        '''applies (session, card, streak, review_at) updates in order, as update_session_card'''
+        self.cur.executemany(Cursor.UPSERT_SESSION_CARD, [
+            {'session_id': session, 'card_id': card, 'streak': streak, 'review_at': review_at}
+            for session, card, streak, review_at in updates])
+        if self.cur.rowcount != len(updates):
+            raise Exception('failed to update session card info')
+
     def get_macro(self, macro_id: int) -> Tuple[int, str, str]:
         self.cur.execute('SELECT * FROM macros WHERE id = ?', (macro_id,))
-        if self.cur.rowcount != 1:
+        macro = self.cur.fetchone()
+        if not macro:
             raise Exception('failed to get macro')
-        return self.cur.fetchone()
+        return macro
 
     def create_macro(self, name: str, definition: str) -> int:
         self.cur.execute(
@@ -303,43 +734,379 @@ class Cursor:
             (name, definition))
         if self.cur.rowcount != 1:
             raise Exception('failed to create macro')
+        self.clear_render_cache()
         return self.cur.lastrowid
 
     def delete_macro(self, macro_id: int):
         self.cur.execute('DELETE FROM macros WHERE id = ?', (macro_id,))
         if self.cur.rowcount != 1:
             raise Exception('failed to delete macro')
+        self.clear_render_cache()
 
     def list_macros(self) -> List[Tuple[int, str, str]]:
         self.cur.execute('SELECT * FROM macros')
         return self.cur.fetchall()
 
+    def get_render_cache(self,
+        text_hashes: Sequence[bytes],
+        width: int,
+        center: bool,
+        macro_hash: bytes
+    ) -> Dict[bytes, str]:
+        '''returns the stored layouts for the given text hashes, by hash'''
+        layouts: Dict[bytes, str] = {}
+        for chunk in in_chunks(text_hashes):
+            params = ', '.join('?' * len(chunk))
+            self.cur.execute(
+                f'''SELECT text_hash, layout FROM render_cache
+                    WHERE text_hash IN ({params})
+                    AND width=? AND center=? AND macro_hash=?''',
+                (*chunk, width, center, macro_hash))
+            layouts.update(self.cur.fetchall())
+        return layouts
+
+    def put_render_cache(self,
+        layouts: Sequence[Tuple[bytes, str]],
+        width: int,
+        center: bool,
+        macro_hash: bytes
+    ):
+        self.cur.executemany(
+            'INSERT OR REPLACE INTO render_cache VALUES (?, ?, ?, ?, ?)',
+            [(hash_, width, center, macro_hash, layout) for hash_, layout in layouts])
+
+    def invalidate_render_cache(self, texts: Sequence[str]):
+        self.cur.executemany(
+            'DELETE FROM render_cache WHERE text_hash=?',
+            [(text_hash(text),) for text in texts])
+
+    def clear_render_cache(self):
+        self.cur.execute('DELETE FROM render_cache')
+
+def is_busy(e: sqlite3.Error) -> bool:
+    '''whether e was caused by another connection holding a lock'''
+    code = getattr(e, 'sqlite_errorcode', None) # python 3.11+
+    if code is None:
+        return isinstance(e, sqlite3.OperationalError) and 'locked' in str(e)
+    return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+class Contention:
+    '''lock contention seen by one connection'''
+
+    __slots__ = 'transactions', 'busy', 'retries', 'wait_s', 'max_wait_s'
+
+    def __init__(self):
+        self.transactions = 0
+        self.busy         = 0   # statements that failed with SQLITE_BUSY/SQLITE_LOCKED
+        self.retries      = 0   # transactions retried after failing that way
+        self.wait_s       = 0.0 # time spent waiting for the write lock
+        self.max_wait_s   = 0.0
+
+    def __repr__(self) -> str:
+        return (f'Contention(transactions={self.transactions}, busy={self.busy}, retries={self.retries}, '
+            f'wait_s={self.wait_s:.3f}, max_wait_s={self.max_wait_s:.3f})')
+
+# for Database.retry
+RETRY_ATTEMPTS  = 5
+RETRY_BACKOFF_S = 0.05
+
 class Database:
-    __slots__ = 'path', 'db', 'cur'
+    '''
+    a connection to a flashcards database
+
+        with db as cur:         # read (or write, if contention isn't a concern)
+            ...
+        with db.write() as cur: # write
+            ...
+        db.retry(f)             # write, retrying f(cur) if the database is busy
+
+    Write transactions take the write lock when they begin, so they wait
+    (up to busy_timeout_s) for other writers instead of failing when they
+    first write.
+    '''
+
+    __slots__ = 'path', 'profile', 'db', 'cur', 'cache', 'data_version', 'contention'
 
-    def __init__(self, path: str):
+    def __init__(self,
+        path: str,
+        profile: str = 'durable',
+        cached_statements: int = 256,
+        cache_size: int = 1024,
+        check_same_thread: bool = True,
+        busy_timeout_s: float = 5.0
+    ):
         self.path = path
-        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.profile = profile
+        self.db = sqlite3.connect(self.path,
+            timeout=busy_timeout_s,
+            isolation_level=None,
+            cached_statements=cached_statements,
+            check_same_thread=check_same_thread)
         #self.db.set_trace_callback(print)
+        self.contention = Contention()
+        if self.schema_version() == 0:
+            # auto_vacuum can only be set before anything (including the
+            # journal mode) is written to a new database, see migration 5
+            self.db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        PROFILES[profile].apply(self.db)
+        if self.schema_version() != SCHEMA_VERSION:
+            self.migrate()
+        self.cache = LruCache(cache_size) if cache_size > 0 else None
+        self.data_version = None
+        # a single cursor is reused for every transaction
+        self.cur = Cursor(self.db.cursor(), self.has_table('cards_fts'), self.cache)
+
+    def has_table(self, name: str) -> bool:
+        return self.db.execute(
+            'SELECT 1 FROM sqlite_master WHERE name=?', (name,)
+        ).fetchone() is not None
+
+    def schema_version(self) -> int:
+        return self.db.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self):
         with self.db:
             cur = self.db.cursor()
-            cur.execute('BEGIN')
-            for table in DB_SCHEMA:
-                cur.execute(table)
+            # take the write lock first, so concurrent openers migrate only once
+            cur.execute('BEGIN IMMEDIATE')
+            version = self.schema_version()
+            if version > SCHEMA_VERSION:
+                raise Exception(f'database schema version {version} is newer than supported ({SCHEMA_VERSION})')
+            for migration in MIGRATIONS[version:]:
+                for statement in migration:
+                    if callable(statement):
+                        statement(cur)
+                    else:
+                        cur.execute(statement)
+            cur.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
             cur.close()
 
     def __del__(self):
+        self.close()
+
+    def close(self):
+        if getattr(self, 'db', None) is None:
+            return
+        if getattr(self, 'cur', None) is not None:
+            self.cur.close()
+            self.cur = None
+        if getattr(self, 'cache', None) is not None:
+            LOG.info('database cache %s', self.cache)
+        LOG.info('database contention %s', self.contention)
         self.db.commit()
+        journal_mode = self.db.execute('PRAGMA journal_mode').fetchone()[0]
+        if journal_mode.lower() == 'wal':
+            self.db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
         self.db.close()
+        self.db = None
 
     def __enter__(self) -> Cursor:
+        return self.begin('DEFERRED')
+
+    def __exit__(self, type_, value, tb):
+        if isinstance(value, sqlite3.Error) and is_busy(value):
+            self.contention.busy += 1
+        if type_ is not None and self.cache is not None:
+            # the cache may hold values from the rolled back transaction
+            self.cache.clear()
+        try:
+            self.db.__exit__(type_, value, tb)
+        except sqlite3.Error as e:
+            # the commit failed, but the transaction is still open
+            if is_busy(e):
+                self.contention.busy += 1
+            self.db.rollback()
+            if self.cache is not None:
+                self.cache.clear()
+            raise
+
+    @contextlib.contextmanager
+    def write(self) -> Iterator[Cursor]:
+        cur = self.begin('IMMEDIATE')
+        try:
+            yield cur
+        except BaseException as e:
+            self.__exit__(type(e), e, e.__traceback__)
+            raise
+        else:
+            self.__exit__(None, None, None)
+
+    def retry(self,
+        f: Callable[[Cursor], T],
+        attempts: int = RETRY_ATTEMPTS,
+        backoff_s: float = RETRY_BACKOFF_S
+    ) -> T:
+        '''
+        runs f(cur) in a write transaction, retrying (after a random delay,
+        doubling on each attempt) if the database stays locked for longer
+        than the busy timeout.  f may run more than once, so it must not have
+        side effects outside of the database that can't be repeated.
+        '''
+        for attempt in range(attempts):
+            try:
+                with self.write() as cur:
+                    return f(cur)
+            except sqlite3.OperationalError as e:
+                if not is_busy(e) or attempt + 1 == attempts:
+                    raise
+                self.contention.retries += 1
+                LOG.info('database busy, retrying (attempt %d of %d)', attempt + 1, attempts)
+                time.sleep(random.uniform(0.0, backoff_s * 2**attempt))
+        assert False
+
+    def begin(self, mode: str) -> Cursor:
         self.db.__enter__()
-        cur = self.db.cursor()
-        cur.execute('BEGIN')
-        self.cur = Cursor(cur)
+        start_s = time.perf_counter()
+        try:
+            self.cur.cur.execute(f'BEGIN {mode}')
+        except sqlite3.OperationalError as e:
+            if is_busy(e):
+                self.contention.busy += 1
+            raise
+        if mode == 'IMMEDIATE':
+            wait_s = time.perf_counter() - start_s
+            self.contention.wait_s += wait_s
+            self.contention.max_wait_s = max(self.contention.max_wait_s, wait_s)
+        self.contention.transactions += 1
+        if self.cache is not None:
+            # changes when another connection commits, which may make anything in the cache stale
+            data_version = self.db.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self.data_version:
+                self.cache.clear()
+                self.data_version = data_version
         return self.cur
 
-    def __exit__(self, type_, value, tb):
-        self.cur.close()
-        self.cur = None
-        self.db.__exit__(type_, value, tb)
\ No newline at end of file
+class DatabasePool:
+    '''
+    one writer connection and up to max_readers reader connections, for
+    sharing a database between threads
+
+    A thread checks out a connection for the duration of a reader()/writer()
+    block (nested blocks in the same thread reuse it).  Writers are
+    serialized; readers only run concurrently with the writer in WAL mode
+    (i.e. the balanced or bulk profiles).  Readers idle for longer than
+    idle_timeout_s are closed.
+    '''
+
+    __slots__ = (
+        'path',
+        'profile',
+        'max_readers',
+        'idle_timeout_s',
+        'busy_timeout_s',
+        'writer_db',
+        'writer_lock',
+        'idle',
+        'open_readers',
+        'available',
+        'local')
+
+    idle: List[Tuple[float, Database]]
+
+    def __init__(self,
+        path: str,
+        profile: str = 'balanced',
+        max_readers: int = 4,
+        idle_timeout_s: float = 60.0,
+        busy_timeout_s: float = 5.0
+    ):
+        self.path           = path
+        self.profile        = profile
+        self.max_readers    = max_readers
+        self.idle_timeout_s = idle_timeout_s
+        self.busy_timeout_s = busy_timeout_s
+        # opened first, so any migrations run before readers connect
+        self.writer_db      = Database(path, profile, check_same_thread=False, busy_timeout_s=busy_timeout_s)
+        self.writer_lock    = threading.RLock()
+        self.idle           = []
+        self.open_readers   = 0
+        self.available      = threading.Condition()
+        self.local          = threading.local()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if getattr(self, 'writer_db', None) is None:
+            return
+        with self.available:
+            for _, db in self.idle:
+                db.close()
+            self.open_readers -= len(self.idle)
+            self.idle = []
+        with self.writer_lock:
+            self.writer_db.close()
+            self.writer_db = None
+
+    @contextlib.contextmanager
+    def writer(self) -> Iterator[Cursor]:
+        with self.writer_lock:
+            if getattr(self.local, 'writing', False):
+                yield self.writer_db.cur
+                return
+            self.local.writing = True
+            try:
+                with self.writer_db.write() as cur:
+                    yield cur
+            finally:
+                self.local.writing = False
+
+    def retry(self, f: Callable[[Cursor], T]) -> T:
+        '''Database.retry on the writer connection'''
+        with self.writer_lock:
+            if getattr(self.local, 'writing', False):
+                return f(self.writer_db.cur)
+            self.local.writing = True
+            try:
+                return self.writer_db.retry(f)
+            finally:
+                self.local.writing = False
+
+    @contextlib.contextmanager
+    def reader(self) -> Iterator[Cursor]:
+        db = getattr(self.local, 'reader', None)
+        if db is not None:
+            yield db.cur
+            return
+        db = self.checkout()
+        self.local.reader = db
+        try:
+            with db as cur:
+                yield cur
+        finally:
+            self.local.reader = None
+            self.checkin(db)
+
+    def checkout(self) -> Database:
+        with self.available:
+            while True:
+                self.evict_idle()
+                if self.idle:
+                    return self.idle.pop()[1]
+                if self.open_readers < self.max_readers:
+                    self.open_readers += 1
+                    break
+                self.available.wait()
+        try:
+            db = Database(self.path, self.profile, check_same_thread=False, busy_timeout_s=self.busy_timeout_s)
+            db.db.execute('PRAGMA query_only = 1')
+        except:
+            with self.available:
+                self.open_readers -= 1
+                self.available.notify()
+            raise
+        return db
+
+    def checkin(self, db: Database):
+        with self.available:
+            self.idle.append((time.monotonic(), db))
+            self.evict_idle()
+            self.available.notify()
+
+    def evict_idle(self):
+        # called with self.available held; idle is ordered by check-in time
+        deadline = time.monotonic() - self.idle_timeout_s
+        while self.idle and self.idle[0][0] < deadline:
+            _, db = self.idle.pop(0)
+            db.close()
+            self.open_readers -= 1
@@ -0,0 +1,164 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import csv, gzip, json, lzma
+from itertools import islice
+from typing import Any, Callable, IO, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from flashcards_lib.database import Cursor
+
+Card = Tuple[str, str]
+
+COMPRESSION = {
+    'gzip': gzip.open,
+    'xz'  : lzma.open,
+}
+
+def card_from_json(item: Any) -> Card:
+    if isinstance(item, dict):
+        return item['front'], item['back']
+    if isinstance(item, list) and len(item) == 2:
+        return item[0], item[1]
+    raise ValueError(f'expected a [front, back] pair or a {{"front", "back"}} object, got {item!r}')
+
+def read_csv(f: TextIO) -> Iterator[Card]:
+    for row in csv.DictReader(f):
+        yield row['front'], row['back']
+
+def read_jsonl(f: TextIO) -> Iterator[Card]:
+    for line in f:
+        if line.strip():
+            yield card_from_json(json.loads(line))
+
+def read_json(f: TextIO, chunk_size: int = 1 << 16) -> Iterator[Card]:
+    '''incrementally parses a JSON array of cards, without loading the whole file'''
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_space() -> Optional[str]:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not fill():
+                return None
+
+    if skip_space() != '[':
+        raise ValueError('expected a JSON array of cards')
+    pos += 1
+    if skip_space() == ']':
+        return
+
+    while True:
+        if skip_space() is None:
+            raise ValueError('unexpected end of JSON input')
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # a value ending exactly at the end of the buffer may be truncated (i.e. a number)
+            if end < len(buf) or not fill():
+                break
+        pos = end
+        yield card_from_json(item)
+
+        c = skip_space()
+        pos += 1
+        if c == ']':
+            return
+        if c != ',':
+            raise ValueError(f'expected "," or "]" in JSON array, got {c!r}')
+
+READERS = {
+    'csv'  : read_csv,
+    'json' : read_json,
+    'jsonl': read_jsonl,
+}
+
+def import_cards(
+    cur: Cursor,
+    deck_id: int,
+    cards: Iterator[Card],
+    batch_size: int = 1000,
+    on_progress: Optional[Callable[[int], None]] = None
+) -> int:
+    count = 0
+    with cur.deferred_fts_index(deck_id):
+        while True:
+            batch: List[Card] = [*islice(cards, batch_size)]
+            if not batch:
+                break
+            cur.add_cards(deck_id, batch)
+            count += len(batch)
+            if on_progress:
+                on_progress(count)
+    return count
+
+def write_csv(f: TextIO, cards: Iterable[Card]) -> int:
+    count = 0
+    writer = csv.DictWriter(f, ('front', 'back'))
+    writer.writeheader()
+    for front, back in cards:
+        writer.writerow({'front': front, 'back': back})
+        count += 1
+    return count
+
+def write_jsonl(f: TextIO, cards: Iterable[Card]) -> int:
+    count = 0
+    for front, back in cards:
+        f.write(json.dumps([front, back], ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+def write_json(f: TextIO, cards: Iterable[Card]) -> int:
+    '''writes the same output as json.dump([*cards], f, ensure_ascii=False, indent='\\t'), one card at a time'''
+    count = 0
+    f.write('[')
+    for front, back in cards:
+        item = json.dumps([front, back], ensure_ascii=False, indent='\t')
+        f.write((',' if count else '') + '\n\t' + item.replace('\n', '\n\t'))
+        count += 1
+    f.write('\n]' if count else ']')
+    return count
+
+WRITERS = {
+    'csv'  : write_csv,
+    'json' : write_json,
+    'jsonl': write_jsonl,
+}
+
+def open_output(path: str, compression: Optional[str] = None) -> IO[str]:
+    if compression is None:
+        return open(path, 'w', encoding='utf-8', newline='')
+    return COMPRESSION[compression](path, 'wt', encoding='utf-8', newline='')
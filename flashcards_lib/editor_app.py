@@ -13,8 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import codecs, logging, msvcrt, sys
-from msvcrt import getwch # type: ignore
+import codecs, logging
 from pathlib import Path
 from typing import Any, Callable, List, Optional, Tuple
 
@@ -27,12 +26,11 @@ from flashcards_lib.console_ui import (
     Input,
     MarkupDrawer,
     ASCII_ESC,
-    MS_KEY_ESC0,
-    MS_KEY_ESC1,
     MS_KEY_DOWN,
     MS_KEY_UP,
     MS_KEY_PAGE_DOWN,
     MS_KEY_PAGE_UP)
+from flashcards_lib.terminal import Terminal, is_special_key
 
 class EditorApp:
     class Card:
@@ -40,10 +38,10 @@ class EditorApp:
 
         card_id: Any
 
-        def __init__(self, card_id, box_front, box_back):
+        def __init__(self, term, card_id, box_front, box_back):
             self.card_id = card_id
-            self.front = MarkupDrawer(*box_front, True, True)
-            self.back  = MarkupDrawer(*box_back , True, True)
+            self.front = MarkupDrawer(term, *box_front, True, True)
+            self.back  = MarkupDrawer(term, *box_back , True, True)
 
         def get_side(self, front: bool) -> MarkupDrawer:
             return self.front if front else self.back
@@ -59,31 +57,36 @@ class EditorApp:
         ((14, 3, 5, 56), (14, 62, 5, 56)),
     )
 
-    def __init__(self, on_submit: Callable[[Any, str, str], None], on_scroll: Callable[[bool], None]):
-        self.input      = Input(EditorApp.INPUT_BOX)
-        self.preview    = EditorApp.Card(None, EditorApp.PREVIEW_FRONT, EditorApp.PREVIEW_BACK)
+    def __init__(self,
+        term: Terminal,
+        on_submit: Callable[[Any, str, str], None],
+        on_scroll: Callable[[bool], None]
+    ):
+        self.term       = term
+        self.input      = Input(term, EditorApp.INPUT_BOX)
+        self.preview    = EditorApp.Card(term, None, EditorApp.PREVIEW_FRONT, EditorApp.PREVIEW_BACK)
         self.edit_front = True
         self.browser    = [
-            EditorApp.Card(None, box_front, box_back)
+            EditorApp.Card(term, None, box_front, box_back)
             for box_front, box_back in EditorApp.CARD_BROWSER]
         self.selected   = None
         self.on_submit  = on_submit
         self.on_scroll  = on_scroll
 
-        sys.stdout.write(ANSI_CLEAR + ANSI_RESET)
+        term.write(ANSI_CLEAR + ANSI_RESET)
 
         lib_path = Path(__file__).parent
         with codecs.open(lib_path / 'editor_ui_utf8.txt', 'r', 'utf-8') as f: # type: ignore
-            sys.stdout.write(f.read())
+            term.write(f.read())
 
-        sys.stdout.write(ansi_pos(
+        term.write(ansi_pos(
             EditorApp.INPUT_BOX[0],
             EditorApp.INPUT_BOX[1]))
-        sys.stdout.flush()
+        term.flush()
 
     def __del__(self):
-        sys.stdout.write(ansi_col(0) + ANSI_DOWN * 4)
-        sys.stdout.flush()
+        self.term.write(ansi_col(0) + ANSI_DOWN * 4)
+        self.term.flush()
 
     @property
     def first_card_id(self) -> Any:
@@ -226,13 +229,14 @@ class EditorApp:
                 elif event_or_input == Input.TAB:
                     self.flip_card(True)
             else:
-                char = getwch()
+                key = self.term.getkey()
+                char = key[0]
                 if char == ASCII_ESC:
                     self.set_selected(None)
                 elif char == '\x03' or char == '\x04':
                     raise KeyboardInterrupt()
-                elif char == MS_KEY_ESC0 or char == MS_KEY_ESC1:
-                    char2 = getwch()
+                elif is_special_key(key):
+                    char2 = key[1:]
                     if char2 == MS_KEY_UP or char2 == MS_KEY_DOWN:
                         self.select_card(char2 == MS_KEY_UP)
                     elif char2 == MS_KEY_PAGE_UP:
@@ -241,7 +245,7 @@ class EditorApp:
                         self.on_scroll(False)
                 elif char in (' ', '\r'):
                     self.edit_selected()
-            sys.stdout.flush()
+            self.term.flush()
 
 def example_main():
     log_handler = logging.FileHandler('console_ui.log', encoding='utf-8')
@@ -265,8 +269,9 @@ def example_main():
         ])
 
     from flashcards_lib.console_ui import WinAnsiMode
+    from flashcards_lib.terminal import ConsoleTerminal
     with WinAnsiMode():
-        app = EditorApp(lambda id, front, back: None, on_scroll)
+        app = EditorApp(ConsoleTerminal(), lambda id, front, back: None, on_scroll)
         app.main()
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+class LruCache:
+    '''
+    bounded least-recently-used cache
+
+    Bounded by entry count, and optionally by total size as measured by
+    "sizeof".  Keeps hit/miss counts for tuning.
+    '''
+
+    MISSING = object()
+
+    __slots__ = 'max_entries', 'max_size', 'sizeof', 'size', 'entries', 'hits', 'misses'
+
+    entries: 'OrderedDict[Hashable, Any]'
+
+    def __init__(self,
+        max_entries: int,
+        max_size: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None
+    ):
+        assert (max_size is None) == (sizeof is None)
+        self.max_entries = max_entries
+        self.max_size    = max_size
+        self.sizeof      = sizeof
+        self.size        = 0
+        self.entries     = OrderedDict()
+        self.hits        = 0
+        self.misses      = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __repr__(self) -> str:
+        return f'LruCache{{{len(self.entries)}/{self.max_entries}, {self.size}B, {self.hits} hits, {self.misses} misses}}'
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: Hashable) -> Any:
+        '''returns the cached value, or LruCache.MISSING'''
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return LruCache.MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self.discard(key)
+        if self.sizeof:
+            size = self.sizeof(value)
+            assert self.max_size is not None
+            if size > self.max_size:
+                return
+            self.size += size
+        self.entries[key] = value
+        while len(self.entries) > self.max_entries or (self.max_size is not None and self.size > self.max_size):
+            _, evicted = self.entries.popitem(last=False)
+            if self.sizeof:
+                self.size -= self.sizeof(evicted)
+
+    def discard(self, key: Hashable):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            return
+        if self.sizeof:
+            self.size -= self.sizeof(value)
+
+    def discard_if(self, predicate: Callable[[Hashable], bool]):
+        for key in [key for key in self.entries if predicate(key)]:
+            self.discard(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
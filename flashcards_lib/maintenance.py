@@ -0,0 +1,147 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging, sqlite3
+from typing import List, Optional
+
+from flashcards_lib.database import AUTO_VACUUM_INCREMENTAL, Database
+
+LOG = logging.getLogger(__name__)
+
+class TableStats:
+    '''storage used by one table or index (pages and bytes are None without the dbstat virtual table)'''
+    __slots__ = 'name', 'table', 'rows', 'pages', 'size', 'unused'
+
+    def __init__(self,
+        name  : str,
+        table : str,
+        rows  : Optional[int] = None,
+        pages : Optional[int] = None,
+        size  : Optional[int] = None,
+        unused: Optional[int] = None
+    ):
+        self.name   = name
+        self.table  = table
+        self.rows   = rows
+        self.pages  = pages
+        self.size   = size
+        self.unused = unused
+
+class StorageStats:
+    __slots__ = 'page_size', 'page_count', 'freelist_count', 'auto_vacuum', 'tables'
+
+    tables: List[TableStats]
+
+    def __init__(self, page_size: int, page_count: int, freelist_count: int, auto_vacuum: int):
+        self.page_size      = page_size
+        self.page_count     = page_count
+        self.freelist_count = freelist_count
+        self.auto_vacuum    = auto_vacuum
+        self.tables         = []
+
+    @property
+    def size(self) -> int:
+        return self.page_count * self.page_size
+
+    @property
+    def free_size(self) -> int:
+        '''bytes in unused pages, which an incremental vacuum returns to the filesystem'''
+        return self.freelist_count * self.page_size
+
+    @property
+    def unused_size(self) -> int:
+        '''unused bytes within pages in use, some of which a full VACUUM recovers by repacking them'''
+        return sum(table.unused or 0 for table in self.tables)
+
+    def reclaimable(self) -> int:
+        '''estimated bytes the next maintain() returns to the filesystem'''
+        if self.auto_vacuum == AUTO_VACUUM_INCREMENTAL:
+            return self.free_size
+        # converting to incremental auto_vacuum takes a full VACUUM
+        return self.free_size + self.unused_size
+
+def storage_stats(db: Database) -> StorageStats:
+    with db as cur:
+        raw = cur.cur
+        def pragma(name: str) -> int:
+            return raw.execute(f'PRAGMA {name}').fetchone()[0]
+        stats = StorageStats(
+            pragma('page_size'),
+            pragma('page_count'),
+            pragma('freelist_count'),
+            pragma('auto_vacuum'))
+
+        schema = raw.execute('''
+            SELECT name, tbl_name, type, sql LIKE 'CREATE VIRTUAL%' FROM sqlite_master
+            WHERE type IN ('table', 'index')
+            ORDER BY tbl_name, type DESC, name''').fetchall()
+        by_name = {}
+        for name, table, type_, virtual in schema:
+            item = TableStats(name, table)
+            if type_ == 'table' and not virtual:
+                item.rows = raw.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            stats.tables.append(item)
+            by_name[name] = item
+
+        # dbstat is an optional sqlite feature, like FTS5
+        try:
+            pages = raw.execute('''
+                SELECT name, COUNT(*), SUM(pgsize), SUM(unused) FROM dbstat
+                GROUP BY name''').fetchall()
+        except sqlite3.OperationalError as e:
+            LOG.warning('page usage unavailable: %s', e)
+            return stats
+
+        for name, count, size, unused in pages:
+            item = by_name.get(name)
+            if item is None:
+                # sqlite_schema, and automatic indexes for UNIQUE constraints
+                # (named after their table, with a "sqlite_autoindex_" prefix)
+                item = TableStats(name, name)
+                stats.tables.append(item)
+            item.pages  = count
+            item.size   = size
+            item.unused = unused
+        return stats
+
+def maintain(db: Database, analyze: bool = False) -> None:
+    '''
+    refreshes the query planner's statistics and returns free pages to the filesystem
+
+    A database created without incremental auto_vacuum (see
+    Database.__init__) is converted to it first, which takes a full VACUUM:
+    that rewrites the whole database, and needs exclusive access to it.
+    Afterwards an incremental vacuum only truncates free pages off the end.
+
+    Statistics are collected with ANALYZE the first time (or if analyze is
+    set), otherwise with PRAGMA optimize, which only re-analyzes tables
+    whose size changed significantly.
+    '''
+    if analyze or not db.has_table('sqlite_stat1'):
+        db.db.execute('ANALYZE')
+    else:
+        db.db.execute('PRAGMA optimize')
+
+    auto_vacuum = db.db.execute('PRAGMA auto_vacuum').fetchone()[0]
+    if auto_vacuum != AUTO_VACUUM_INCREMENTAL:
+        LOG.info('converting to incremental auto_vacuum')
+        # the setting only applies to this connection until VACUUM, which
+        # can't run in a transaction
+        db.db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        db.db.execute('VACUUM')
+    else:
+        # this frees one page per step, but execute() only steps once
+        # (executescript runs statements to completion)
+        db.db.executescript('PRAGMA incremental_vacuum')
@@ -15,13 +15,26 @@
 
 from __future__ import annotations
 
-import logging, sys, threading, unicodedata
+import hashlib, json, logging, sys, threading
+from array import array
 from functools import reduce
 from logging.handlers import MemoryHandler
-from typing import Any, Callable, Dict, Generator, Iterator, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 from flashcards_lib.ansi_esc import *
-from flashcards_lib.util import is_breaking_space, is_inner_punctuation, is_starting_punctuation, is_ending_punctuation, line_break_opportunities, StringMask, unicode_width, unicode_center
+from flashcards_lib.lru import LruCache
+from flashcards_lib.util import (
+    classify,
+    is_breaking_space,
+    line_break_opportunities,
+    StringMask,
+    unicode_width,
+    CLASS_BREAKING,
+    CLASS_END_PUNCTUATION,
+    CLASS_INNER_PUNCTUATION,
+    CLASS_MARKUP,
+    CLASS_NUMBER_SIGN,
+    CLASS_START_PUNCTUATION)
 
 LOG = logging.getLogger(__name__)
 
@@ -49,17 +62,18 @@ class MarkupLogHandler(MemoryHandler):
         finally:
             self.release()
 
-def token_boundaries(s: str) -> StringMask:
-    cats = [unicodedata.category(c) for c in s]
-    delim = StringMask.collect(
-        c in ('\\', '{', '}', '^', '_') or
-        is_breaking_space(c, cat) or
-        is_inner_punctuation(cat) or
-        is_starting_punctuation(cat) or
-        is_ending_punctuation(cat)
-        for c, cat in zip(s, cats))
-    number_sign = StringMask.collect(c == '#' for c in s)
-    return (line_break_opportunities(s) | delim | delim << 1) & ~number_sign
+def token_boundaries(s: str, classes: Optional[bytes] = None) -> StringMask:
+    if classes is None:
+        classes = classify(s)
+    # breaking hyphens are ending punctuation, too
+    delim = StringMask.from_classes(classes,
+        CLASS_MARKUP |
+        CLASS_BREAKING |
+        CLASS_INNER_PUNCTUATION |
+        CLASS_START_PUNCTUATION |
+        CLASS_END_PUNCTUATION)
+    number_sign = StringMask.from_classes(classes, CLASS_NUMBER_SIGN)
+    return (line_break_opportunities(s, classes) | delim | delim << 1) & ~number_sign
 
 class Token:
     __slots__ = '_type', '_scope', '_range', '_value'
@@ -110,95 +124,152 @@ class Token:
     def __repr__(self) -> str:
         return f'Token{{{str(self.type)}, {self.range}, \"{self.value}\"}}'
 
-def tokenize(s: str, scope: Optional[str] = None) -> Generator[Token, None, None]:
-    breaks = token_boundaries(s)
-    i = 0
-    j = 0
-    while j < len(s):
-        if breaks[j]:
-            yield Token(Token.LITERAL, scope, (i, j+1), s[i:j+1])
-            i = j+1
-        j = j+1
-    if i < len(s):
-        yield Token(Token.LITERAL, scope, (i, j), s[i:])
-
-def normalize(tokens: Iterator[Token]) -> Generator[Token, None, None]:
-    t0: Optional[Token] = None
-
-    VALUE_LIKE = (Token.LITERAL, Token.FUNCTION, Token.MACRO, Token.RBRACKET)
+# TokenStream type codes
+TOKEN_TYPES = (
+    Token.LITERAL,
+    Token.ESCAPE,
+    Token.SPACE,
+    Token.INFIX,
+    Token.FUNCTION,
+    Token.MACRO,
+    Token.LBRACKET,
+    Token.RBRACKET)
+(
+    TOKEN_LITERAL,
+    TOKEN_ESCAPE,
+    TOKEN_SPACE,
+    TOKEN_INFIX,
+    TOKEN_FUNCTION,
+    TOKEN_MACRO,
+    TOKEN_LBRACKET,
+    TOKEN_RBRACKET
+) = range(len(TOKEN_TYPES))
+
+class TokenStream:
+    '''
+    normalized tokens of a string, as parallel arrays (see scan)
+
+    Token i has type TOKEN_TYPES[types[i]] and value source[starts[i]:ends[i]].
+    Tokens inserted by normalization have no range (start and end are -1)
+    and an empty value.  Indexing or iterating yields equivalent Tokens.
+    '''
+
+    __slots__ = 'source', 'scope', 'types', 'starts', 'ends'
+
+    def __init__(self, source: str, scope: Optional[str] = None):
+        self.source = source
+        self.scope  = scope
+        self.types  = array('B')
+        self.starts = array('l')
+        self.ends   = array('l')
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, i: int) -> Token:
+        start = self.starts[i]
+        if start < 0:
+            return Token(TOKEN_TYPES[self.types[i]], self.scope, None, '')
+        end = self.ends[i]
+        return Token(TOKEN_TYPES[self.types[i]], self.scope, (start, end), self.source[start:end])
+
+    def __iter__(self) -> Iterator[Token]:
+        return (self[i] for i in range(len(self.types)))
+
+    def value(self, i: int) -> str:
+        start = self.starts[i]
+        return self.source[start:self.ends[i]] if start >= 0 else ''
+
+def scan(s: str, scope: Optional[str] = None) -> TokenStream:
+    '''
+    splits s into tokens at token_boundaries and normalizes them: tokens are
+    typed, runs of spaces merged, and empty literals or spaces inserted so
+    values and operators alternate, all in one pass without allocating Tokens
+
+    Escapes, brackets and infix operators are single CLASS_MARKUP
+    characters, and breaking spaces single CLASS_BREAKING characters (see
+    token_boundaries), so other fragments are literals without looking at
+    their value.
+    '''
+    classes = classify(s)
+    breaks = token_boundaries(s, classes).flags(len(s))
+    stream = TokenStream(s, scope)
+    types_append  = stream.types.append
+    starts_append = stream.starts.append
+    ends_append   = stream.ends.append
+
+    def emit(type_: int, start: int, end: int):
+        types_append(type_)
+        starts_append(start)
+        ends_append(end)
+
+    VALUE_LIKE = (TOKEN_LITERAL, TOKEN_FUNCTION, TOKEN_MACRO, TOKEN_RBRACKET)
+
+    # the pending token, which the next one may change; -1 if there isn't one yet
+    t0 = -1
+    start0 = end0 = -1
 
-    while True:
-        try:
-            t1 = next(tokens)
-        except StopIteration:
-            break
-
-        if t0 and t0.type == Token.ESCAPE:
-            if t1.value in Function.lookup:
-                t1 = t1.with_type(Token.FUNCTION)
-            elif t1.value in Macro.lookup:
-                t1 = t1.with_type(Token.MACRO)
-            t0 = t1
-        elif t1.value == '\\':
-            t1 = t1.with_type(Token.ESCAPE)
-            if t0:
-                yield t0
-                if t0.type in VALUE_LIKE:
-                    yield Token(Token.SPACE, t1.scope, None, '')
-            t0 = t1
-        elif t1.value in InfixOperator.lookup:
-            t1 = t1.with_type(Token.INFIX)
-            if not t0 or t0.type not in VALUE_LIKE:
-                yield Token(Token.LITERAL, t1.scope, None, '')
-            if t0:
-                yield t0
-            t0 = t1
-        elif t1.value == '{':
-            t1 = t1.with_type(Token.LBRACKET)
-            if t0:
-                yield t0
-                if t0.type in VALUE_LIKE:
-                    yield Token(Token.SPACE, t1.scope, None, '')
-            t0 = t1
-        elif t1.value == '}':
-            t1 = t1.with_type(Token.RBRACKET)
-            if t0:
-                yield t0
-                if t0.type not in VALUE_LIKE:
-                    yield Token(Token.LITERAL, t1.scope, None, '')
-            t0 = t1
-        elif all(is_breaking_space(c) for c in t1.value):
-            if t0 and t0.type == Token.SPACE:
-                assert t0.range and t1.range
-                t0 = Token(Token.SPACE,
-                    t1.scope,
-                    (
-                        min(t0.range[0], t1.range[0]),
-                        max(t0.range[1], t1.range[1])
-                    ),
-                    t0.value + t1.value)
+    i = 0
+    n = len(s)
+    while i < n:
+        j = breaks.find(1, i) + 1 or n
+
+        if t0 != TOKEN_ESCAPE and not classes[i] & (CLASS_MARKUP | CLASS_BREAKING):
+            if t0 >= 0:
+                emit(t0, start0, end0)
+                if t0 in VALUE_LIKE:
+                    emit(TOKEN_SPACE, -1, -1)
+            t0, start0, end0 = TOKEN_LITERAL, i, j
+            i = j
+            continue
+
+        value = s[i:j]
+        if t0 == TOKEN_ESCAPE:
+            if value in Function.lookup:
+                t0 = TOKEN_FUNCTION
+            elif value in Macro.lookup:
+                t0 = TOKEN_MACRO
             else:
-                if t0 and t0.type in VALUE_LIKE:
-                    t1 = t1.with_type(Token.SPACE)
-                else:
-                    t1 = t1.with_type(Token.LITERAL)
-                if t0:
-                    yield t0
-                t0 = t1
-        else:
-            t1 = t1.with_type(Token.LITERAL)
-            if t0:
-                yield t0
-                if t0.type in VALUE_LIKE:
-                    yield Token(Token.SPACE, t1.scope, None, '')
-            t0 = t1
-
-    if t0:
-        if t0.type not in VALUE_LIKE:
-            yield t0
-            yield Token(Token.LITERAL, t1.scope, None, '')
+                t0 = TOKEN_LITERAL
+            start0, end0 = i, j
+        elif value == '\\' or value == '{':
+            if t0 >= 0:
+                emit(t0, start0, end0)
+                if t0 in VALUE_LIKE:
+                    emit(TOKEN_SPACE, -1, -1)
+            t0, start0, end0 = (TOKEN_ESCAPE if value == '\\' else TOKEN_LBRACKET), i, j
+        elif value in InfixOperator.lookup:
+            if t0 not in VALUE_LIKE:
+                emit(TOKEN_LITERAL, -1, -1)
+            if t0 >= 0:
+                emit(t0, start0, end0)
+            t0, start0, end0 = TOKEN_INFIX, i, j
+        elif value == '}':
+            if t0 >= 0:
+                emit(t0, start0, end0)
+                if t0 not in VALUE_LIKE:
+                    emit(TOKEN_LITERAL, -1, -1)
+            t0, start0, end0 = TOKEN_RBRACKET, i, j
+        elif classes[i] & CLASS_BREAKING and all(is_breaking_space(c) for c in value):
+            if t0 == TOKEN_SPACE:
+                end0 = j
+            else:
+                if t0 >= 0:
+                    emit(t0, start0, end0)
+                t0, start0, end0 = (TOKEN_SPACE if t0 in VALUE_LIKE else TOKEN_LITERAL), i, j
         else:
-            yield t0
+            if t0 >= 0:
+                emit(t0, start0, end0)
+                if t0 in VALUE_LIKE:
+                    emit(TOKEN_SPACE, -1, -1)
+            t0, start0, end0 = TOKEN_LITERAL, i, j
+        i = j
+
+    if t0 >= 0:
+        emit(t0, start0, end0)
+        if t0 not in VALUE_LIKE:
+            emit(TOKEN_LITERAL, -1, -1)
+    return stream
 
 class Text:
     __slots__ = '_x', '_y', '_text'
@@ -269,11 +340,32 @@ class TextBox:
         return TextBox(0, 0, 0)
 
 class TextGroup:
-    __slots__ = '_box', '_items'
+    '''
+    text items laid out in a box
+
+    concat doesn't copy either group's items: the result keeps both groups
+    (with their offsets) as parts, and only makes its own list of items,
+    walking the tree of parts once, when items is first used.  (Otherwise
+    laying out k words one concat at a time copies O(k^2) items.)
+    '''
+
+    __slots__ = '_box', '_items', '_parts'
+
+    _items: Optional[List[Text]]
+    _parts: Optional[Tuple[Tuple[int, int, TextGroup], ...]]
 
     def __init__(self, box: TextBox, items: List[Text]):
         self._box = box
         self._items = items
+        self._parts = None
+
+    @staticmethod
+    def from_parts(box: TextBox, parts: Tuple[Tuple[int, int, TextGroup], ...]) -> TextGroup:
+        '''a group of other groups, each offset by (x, y)'''
+        group = TextGroup(box, [])
+        group._items = None
+        group._parts = parts
+        return group
 
     def __repr__(self) -> str:
         return f'TextGroup{{{self.box}, {self.items}}}'
@@ -284,13 +376,31 @@ class TextGroup:
 
     @property
     def items(self) -> List[Text]:
+        if self._items is None:
+            self._items = self.flatten()
+            self._parts = None
         return self._items
 
+    def flatten(self) -> List[Text]:
+        items: List[Text] = []
+        # depth-first, in order, without recursion (concat chains are as deep as they are long)
+        stack = [(0, 0, self)]
+        while stack:
+            x, y, group = stack.pop()
+            if group._items is None:
+                assert group._parts is not None
+                stack += [(x + dx, y + dy, part) for dx, dy, part in reversed(group._parts)]
+            elif x == 0 and y == 0:
+                items += group._items
+            else:
+                items += [Text(item.x + x, item.y + y, item.text) for item in group._items]
+        return items
+
     def with_items(self, items: List[Text]) -> TextGroup:
         return TextGroup(self._box, items)
 
     def clone(self) -> TextGroup:
-        return TextGroup(self._box, [*self._items])
+        return TextGroup(self._box, [*self.items])
 
     def concat(self,
         other: TextGroup,
@@ -312,18 +422,9 @@ class TextGroup:
             baseline = self.box.baseline - y0
 
         box = TextBox(x1 - x0, y1 - y0, baseline)
-        items = [
-            *(Text(
-                item.x - x0,
-                item.y - y0,
-                item.text)
-            for item in self.items),
-            *(Text(
-                item.x + x_offset - x0,
-                item.y + y_offset - y0,
-                item.text)
-            for item in other.items)]
-        return TextGroup(box, items)
+        return TextGroup.from_parts(box, (
+            (-x0, -y0, self),
+            (x_offset - x0, y_offset - y0, other)))
 
     @staticmethod
     def from_str(text: str) -> TextGroup:
@@ -336,13 +437,18 @@ class TextGroup:
 class Macro:
     lookup: Dict[str, Macro] = {}
     tls = threading.local()
+    # incremented whenever lookup changes, since layouts depend on it
+    generation = 0
+    # (generation, registry_hash())
+    digest: Tuple[int, bytes] = (-1, b'')
 
-    __slots__ = 'ident', 'argn', 'tokens'
+    __slots__ = 'ident', 'argn', 'tokens', 'definition'
 
-    def __init__(self, ident: str, argn: int, tokens: List[Token]):
+    def __init__(self, ident: str, argn: int, tokens: List[Token], definition: str = ''):
         self.ident = ident
         self.argn = argn
         self.tokens = tokens
+        self.definition = definition
 
     @staticmethod
     def match_group(token: Token) -> Optional[int]:
@@ -391,14 +497,33 @@ class Macro:
 
     @staticmethod
     def create(ident: str, definition: str):
-        tokens = [*normalize(tokenize(definition))]
+        tokens = [*scan(definition)]
         argn = 0
         for token in tokens:
             group = Macro.match_group(token)
             if group and group >= argn:
                 argn = group + 1
-        macro = Macro(ident, argn, tokens)
+        macro = Macro(ident, argn, tokens, definition)
         Macro.lookup[ident] = macro
+        with LAYOUT_CACHE_LOCK:
+            Macro.generation += 1
+            LAYOUT_CACHE.clear()
+
+    @staticmethod
+    def registry_hash() -> bytes:
+        '''identifies the macros currently defined (and LAYOUT_VERSION), for caching layouts outside the process'''
+        # read before hashing: create() updates lookup before generation, so
+        # a macro created meanwhile still invalidates the stored digest
+        generation = Macro.generation
+        cached_generation, digest = Macro.digest
+        if cached_generation == generation:
+            return digest
+        h = hashlib.sha256(f'{LAYOUT_VERSION}\0'.encode('utf-8'))
+        for ident, macro in sorted(Macro.lookup.items()):
+            h.update(f'{ident}\0{macro.definition}\0'.encode('utf-8'))
+        digest = h.digest()[:16]
+        Macro.digest = generation, digest
+        return digest
 
 def with_tls(f: Callable[..., Any]) -> Callable[..., Any]:
     tls = threading.local()
@@ -696,6 +821,8 @@ def layout(tokens: Iterator[Token], max_width: int, center: bool) -> Tuple[List[
             return lhs.concat(rhs, x_offset=x_offset, y_offset=y_offset)
 
         result = reduce(lambda output, line: append_line(output, line, center), output, TextGroup.empty())
+        # flatten here, so the result can be shared between threads (see layout_text)
+        result.items
     except:
         LOG.info('quirks %s', quirks)
         MarkupLogHandler.get().flush()
@@ -705,6 +832,66 @@ def layout(tokens: Iterator[Token], max_width: int, center: bool) -> Tuple[List[
 
     return quirks, result
 
+Quirks = List[Tuple[str, Optional[str], Optional[Tuple[int, int]]]]
+
+# increment whenever layout() output changes, so stored layouts aren't reused
+LAYOUT_VERSION = 1
+
+def dump_layout(quirks: Quirks, group: TextGroup) -> str:
+    box = group.box
+    return json.dumps({
+        'quirks': quirks,
+        'box': [box.width, box.height, box.baseline],
+        'items': [[item.x, item.y, item.text] for item in group.items]},
+        ensure_ascii=False, separators=(',', ':'))
+
+def load_layout(s: str) -> Tuple[Quirks, TextGroup]:
+    '''inverse of dump_layout'''
+    data = json.loads(s)
+    quirks: Quirks = [
+        (description, scope, tuple(range_) if range_ else None) # type: ignore
+        for description, scope, range_ in data['quirks']]
+    items = [Text(x, y, text) for x, y, text in data['items']]
+    return quirks, TextGroup(TextBox(*data['box']), items)
+
+LAYOUT_CACHE_ENTRIES = 4096
+LAYOUT_CACHE_SIZE    = 8 << 20
+
+def layout_size(value: Tuple[Quirks, TextGroup]) -> int:
+    '''rough memory use of a cached layout, in bytes (counting the key's text as about the same as the items' text)'''
+    quirks, group = value
+    return 256 + 128 * len(quirks) + sum(96 + 2 * sys.getsizeof(item.text) for item in group.items)
+
+# shared by every thread (e.g. the servers'), so guarded by a lock
+LAYOUT_CACHE = LruCache(LAYOUT_CACHE_ENTRIES, LAYOUT_CACHE_SIZE, layout_size)
+LAYOUT_CACHE_LOCK = threading.Lock()
+
+def layout_text(text: str, max_width: int, center: bool) -> Tuple[Quirks, TextGroup]:
+    '''
+    tokenizes, normalizes and lays out text, reusing the result for the same
+    text, width and macros
+
+    The result is shared, so callers must not modify it.
+    '''
+    generation = Macro.generation
+    result = get_cached_layout(text, max_width, center)
+    if result is None:
+        result = layout(iter(scan(text)), max_width, center)
+        cache_layout(text, max_width, center, result, generation)
+    return result
+
+def get_cached_layout(text: str, max_width: int, center: bool) -> Optional[Tuple[Quirks, TextGroup]]:
+    with LAYOUT_CACHE_LOCK:
+        cached = LAYOUT_CACHE.get((text, max_width, center, Macro.generation))
+    return None if cached is LruCache.MISSING else cached
+
+def cache_layout(text: str, max_width: int, center: bool, result: Tuple[Quirks, TextGroup], generation: int):
+    '''adds a layout made with the macros of the given Macro.generation to the cache'''
+    with LAYOUT_CACHE_LOCK:
+        # not if a macro changed in the meantime; the key would never be looked up again
+        if generation == Macro.generation:
+            LAYOUT_CACHE.put((text, max_width, center, generation), result)
+
 if __name__ == '__main__':
     log_handler = logging.FileHandler('markup.log', encoding='utf-8')
     log_handler.setLevel(logging.DEBUG)
@@ -723,7 +910,7 @@ if __name__ == '__main__':
             if not s:
                 break
 
-            quirks, group = layout(normalize(tokenize(s)), 20, True)
+            quirks, group = layout(iter(scan(s)), 20, True)
 
             sys.stdout.write(ANSI_SAVE + ANSI_CLEAR)
             for item in group.items:
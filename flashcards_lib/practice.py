@@ -0,0 +1,99 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unicodedata
+from random import shuffle
+from typing import List, Optional, Tuple
+
+from flashcards_lib.database import Cursor
+
+class QuestionResult:
+    __slots__ = ()
+
+RESULT_PASS = QuestionResult()
+RESULT_FAIL = QuestionResult()
+
+Card = Tuple[int, str, str, str, int] # id, deck name, front, back, streak
+
+MAX_STREAK = 31
+
+def normalize_answer(s: str) -> str:
+    return ' '.join(unicodedata.normalize('NFKD', s).lower().split())
+
+def check_answer(expected: str, answer: str) -> QuestionResult:
+    return RESULT_PASS if normalize_answer(expected) == normalize_answer(answer) else RESULT_FAIL
+
+def schedule(counter: int, streak: int, result: QuestionResult) -> Tuple[int, Optional[int]]:
+    '''returns the new (streak, review_at) for a card answered in the round numbered "counter"'''
+    if result == RESULT_PASS:
+        streak = min(streak + 1, MAX_STREAK)
+        return streak, counter + 2**streak
+    return 0, None
+
+class PracticeRound:
+    '''the cards of one round of practice: waiting, current, and answered'''
+
+    __slots__ = 'session_id', 'round_cards', 'ready', 'current', 'done', 'counter'
+
+    ready: List[Card]
+    current: Optional[Card]
+    done: List[Tuple[int, int]]
+
+    def __init__(self, session_id: int, round_cards: int):
+        self.session_id  = session_id
+        self.round_cards = round_cards
+        self.ready       = []
+        self.current     = None
+        self.done        = []
+        self.counter     = 0
+
+    def start(self, cur: Cursor):
+        self.current = None
+        self.done    = []
+
+        cur.increment_session_counter(self.session_id)
+        self.counter = cur.get_session_counter(self.session_id)
+        review_cards = cur.get_review_cards(self.session_id, self.round_cards)
+        new_cards = cur.get_new_cards(self.session_id, self.round_cards - len(review_cards))
+        self.ready  = [(card_id, deck_name, front, back, streak) for card_id, deck_name, front, back, streak in review_cards]
+        self.ready += [(card_id, deck_name, front, back,      0) for card_id, deck_name, front, back         in new_cards   ]
+        shuffle(self.ready)
+
+    def next(self) -> Optional[Card]:
+        self.current = self.ready.pop() if self.ready else None
+        return self.current
+
+    @property
+    def number(self) -> int:
+        return len(self.done) + 1
+
+    @property
+    def total(self) -> int:
+        return len(self.ready) + len(self.done) + (1 if self.current else 0)
+
+    def answer(self, answer: str) -> Tuple[Card, QuestionResult]:
+        assert self.current is not None
+        card = self.current
+        card_id, deck_name, front, back, streak = card
+        self.done.append((card_id, streak))
+        self.current = None
+        return card, check_answer(back, answer)
+
+    def streak(self, card_id: int) -> int:
+        '''the streak a card answered this round had before it was answered'''
+        return next(streak for card_id_, streak in self.done if card_id_ == card_id)
+
+    def is_answered(self, card_id: int) -> bool:
+        return any(card_id_ == card_id for card_id_, _ in self.done)
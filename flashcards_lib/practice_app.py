@@ -13,8 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import codecs, logging, sys
-from msvcrt import getwch # type: ignore
+import codecs, logging
 from pathlib import Path
 from typing import Any, Callable, Optional, Tuple, Union
 
@@ -28,16 +27,12 @@ from flashcards_lib.console_ui import (
     Input,
     MarkupDrawer,
     ASCII_ESC,
-    MS_KEY_ESC0,
-    MS_KEY_ESC1,
     MS_KEY_DOWN,
     MS_KEY_UP)
+from flashcards_lib.practice import QuestionResult, RESULT_PASS, RESULT_FAIL
+from flashcards_lib.terminal import Terminal, is_special_key
+from flashcards_lib.util import unicode_width
 
-class QuestionResult:
-    __slots__ = ()
-
-RESULT_PASS = QuestionResult()
-RESULT_FAIL = QuestionResult()
 
 class HistoryData:
     __slots__ = 'id', 'modified', 'result', 'question', 'expected', 'answered'
@@ -60,15 +55,16 @@ class HistoryForm:
     __slots__ = 'result', 'question', 'expected', 'answered'
 
     def __init__(self,
+        term    : Terminal,
         result  : Box,
         question: Box,
         expected: Box,
         answered: Box
     ):
-        self.result   = Formatter(*result, False, False)
-        self.question = MarkupDrawer(*question, False, False)
-        self.expected = MarkupDrawer(*expected, False, False)
-        self.answered = MarkupDrawer(*answered, False, False)
+        self.result   = Formatter(term, *result, False, False)
+        self.question = MarkupDrawer(term, *question, False, False)
+        self.expected = MarkupDrawer(term, *expected, False, False)
+        self.answered = MarkupDrawer(term, *answered, False, False)
 
     def update_result(self, result: Optional[QuestionResult], highlight: bool):
         if result is None:
@@ -104,54 +100,67 @@ class HistoryForm:
         self.update_expected(data.expected)
         self.update_answered(data.answered)
 
-HISTORY_FORMS = (
-    HistoryForm((16, 3, 1, 9), (16, 14, 2, 104), (18, 14, 2, 104), (20, 14, 2, 104)),
-    HistoryForm(( 9, 3, 1, 9), ( 9, 14, 2, 104), (11, 14, 2, 104), (13, 14, 2, 104)),
-    HistoryForm(( 2, 3, 1, 9), ( 2, 14, 2, 104), ( 4, 14, 2, 104), ( 6, 14, 2, 104)))
+HISTORY_BOXES = (
+    ((16, 3, 1, 9), (16, 14, 2, 104), (18, 14, 2, 104), (20, 14, 2, 104)),
+    (( 9, 3, 1, 9), ( 9, 14, 2, 104), (11, 14, 2, 104), (13, 14, 2, 104)),
+    (( 2, 3, 1, 9), ( 2, 14, 2, 104), ( 4, 14, 2, 104), ( 6, 14, 2, 104)))
 
 QUESTION_BOX = (23, 3, 3, 115)
 NUMBER_BOX   = (22, 3, 1,   2)
 TOTAL_BOX    = (22, 6, 1,   2)
+LABEL_BOX    = (22, 14, 1, 104) # on the border above QUESTION_BOX
 ANSWER_BOX   = (27, 3, 2, 115)
 
+# (width, center) of card fronts in QUESTION_BOX, see PracticeRound; the
+# question is only the front, so it's laid out the way it's cached (see
+# render_cache.py), and the card's label is drawn in LABEL_BOX
+FRONT_LAYOUT = (QUESTION_BOX[3], True)
+
 class PracticeApp:
     selected: Optional[int]
 
-    def __init__(self, on_submit: Callable[[str], bool], on_revise: Callable[[Any, QuestionResult], None]):
-        self.answer    = Input(ANSWER_BOX)
-        self.history   = [HistoryData() for _ in HISTORY_FORMS]
-        self.question = MarkupDrawer(*QUESTION_BOX, True , True )
+    def __init__(self,
+        term: Terminal,
+        on_submit: Callable[[str], bool],
+        on_revise: Callable[[Any, QuestionResult], None]
+    ):
+        self.term      = term
+        self.answer    = Input(term, ANSWER_BOX)
+        self.forms     = [HistoryForm(term, *boxes) for boxes in HISTORY_BOXES]
+        self.history   = [HistoryData() for _ in self.forms]
+        self.question = MarkupDrawer(term, *QUESTION_BOX, True , True )
         self.selected  = None
         self.on_submit = on_submit
         self.on_revise = on_revise
 
-        sys.stdout.write(ANSI_CLEAR + ANSI_RESET)
+        term.write(ANSI_CLEAR + ANSI_RESET)
 
         lib_path = Path(__file__).parent
         with codecs.open(lib_path / 'practice_ui_utf8.txt', 'r', 'utf-8') as f: # type: ignore
-            sys.stdout.write(f.read())
+            term.write(f.read())
 
-        sys.stdout.write(ansi_pos(ANSWER_BOX[0], ANSWER_BOX[1]))
-        sys.stdout.flush()
+        term.write(ansi_pos(ANSWER_BOX[0], ANSWER_BOX[1]))
+        self.answer.focus()
+        term.flush()
 
     def __del__(self):
-        sys.stdout.write(ansi_col(0) + ANSI_DOWN * 3)
-        sys.stdout.flush()
+        self.term.write(ansi_col(0) + ANSI_DOWN * 3)
+        self.term.flush()
 
     def redraw_history(self):
-        for i, (form, data) in enumerate(zip(HISTORY_FORMS, self.history)):
+        for i, (form, data) in enumerate(zip(self.forms, self.history)):
             form.update(data, i == self.selected)
 
     def clear_history(self):
-        self.history = [HistoryData() for _ in HISTORY_FORMS]
+        self.history = [HistoryData() for _ in self.forms]
         self.redraw_history()
 
     def push_history(self, id: Any, result: QuestionResult, question: str, expected: str, answered: str):
         item = HistoryData(id, result, question, expected, answered)
-        self.history = [item] + self.history[:len(HISTORY_FORMS)-1]
+        self.history = [item] + self.history[:len(self.forms)-1]
         self.redraw_history()
 
-    def update_question(self, question: str, number: Union[int, str], total: Union[int, str]):
+    def update_question(self, question: str, number: Union[int, str], total: Union[int, str], label: str = ''):
         number = str(number)
         if len(number) > NUMBER_BOX[3]:
             number = '#' * NUMBER_BOX[3]
@@ -164,10 +173,15 @@ class PracticeApp:
         else:
             total = total.rjust(TOTAL_BOX[3])
 
-        sys.stdout.write(
+        while unicode_width(label) > LABEL_BOX[3]:
+            label = label[:-1]
+        label += '═' * (LABEL_BOX[3] - unicode_width(label))
+
+        self.term.write(
             ANSI_SAVE +
             ansi_pos(NUMBER_BOX[0], NUMBER_BOX[1]) + number +
             ansi_pos(TOTAL_BOX [0], TOTAL_BOX [1]) + total  +
+            ansi_pos(LABEL_BOX [0], LABEL_BOX [1]) + label  +
             ANSI_RESTORE)
 
         self.question.text = question
@@ -180,16 +194,16 @@ class PracticeApp:
                 history_data.modified = False
                 assert history_data.result is not None
                 self.on_revise(history_data.id, history_data.result)
-            HISTORY_FORMS[self.selected].update_result(history_data.result, False)
+            self.forms[self.selected].update_result(history_data.result, False)
 
         self.selected = selected
 
         if self.selected is not None:
             history_data = self.history[self.selected]
-            HISTORY_FORMS[self.selected].update_result(history_data.result, True)
+            self.forms[self.selected].update_result(history_data.result, True)
 
     def select_item(self, up: bool):
-        n = len(HISTORY_FORMS)
+        n = len(self.forms)
         if up:
             if self.selected is None:
                 self.set_selected(0)
@@ -216,32 +230,45 @@ class PracticeApp:
         else:
             history_data.result = RESULT_PASS
         history_data.modified = True
-        HISTORY_FORMS[self.selected].update_result(history_data.result, True)
+        self.forms[self.selected].update_result(history_data.result, True)
+
+    def process_key(self, key: str) -> bool:
+        '''handles one key (as returned by Terminal.getkey); returns False when the user quits'''
+        if self.selected is None:
+            event_or_input = self.answer.process_key(key)
+            if event_or_input is None:
+                return True
+            elif isinstance(event_or_input, str):
+                # submitting keeps the input focused (and other widgets
+                # restore the cursor), so there's nothing to redraw
+                return self.on_submit(event_or_input)
+            elif event_or_input == Input.UNFOCUS:
+                return False
+            elif event_or_input == Input.KEY_UP:
+                self.select_item(True)
+            elif event_or_input == Input.KEY_DOWN:
+                self.select_item(False)
+        else:
+            char = key[0]
+            if char == ASCII_ESC:
+                self.set_selected(None)
+            elif char == '\x03' or char == '\x04':
+                raise KeyboardInterrupt()
+            elif is_special_key(key):
+                char2 = key[1:]
+                if char2 == MS_KEY_UP or char2 == MS_KEY_DOWN:
+                    self.select_item(char2 == MS_KEY_UP)
+            elif char in (' ', '\u3000'):
+                self.toggle_item()
+                self.set_selected(None)
+        # every other event unfocused the input, and it stays unfocused
+        # while a history item is selected
+        if self.selected is None:
+            self.answer.focus()
+        return True
 
     def main(self) -> int:
-        while True:
-            if self.selected is None:
-                event_or_input = self.answer.get_input()
-                if isinstance(event_or_input, str):
-                    if not self.on_submit(event_or_input):
-                        return 0
-                elif event_or_input == Input.UNFOCUS:
-                    return 0
-                elif event_or_input == Input.KEY_UP:
-                    self.select_item(True)
-                elif event_or_input == Input.KEY_DOWN:
-                    self.select_item(False)
-            else:
-                char = getwch()
-                if char == ASCII_ESC:
-                    self.set_selected(None)
-                elif char == '\x03' or char == '\x04':
-                    raise KeyboardInterrupt()
-                elif char == MS_KEY_ESC0 or char == MS_KEY_ESC1:
-                    char2 = getwch()
-                    if char2 == MS_KEY_UP or char2 == MS_KEY_DOWN:
-                        self.select_item(char2 == MS_KEY_UP)
-                elif char in (' ', '\u3000'):
-                    self.toggle_item()
-                    self.set_selected(None)
-            sys.stdout.flush()
\ No newline at end of file
+        while self.process_key(self.term.getkey()):
+            self.term.flush()
+        self.term.flush()
+        return 0
@@ -0,0 +1,93 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Layouts of card text are stored in the database's render_cache table, so
+# a new process (or a new round) doesn't need to lay out text it has laid out
+# before.  Rows are keyed by a hash of the text, the layout width and the
+# macros it was laid out with; cards and macros delete stale rows when they
+# change (see Cursor.update_card and Cursor.create_macro).
+
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+from flashcards_lib.database import text_hash, Cursor, Database
+from flashcards_lib.markup import cache_layout, dump_layout, get_cached_layout, layout, load_layout, scan, Macro
+
+LOG = logging.getLogger(__name__)
+
+class LayoutPrefetch:
+    '''
+    loads the layouts of texts into markup's in-memory cache, from the
+    database where possible, laying out and storing the rest
+
+    Laying out is slow, so it's a separate step that needs no transaction:
+    load(cur) reads stored layouts, compute() lays out the texts that had
+    none, and store(cur) writes those back.
+    '''
+
+    __slots__ = 'width', 'center', 'generation', 'macro_hash', 'pending', 'new_layouts'
+
+    pending: Dict[bytes, str]
+    new_layouts: List[Tuple[bytes, str]]
+
+    def __init__(self, texts: Iterable[str], width: int, center: bool):
+        self.width       = width
+        self.center      = center
+        # read first, see Macro.registry_hash
+        self.generation  = Macro.generation
+        self.macro_hash  = Macro.registry_hash()
+        self.pending     = {
+            text_hash(text): text for text in texts
+            if get_cached_layout(text, width, center) is None}
+        self.new_layouts = []
+
+    def load(self, cur: Cursor):
+        if not self.pending:
+            return
+        stored = cur.get_render_cache([*self.pending], self.width, self.center, self.macro_hash)
+        for hash_, layout_ in stored.items():
+            cache_layout(self.pending.pop(hash_), self.width, self.center, load_layout(layout_), self.generation)
+        LOG.debug('prefetched %d layouts', len(stored))
+
+    def compute(self) -> int:
+        '''returns the number of texts that had to be laid out'''
+        for hash_, text in self.pending.items():
+            result = layout(iter(scan(text)), self.width, self.center)
+            cache_layout(text, self.width, self.center, result, self.generation)
+            self.new_layouts.append((hash_, dump_layout(*result)))
+        self.pending = {}
+        LOG.debug('laid out %d texts', len(self.new_layouts))
+        return len(self.new_layouts)
+
+    def store(self, cur: Cursor):
+        cur.put_render_cache(self.new_layouts, self.width, self.center, self.macro_hash)
+        self.new_layouts = []
+
+def prefetch_layouts(db: Database, texts: Iterable[str], width: int, center: bool) -> int:
+    '''
+    LayoutPrefetch with a read transaction to load and a short write
+    transaction to store
+
+    returns the number of texts that had to be laid out
+    '''
+    prefetch = LayoutPrefetch(texts, width, center)
+    if not prefetch.pending:
+        return 0
+    with db as cur:
+        prefetch.load(cur)
+    count = prefetch.compute()
+    if count:
+        db.retry(prefetch.store)
+    return count
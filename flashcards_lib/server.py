@@ -0,0 +1,311 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json, logging, re, secrets, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from flashcards_lib import markup
+from flashcards_lib.database import Cursor, DatabasePool
+from flashcards_lib.practice import check_answer, schedule, PracticeRound, QuestionResult, RESULT_PASS, RESULT_FAIL
+
+LOG = logging.getLogger(__name__)
+
+RESULTS = {'pass': RESULT_PASS, 'fail': RESULT_FAIL}
+
+DEFAULT_WIDTH = 115
+MAX_WIDTH     = 1000
+MAX_BODY      = 1 << 16
+
+class HttpError(Exception):
+    __slots__ = 'status', 'message'
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status  = status
+        self.message = message
+
+def render(text: str, width: int) -> Dict[str, Any]:
+    quirks, group = markup.layout_text(text, width, True)
+    return {
+        'text': text,
+        'quirks': [
+            {'description': description, 'scope': scope, 'range': range_}
+            for description, scope, range_ in quirks],
+        'box': {
+            'width': group.box.width,
+            'height': group.box.height,
+            'baseline': group.box.baseline},
+        'items': [[item.x, item.y, item.text] for item in group.items]}
+
+class ServerRound:
+    '''a practice round, plus what the server needs to share it between requests'''
+
+    __slots__ = 'round', 'lock', 'last_used', 'front'
+
+    front: Optional[Tuple[int, int, Dict[str, Any]]] # card id, width, rendering
+
+    def __init__(self, round_: PracticeRound):
+        self.round     = round_
+        self.lock      = threading.Lock()
+        self.last_used = time.monotonic()
+        self.front     = None
+
+class Server(ThreadingHTTPServer):
+    '''
+    JSON API for practice sessions
+
+        POST /sessions/<name>/rounds             start a round
+        GET  /rounds/<id>/next?width=<columns>   current card, front laid out
+        POST /rounds/<id>/answer   {"answer": ...}
+        POST /rounds/<id>/revise   {"card_id": ..., "result": "pass"|"fail"}
+        DELETE /rounds/<id>
+
+    Each connection gets its own thread.  Rounds live in memory only and are
+    dropped after round_timeout_s without a request; answers are written
+    through to the database.
+    '''
+
+    daemon_threads = True
+    # the default of 5 drops connections when many clients connect at once
+    request_queue_size = 128
+
+    rounds: Dict[str, ServerRound]
+
+    def __init__(self,
+        address: Tuple[str, int],
+        pool: DatabasePool,
+        round_cards: int = 10,
+        round_timeout_s: float = 3600.0
+    ):
+        super().__init__(address, RequestHandler)
+        self.pool            = pool
+        self.round_cards     = round_cards
+        self.round_timeout_s = round_timeout_s
+        self.rounds          = {}
+        self.rounds_lock     = threading.Lock()
+        self.last_evicted    = time.monotonic()
+
+    def load_macros(self):
+        with self.pool.reader() as cur:
+            macros = cur.list_macros()
+        for macro_id, name, definition in macros:
+            markup.Macro.create(name, definition)
+
+    def start_round(self, session_name: str) -> Tuple[str, PracticeRound]:
+        with self.pool.reader() as cur:
+            try:
+                session_id = cur.get_session_id(session_name)
+            except Exception as e:
+                raise HttpError(404, str(e))
+        round_ = PracticeRound(session_id, self.round_cards)
+        self.pool.retry(round_.start)
+
+        round_id = secrets.token_urlsafe(16)
+        with self.rounds_lock:
+            self.evict_rounds()
+            self.rounds[round_id] = ServerRound(round_)
+        return round_id, round_
+
+    def get_round(self, round_id: str) -> ServerRound:
+        with self.rounds_lock:
+            self.evict_rounds()
+            try:
+                round_ = self.rounds[round_id]
+            except KeyError:
+                raise HttpError(404, 'no such round')
+            round_.last_used = time.monotonic()
+            return round_
+
+    def end_round(self, round_id: str):
+        with self.rounds_lock:
+            if self.rounds.pop(round_id, None) is None:
+                raise HttpError(404, 'no such round')
+
+    def evict_rounds(self):
+        now = time.monotonic()
+        if now - self.last_evicted < 60.0:
+            return
+        self.last_evicted = now
+        expired = [round_id for round_id, round_ in self.rounds.items()
+            if now - round_.last_used > self.round_timeout_s]
+        for round_id in expired:
+            del self.rounds[round_id]
+        if expired:
+            LOG.info('dropped %d idle rounds', len(expired))
+
+    def update_card(self, session_id: int, card_id: int, streak: int, result: QuestionResult) -> Tuple[int, Optional[int]]:
+        def update(cur: Cursor) -> Tuple[int, Optional[int]]:
+            streak_, review_at = schedule(cur.get_session_counter(session_id), streak, result)
+            cur.update_session_card(session_id, card_id, streak_, review_at)
+            return streak_, review_at
+
+        return self.pool.retry(update)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; with Nagle's algorithm the body
+    # waits on the client's delayed ACK (~40ms) on keep-alive connections
+    disable_nagle_algorithm = True
+
+    server: Server
+
+    ROUTES = (
+        ('POST'  , re.compile(r'/sessions/([^/]+)/rounds'), 'post_rounds'),
+        ('GET'   , re.compile(r'/rounds/([\w-]+)/next'   ), 'get_next'   ),
+        ('POST'  , re.compile(r'/rounds/([\w-]+)/answer' ), 'post_answer'),
+        ('POST'  , re.compile(r'/rounds/([\w-]+)/revise' ), 'post_revise'),
+        ('DELETE', re.compile(r'/rounds/([\w-]+)'        ), 'delete_round'),
+    )
+
+    def log_message(self, format: str, *args: Any):
+        LOG.debug('%s %s', self.address_string(), format % args)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method: str):
+        url = urlsplit(self.path)
+        try:
+            body = self.read_body()
+            for method_, pattern, name in RequestHandler.ROUTES:
+                match = pattern.fullmatch(url.path)
+                if match:
+                    if method_ != method:
+                        continue
+                    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                    self.send_json(200, getattr(self, name)(*match.groups(), query=query, body=body))
+                    return
+            raise HttpError(404, 'not found')
+        except HttpError as e:
+            self.send_json(e.status, {'error': e.message})
+        except Exception:
+            LOG.exception('error handling %s %s', method, self.path)
+            self.send_json(500, {'error': 'internal error'})
+
+    def read_body(self) -> Any:
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            self.close_connection = True
+            raise HttpError(413, 'request body too large')
+        if not length:
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except (ValueError, UnicodeDecodeError):
+            raise HttpError(400, 'request body is not valid JSON')
+
+    def send_json(self, status: int, value: Any):
+        data = json.dumps(value, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def field(body: Any, name: str, type_: type) -> Any:
+        if not isinstance(body, dict) or not isinstance(body.get(name), type_):
+            raise HttpError(400, f'expected "{name}" in request body')
+        return body[name]
+
+    def post_rounds(self, session_name: str, query: Dict[str, str], body: Any) -> Any:
+        round_id, round_ = self.server.start_round(unquote(session_name))
+        return {'round': round_id, 'counter': round_.counter, 'cards': len(round_.ready)}
+
+    def get_next(self, round_id: str, query: Dict[str, str], body: Any) -> Any:
+        try:
+            width = int(query.get('width', DEFAULT_WIDTH))
+        except ValueError:
+            raise HttpError(400, '"width" must be an integer')
+        if not 0 < width <= MAX_WIDTH:
+            raise HttpError(400, f'"width" must be between 1 and {MAX_WIDTH}')
+
+        server_round = self.server.get_round(round_id)
+        with server_round.lock:
+            round_ = server_round.round
+            card = round_.current or round_.next()
+            if card is None:
+                return {'card': None, 'answered': len(round_.done)}
+            card_id, deck_name, front, back, streak = card
+            # repeated requests for the same card are common (e.g. retries), so
+            # keep the last layout
+            if server_round.front is None or server_round.front[:2] != (card_id, width):
+                server_round.front = card_id, width, render(front, width)
+            return {
+                'card': {'id': card_id, 'deck': deck_name, 'front': server_round.front[2]},
+                'number': round_.number,
+                'total': round_.total}
+
+    def post_answer(self, round_id: str, query: Dict[str, str], body: Any) -> Any:
+        answer = RequestHandler.field(body, 'answer', str)
+        server_round = self.server.get_round(round_id)
+        with server_round.lock:
+            round_ = server_round.round
+            if round_.current is None:
+                raise HttpError(409, 'no current card (request the next card first)')
+            card_id, deck_name, front, back, streak = round_.current
+            # written before the round moves on, so a failed write can be retried
+            result = check_answer(back, answer)
+            streak, review_at = self.server.update_card(round_.session_id, card_id, streak, result)
+            round_.answer(answer)
+        return {
+            'card_id': card_id,
+            'result': 'pass' if result == RESULT_PASS else 'fail',
+            'back': back,
+            'streak': streak,
+            'review_at': review_at}
+
+    def post_revise(self, round_id: str, query: Dict[str, str], body: Any) -> Any:
+        card_id = RequestHandler.field(body, 'card_id', int)
+        try:
+            result = RESULTS[RequestHandler.field(body, 'result', str)]
+        except KeyError:
+            raise HttpError(400, '"result" must be "pass" or "fail"')
+        server_round = self.server.get_round(round_id)
+        with server_round.lock:
+            round_ = server_round.round
+            if not round_.is_answered(card_id):
+                raise HttpError(409, 'card has not been answered in this round')
+            streak, review_at = self.server.update_card(round_.session_id, card_id, round_.streak(card_id), result)
+        return {'card_id': card_id, 'streak': streak, 'review_at': review_at}
+
+    def delete_round(self, round_id: str, query: Dict[str, str], body: Any) -> Any:
+        self.server.end_round(round_id)
+        return {}
+
+def serve(path: str, profile: str, busy_timeout_s: float, host: str, port: int, max_readers: int, round_cards: int = 10) -> int:
+    pool = DatabasePool(path, profile, max_readers, busy_timeout_s=busy_timeout_s)
+    try:
+        server = Server((host, port), pool, round_cards)
+        server.load_macros()
+        LOG.info('serving on %s:%d', *server.server_address[:2])
+        print(f'serving on http://{server.server_address[0]}:{server.server_address[1]}/ (Ctrl+C to stop)')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    finally:
+        pool.close()
+    return 0
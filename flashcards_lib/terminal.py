@@ -0,0 +1,100 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+from typing import Callable, List
+
+if sys.platform == 'win32':
+    from msvcrt import getwch, kbhit # type: ignore
+
+# msvcrt.getwch reports special keys (arrows, etc.) as one of these followed by a scan code
+MS_KEY_ESC0  = '\x00'
+MS_KEY_ESC1  = '\xe0'
+
+def is_special_key(key: str) -> bool:
+    '''
+    whether key (as returned by Terminal.getkey) is a special key; typed
+    characters can be MS_KEY_ESC1 too ('\xe0' is "à"), but arrive alone
+    '''
+    return len(key) == 2 and (key[0] == MS_KEY_ESC0 or key[0] == MS_KEY_ESC1)
+
+class Terminal:
+    '''
+    where the UI is drawn and where keys come from
+
+    Output is buffered until flush(), which the apps call once per frame
+    (i.e. after handling each key).  Keys use msvcrt.getwch conventions:
+    special keys are MS_KEY_ESC0 or MS_KEY_ESC1 followed by a scan code.
+    '''
+
+    __slots__ = ()
+
+    def write(self, s: str):
+        raise NotImplementedError()
+
+    def flush(self):
+        raise NotImplementedError()
+
+    def getwch(self) -> str:
+        raise NotImplementedError()
+
+    def kbhit(self) -> bool:
+        raise NotImplementedError()
+
+    def getkey(self) -> str:
+        '''blocks for the next key, returning both characters of special keys'''
+        char = self.getwch()
+        if char == MS_KEY_ESC0 or char == MS_KEY_ESC1:
+            char += self.getwch()
+        return char
+
+class ConsoleTerminal(Terminal):
+    '''this process' own console (Windows only)'''
+
+    __slots__ = ()
+
+    def write(self, s: str):
+        sys.stdout.write(s)
+
+    def flush(self):
+        sys.stdout.flush()
+
+    def getwch(self) -> str:
+        return getwch()
+
+    def kbhit(self) -> bool:
+        return kbhit()
+
+class BufferedTerminal(Terminal):
+    '''
+    collects output for a terminal on the other end of a stream; each flush()
+    passes one frame to send.  Keys are pushed to the app rather than read
+    from here.
+    '''
+
+    __slots__ = 'buffer', 'send'
+
+    def __init__(self, send: Callable[[str], None]):
+        self.buffer: List[str] = []
+        self.send = send
+
+    def write(self, s: str):
+        self.buffer.append(s)
+
+    def flush(self):
+        if self.buffer:
+            frame = ''.join(self.buffer)
+            self.buffer = []
+            self.send(frame)
@@ -0,0 +1,364 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio, codecs, logging
+from typing import AsyncIterator, List, Optional, Set
+
+from flashcards_lib.async_database import AsyncDatabase
+from flashcards_lib.ansi_esc import *
+from flashcards_lib.console_ui import (
+    Input,
+    ASCII_BACKSPACE,
+    ASCII_ESC,
+    MS_KEY_DOWN,
+    MS_KEY_END,
+    MS_KEY_HOME,
+    MS_KEY_LEFT,
+    MS_KEY_PAGE_DOWN,
+    MS_KEY_PAGE_UP,
+    MS_KEY_RIGHT,
+    MS_KEY_UP)
+from flashcards_lib.markup import Macro
+from flashcards_lib.practice import normalize_answer, schedule, PracticeRound, QuestionResult
+from flashcards_lib.practice_app import PracticeApp, FRONT_LAYOUT
+from flashcards_lib.render_cache import LayoutPrefetch
+from flashcards_lib.terminal import BufferedTerminal, MS_KEY_ESC1
+
+LOG = logging.getLogger(__name__)
+
+TELNET_IAC  = 255
+TELNET_DONT = 254
+TELNET_DO   = 253
+TELNET_WONT = 252
+TELNET_WILL = 251
+TELNET_SB   = 250
+TELNET_SE   = 240
+TELNET_ECHO = 1
+TELNET_SGA  = 3
+
+# asks the client for character-at-a-time input without local echo
+TELNET_SETUP = bytes((
+    TELNET_IAC, TELNET_WILL, TELNET_ECHO,
+    TELNET_IAC, TELNET_WILL, TELNET_SGA,
+    TELNET_IAC, TELNET_DO  , TELNET_SGA))
+
+# final byte of a VT input sequence ("ESC [ <params> <final>" or "ESC O <final>")
+VT_KEYS = {
+    'A': MS_KEY_UP,
+    'B': MS_KEY_DOWN,
+    'C': MS_KEY_RIGHT,
+    'D': MS_KEY_LEFT,
+    'H': MS_KEY_HOME,
+    'F': MS_KEY_END,
+}
+
+# "ESC [ <n> ~" sequences
+VT_TILDE_KEYS = {
+    '1': MS_KEY_HOME,
+    '4': MS_KEY_END,
+    '5': MS_KEY_PAGE_UP,
+    '6': MS_KEY_PAGE_DOWN,
+    '7': MS_KEY_HOME,
+    '8': MS_KEY_END,
+}
+
+class TelnetDecoder:
+    '''strips telnet commands from a byte stream and decodes the rest as UTF-8'''
+
+    __slots__ = 'state', 'decoder'
+
+    DATA, IAC, OPTION, SB, SB_IAC = range(5)
+
+    def __init__(self):
+        self.state   = TelnetDecoder.DATA
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def decode(self, data: bytes) -> str:
+        out = bytearray()
+        for byte in data:
+            if self.state == TelnetDecoder.DATA:
+                if byte == TELNET_IAC:
+                    self.state = TelnetDecoder.IAC
+                else:
+                    out.append(byte)
+            elif self.state == TelnetDecoder.IAC:
+                if byte == TELNET_IAC:
+                    out.append(byte)
+                    self.state = TelnetDecoder.DATA
+                elif byte == TELNET_SB:
+                    self.state = TelnetDecoder.SB
+                elif byte in (TELNET_WILL, TELNET_WONT, TELNET_DO, TELNET_DONT):
+                    self.state = TelnetDecoder.OPTION
+                else:
+                    self.state = TelnetDecoder.DATA
+            elif self.state == TelnetDecoder.OPTION:
+                self.state = TelnetDecoder.DATA
+            elif self.state == TelnetDecoder.SB:
+                if byte == TELNET_IAC:
+                    self.state = TelnetDecoder.SB_IAC
+            elif self.state == TelnetDecoder.SB_IAC:
+                self.state = TelnetDecoder.DATA if byte == TELNET_SE else TelnetDecoder.SB
+        return self.decoder.decode(bytes(out))
+
+class KeyDecoder:
+    '''
+    translates VT terminal input into keys as returned by Terminal.getkey
+
+    An escape at the end of a chunk of input is taken to be the escape key,
+    since terminals send whole sequences at once.
+    '''
+
+    __slots__ = 'pending', 'last'
+
+    def __init__(self):
+        self.pending = ''
+        self.last    = ''
+
+    def decode(self, text: str) -> List[str]:
+        text = self.pending + text
+        self.pending = ''
+        keys: List[str] = []
+        i = 0
+        while i < len(text):
+            char = text[i]
+            i += 1
+            if char == ASCII_ESC and i < len(text) and text[i] in '[O':
+                # find the final byte of the sequence
+                j = i + 1
+                while j < len(text) and not ('@' <= text[j] <= '~'):
+                    j += 1
+                if j == len(text):
+                    self.pending = text[i-1:]
+                    break
+                params, final = text[i+1:j], text[j]
+                i = j + 1
+                if final in VT_KEYS:
+                    keys.append(MS_KEY_ESC1 + VT_KEYS[final])
+                elif final == '~' and params in VT_TILDE_KEYS:
+                    keys.append(MS_KEY_ESC1 + VT_TILDE_KEYS[params])
+                continue
+            elif char == '\x7f':
+                char = ASCII_BACKSPACE
+            elif char in ('\0', '\n') and self.last == '\r':
+                # telnet sends enter as CR NUL or CR LF
+                self.last = ''
+                continue
+            self.last = char
+            keys.append(char)
+        return keys
+
+class TerminalSession:
+    '''one learner's practice session, over one connection'''
+
+    __slots__ = (
+        'db',
+        'reader',
+        'writer',
+        'term',
+        'round_cards',
+        'round',
+        'app',
+        'starting',
+        'tasks')
+
+    round: Optional[PracticeRound]
+    app: Optional[PracticeApp]
+    tasks: Set[asyncio.Task]
+
+    def __init__(self, db: AsyncDatabase, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, round_cards: int):
+        self.db          = db
+        self.reader      = reader
+        self.writer      = writer
+        self.term        = BufferedTerminal(self.send)
+        self.round_cards = round_cards
+        self.round       = None
+        self.app         = None
+        self.starting    = False
+        self.tasks       = set()
+
+    def send(self, frame: str):
+        if not self.writer.is_closing():
+            self.writer.write(frame.replace('\n', '\r\n').encode('utf-8'))
+
+    async def keys(self) -> AsyncIterator[List[str]]:
+        telnet = TelnetDecoder()
+        keys = KeyDecoder()
+        while True:
+            data = await self.reader.read(4096)
+            if not data:
+                return
+            yield keys.decode(telnet.decode(data))
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.task_done)
+
+    def task_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            LOG.error('practice session task failed', exc_info=task.exception())
+
+    async def run(self):
+        peer = self.writer.get_extra_info('peername')
+        LOG.info('%s connected', peer)
+        try:
+            self.writer.write(TELNET_SETUP)
+            keys = self.keys()
+            session_id = await self.choose_session(keys)
+            if session_id is None:
+                return
+            self.round = PracticeRound(session_id, self.round_cards)
+            self.app = PracticeApp(self.term, self.on_submit, self.on_revise)
+            await self.start_round()
+            async for chunk in keys:
+                for key in chunk:
+                    if not self.app.process_key(key):
+                        return
+                # one write per chunk of input, however many widgets were redrawn
+                self.term.flush()
+                await self.writer.drain()
+        except KeyboardInterrupt:
+            pass
+        except ConnectionError:
+            pass
+        finally:
+            self.app = None
+            # don't lose answers that are still being written
+            if self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.term.write(ANSI_RESET + ANSI_CLEAR)
+            self.term.flush()
+            self.writer.close()
+            LOG.info('%s disconnected', peer)
+
+    async def choose_session(self, keys: AsyncIterator[List[str]]) -> Optional[int]:
+        self.term.write(ANSI_CLEAR + ANSI_RESET + ansi_pos(2, 3) + 'Session:')
+        prompt = Input(self.term, (2, 12, 1, 60))
+        prompt.focus()
+        self.term.flush()
+        async for chunk in keys:
+            for key in chunk:
+                event_or_input = prompt.process_key(key)
+                if event_or_input == Input.UNFOCUS:
+                    return None
+                elif isinstance(event_or_input, str):
+                    try:
+                        return await self.db.get_session_id(event_or_input.strip())
+                    except Exception as e:
+                        self.term.write(ansi_pos(4, 3) + ANSI_RED + str(e).ljust(70) + ANSI_RESET)
+                    prompt.focus()
+            self.term.flush()
+            await self.writer.drain()
+        return None
+
+    def next_question(self):
+        assert self.app is not None
+        assert self.round is not None
+
+        card = self.round.next()
+        if card:
+            card_id, deck_name, front, back, streak = card
+            self.app.update_question(front, self.round.number, self.round.total, f'[{card_id}, {deck_name}]')
+        elif self.round.done:
+            self.app.update_question('Continue? [Y/N]', 0, 0)
+        else:
+            self.app.update_question('No cards to review.\n(Add more! :D)', 0, 0)
+
+    async def start_round(self):
+        assert self.app is not None
+        assert self.round is not None
+
+        self.starting = True
+        try:
+            self.app.clear_history()
+            self.term.flush()
+            await self.db.run(self.round.start)
+            await self.prefetch_layouts()
+            if self.app is None:
+                return
+            self.next_question()
+            self.term.flush()
+        finally:
+            self.starting = False
+
+    async def prefetch_layouts(self):
+        assert self.round is not None
+        prefetch = LayoutPrefetch((front for _, _, front, _, _ in self.round.ready), *FRONT_LAYOUT)
+        if not prefetch.pending:
+            return
+        await self.db.run(prefetch.load)
+        # laid out on the default executor, so other sessions' queries don't
+        # wait behind it on the database thread
+        if await asyncio.get_running_loop().run_in_executor(None, prefetch.compute):
+            await self.db.run(prefetch.store)
+
+    async def update_card(self, card_id: int, streak: int, result: QuestionResult):
+        assert self.round is not None
+        session_id = self.round.session_id
+
+        def update(cur):
+            streak_, review_at = schedule(cur.get_session_counter(session_id), streak, result)
+            cur.update_session_card(session_id, card_id, streak_, review_at)
+
+        await self.db.run(update)
+
+    def on_submit(self, answer: str) -> bool:
+        assert self.app is not None
+        assert self.round is not None
+
+        if self.starting:
+            pass
+        elif self.round.current:
+            (card_id, deck_name, front, back, streak), result = self.round.answer(answer)
+            self.app.push_history(card_id, result, front, back, answer)
+            # written in the background; the database batches concurrent writes
+            self.spawn(self.update_card(card_id, streak, result))
+            self.next_question()
+        elif normalize_answer(answer) in ('y', 'yes'):
+            self.spawn(self.start_round())
+        elif normalize_answer(answer) in ('n', 'no'):
+            return False
+        return True
+
+    def on_revise(self, card_id: int, result: QuestionResult):
+        assert self.round is not None
+        if self.round.is_answered(card_id):
+            self.spawn(self.update_card(card_id, self.round.streak(card_id), result))
+
+async def serve_terminals_async(path: str, profile: str, busy_timeout_s: float, host: str, port: int, round_cards: int):
+    db = AsyncDatabase(path, profile, busy_timeout_s=busy_timeout_s)
+    try:
+        for macro_id, name, definition in await db.list_macros():
+            Macro.create(name, definition)
+
+        async def on_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            await TerminalSession(db, reader, writer, round_cards).run()
+
+        server = await asyncio.start_server(on_connect, host, port)
+        for socket in server.sockets:
+            LOG.info('serving terminals on %s', socket.getsockname())
+            print(f'serving terminals on {socket.getsockname()} (Ctrl+C to stop)')
+        async with server:
+            await server.serve_forever()
+    finally:
+        await db.aclose()
+
+def serve_terminals(path: str, profile: str, busy_timeout_s: float, host: str, port: int, round_cards: int = 10) -> int:
+    try:
+        asyncio.run(serve_terminals_async(path, profile, busy_timeout_s, host, port, round_cards))
+    except KeyboardInterrupt:
+        pass
+    return 0
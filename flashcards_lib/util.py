@@ -15,7 +15,7 @@
 
 from __future__ import annotations
 
-from typing import Optional, Generator
+from typing import Dict, Optional, Generator
 import unicodedata
 
 from functools import reduce
@@ -39,7 +39,12 @@ def unicode_center(s: str, width: int) -> str:
     n1 = n - n0
     return ' '*n0 + s + ' '*n1
 
+# for StringMask.flags
+BITS_TO_FLAGS = bytes.maketrans(b'01', b'\x00\x01')
+
 class StringMask:
+    '''a set of character positions in a string, as the bits of an int'''
+
     __slots__ = 'bits'
 
     bits: int
@@ -84,8 +89,11 @@ class StringMask:
         return self
 
     def extend(self, gen: Generator[bool, None, None]):
-        for i, bit in enumerate(gen):
-            self[i] = bit
+        # setting bits one at a time would copy the int every time
+        digits = ''.join(['1' if bit else '0' for bit in gen])
+        if digits:
+            n = len(digits)
+            self.bits = (self.bits & ~((1 << n) - 1)) | int(digits[::-1], 2)
 
     @staticmethod
     def collect(gen: Generator[bool, None, None]) -> StringMask:
@@ -93,6 +101,26 @@ class StringMask:
         mask.extend(gen)
         return mask
 
+    @staticmethod
+    def from_classes(classes: bytes, flags: int) -> StringMask:
+        '''a mask of the characters whose class (see classify) has any of "flags" set'''
+        if not classes:
+            return StringMask()
+        try:
+            table = CLASS_DIGITS[flags]
+        except KeyError:
+            table = bytes(b'01'[code & flags != 0] for code in range(256))
+            CLASS_DIGITS[flags] = table
+        # int() parses base-2 digits in linear time; the first character is the lowest bit
+        return StringMask(int(classes.translate(table)[::-1], 2))
+
+    def flags(self, length: int) -> bytes:
+        '''the first "length" bits, as a byte (0 or 1) per character, for quick indexing'''
+        if length <= 0:
+            return b''
+        bits = self.bits & ((1 << length) - 1)
+        return format(bits, f'0{length}b').encode('ascii')[::-1].translate(BITS_TO_FLAGS)
+
 def is_breaking_space(c: str, cat: Optional[str] = None):
     if cat is None:
         cat = unicodedata.category(c)
@@ -112,36 +140,78 @@ def is_starting_punctuation(cat: str) -> bool:
 def is_ending_punctuation(cat: str) -> bool:
     return cat in ('Pd', 'Pe', 'Pf')
 
-def line_break_opportunities(s: str) -> StringMask:
-    cats = [unicodedata.category(c) for c in s]
-    breaking_spaces = StringMask.collect(
-        is_breaking_space(c, cat)
-        for c, cat in zip(s, cats))
-    breaking_hyphens = StringMask.collect(
-        is_breaking_hyphen(c, cat)
-        for c, cat in zip(s, cats))
-    cjk_ideograms = StringMask.collect(
-        (c >=     '\u3200' and c <=     '\u9fff') or
-        (c >= '\U00020000' and c <= '\U0002ffff')
-        for c in s)
-    kana = StringMask.collect(c >= '\u3040' and c <= '\u30ff' for c in s)
-    punctuation_inner  = StringMask.collect(is_inner_punctuation   (cat) for cat in cats)
-    punctuation_before = StringMask.collect(is_starting_punctuation(cat) for cat in cats)
-    punctuation_after  = StringMask.collect(is_ending_punctuation  (cat) for cat in cats)
-    modifier = StringMask.collect(cat == 'Sk' for cat in cats)
-
-    maybe_break_after = StringMask()
-    maybe_break_after |= breaking_spaces
-    maybe_break_after |= breaking_hyphens
-    maybe_break_after |= cjk_ideograms
-    maybe_break_after |= cjk_ideograms << 1
-    maybe_break_after |= kana
-    maybe_break_after |= kana << 1
-
-    maybe_break_after &= ~punctuation_inner
-    maybe_break_after &= ~(punctuation_inner << 1)
-    maybe_break_after &= ~punctuation_before
-    maybe_break_after &= ~(punctuation_after << 1)
-    maybe_break_after &= ~(modifier << 1)
+# character classes (bit flags), see classify
+CLASS_BREAKING          = 0x01 # breaking spaces and hyphens
+CLASS_IDEOGRAPHIC       = 0x02 # CJK ideographs and kana
+CLASS_INNER_PUNCTUATION = 0x04
+CLASS_START_PUNCTUATION = 0x08
+CLASS_END_PUNCTUATION   = 0x10
+CLASS_MODIFIER          = 0x20
+CLASS_MARKUP            = 0x40 # markup operators and escapes (see markup.token_boundaries)
+CLASS_NUMBER_SIGN       = 0x80
+
+def char_class(c: str) -> int:
+    cat = unicodedata.category(c)
+    code = 0
+    if is_breaking_space(c, cat) or is_breaking_hyphen(c, cat):
+        code |= CLASS_BREAKING
+    if ('\u3040' <= c <= '\u30ff' or
+        '\u3200' <= c <= '\u9fff' or
+        '\U00020000' <= c <= '\U0002ffff'
+    ):
+        code |= CLASS_IDEOGRAPHIC
+    if is_inner_punctuation(cat):
+        code |= CLASS_INNER_PUNCTUATION
+    if is_starting_punctuation(cat):
+        code |= CLASS_START_PUNCTUATION
+    if is_ending_punctuation(cat):
+        code |= CLASS_END_PUNCTUATION
+    if cat == 'Sk':
+        code |= CLASS_MODIFIER
+    if c in ('\\', '{', '}', '^', '_'):
+        code |= CLASS_MARKUP
+    if c == '#':
+        code |= CLASS_NUMBER_SIGN
+    return code
+
+class CharClasses(Dict[int, str]):
+    '''str.translate table from characters to chr(char_class(c)), filled in as characters are seen'''
+
+    __slots__ = ()
+
+    def __missing__(self, key: int) -> str:
+        value = chr(char_class(chr(key)))
+        self[key] = value
+        return value
+
+CHAR_CLASSES = CharClasses()
+# bytes.translate needs a 256-entry table, though only ASCII is looked up
+ASCII_CLASSES = bytes(char_class(chr(i)) for i in range(256))
+
+# StringMask.from_classes translate tables, by flags
+CLASS_DIGITS: Dict[int, bytes] = {}
+
+def classify(s: str) -> bytes:
+    '''the class of each character in s (see char_class), as one byte per character'''
+    if s.isascii():
+        return s.encode('ascii').translate(ASCII_CLASSES)
+    return s.translate(CHAR_CLASSES).encode('latin-1')
+
+def line_break_opportunities(s: str, classes: Optional[bytes] = None) -> StringMask:
+    '''
+    characters a line may break after
+
+    classes may be given if the caller has already classified s.
+    '''
+    if classes is None:
+        classes = classify(s)
+    ideographic = StringMask.from_classes(classes, CLASS_IDEOGRAPHIC)
+
+    maybe_break_after  = StringMask.from_classes(classes, CLASS_BREAKING | CLASS_IDEOGRAPHIC)
+    maybe_break_after |= ideographic << 1
+
+    maybe_break_after &= ~StringMask.from_classes(classes, CLASS_INNER_PUNCTUATION | CLASS_START_PUNCTUATION)
+    maybe_break_after &= ~(StringMask.from_classes(classes,
+        CLASS_INNER_PUNCTUATION | CLASS_END_PUNCTUATION | CLASS_MODIFIER) << 1)
 
     return maybe_break_after
\ No newline at end of file
@@ -0,0 +1,236 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import glob, json, logging, os, sqlite3, sys, threading
+from typing import IO, List, Optional, Tuple
+
+from flashcards_lib.database import Database
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+LOG = logging.getLogger(__name__)
+
+Update = Tuple[int, int, int, Optional[int]] # session, card, streak, review_at
+
+def journal_path(db_path: str, pid: int, seq: int) -> str:
+    return f'{db_path}-answers-{pid}-{seq}'
+
+def journal_order(path: str) -> Tuple[int, ...]:
+    '''sorts a process' journals in the order they were written'''
+    try:
+        return tuple(int(n) for n in path.rsplit('-answers-', 1)[1].split('-'))
+    except ValueError:
+        return ()
+
+def lock_journal(f: IO[str], wait: bool) -> bool:
+    '''
+    locks a journal for as long as it's open; the lock is how other
+    processes tell a live journal from one left behind
+    '''
+    try:
+        if sys.platform == 'win32':
+            # locks the first byte, wherever the file is written
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if wait else msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+    except OSError:
+        return False
+    return True
+
+def is_journal(f: IO[str], path: str) -> bool:
+    '''whether f is (still) the file at path'''
+    try:
+        return os.path.samestat(os.stat(path), os.fstat(f.fileno()))
+    except FileNotFoundError:
+        return False
+
+def remove_journal(f: IO[str]):
+    if sys.platform == 'win32':
+        # open files can't be removed here; another replay may get to it first
+        f.close()
+        try:
+            os.remove(f.name)
+        except FileNotFoundError:
+            pass
+    else:
+        # removed while still locked, so nobody can append to it in between
+        os.remove(f.name)
+        f.close()
+
+class AnswerBuffer:
+    '''
+    write-behind buffer for practice answers
+
+    Updates are appended to a journal file (without fsync) and collected in
+    memory, then written to the database as one batch by flush(), at least
+    every flush_interval_s seconds from a background thread on its own
+    connection.  Each process has its own journals, locked while in use; if
+    the process dies before a flush, they're replayed the next time a buffer
+    is opened for the database.
+
+    A flush starts a new journal and writes the database without holding
+    the lock add() needs, so answers don't wait for the commit; the journals
+    it wrote are removed once it's committed.
+    '''
+
+    __slots__ = (
+        'db',
+        'seq',
+        'journals',
+        'pending',
+        'lock',
+        'flush_lock',
+        'flush_interval_s',
+        'stop',
+        'thread')
+
+    journals: List[IO[str]] # holding the answers in pending; add() appends to the last
+    pending: List[Update]
+
+    def __init__(self, db: Database, flush_interval_s: float = 30.0):
+        self.db = db
+        self.seq = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flush_interval_s = flush_interval_s
+        AnswerBuffer.replay(db)
+        self.journals = [self.next_journal()]
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='AnswerBuffer', daemon=True)
+        self.thread.start()
+
+    def __del__(self):
+        self.close()
+
+    def next_journal(self) -> IO[str]:
+        self.seq += 1
+        return AnswerBuffer.open_journal(journal_path(self.db.path, os.getpid(), self.seq))
+
+    # attempts at locking our journal; only a replay of a journal left by an
+    # earlier process with our pid holds it, and not for long
+    LOCK_ATTEMPTS = 3
+
+    @staticmethod
+    def open_journal(path: str) -> IO[str]:
+        attempts = AnswerBuffer.LOCK_ATTEMPTS
+        while True:
+            f = open(path, 'a', encoding='utf-8')
+            if not lock_journal(f, True):
+                # msvcrt gives up after a few seconds; without the lock a
+                # replay could remove the journal while we append to it
+                f.close()
+                attempts -= 1
+                if attempts <= 0:
+                    raise Exception(f'failed to lock answer journal {path}')
+                continue
+            # a replay (of a journal left by an earlier process with our pid)
+            # may have removed the file while we waited for the lock
+            if is_journal(f, path):
+                return f
+            f.close()
+
+    @staticmethod
+    def replay(db: Database) -> int:
+        '''writes any journals left behind by other processes to the database'''
+        count = 0
+        # in order, since a later journal may update the same cards
+        for path in sorted(glob.glob(glob.escape(db.path) + '-answers-*'), key=journal_order):
+            try:
+                f = open(path, 'r+', encoding='utf-8')
+            except FileNotFoundError:
+                continue
+            if not lock_journal(f, False):
+                # still in use
+                f.close()
+                continue
+            if not is_journal(f, path):
+                # replayed by someone else while we opened it
+                f.close()
+                continue
+            updates: List[Update] = []
+            for line in f:
+                try:
+                    session, card, streak, review_at = json.loads(line)
+                except ValueError:
+                    # a torn write at the end of the journal never made it to the buffer
+                    LOG.warning('ignoring incomplete journal entry %r', line)
+                    break
+                updates.append((session, card, streak, review_at))
+            if updates:
+                LOG.info('replaying %d journaled answers from %s', len(updates), path)
+                try:
+                    db.retry(lambda cur: cur.update_session_cards(updates))
+                except:
+                    f.close()
+                    raise
+            # replaying is idempotent, so it's fine if this is interrupted
+            remove_journal(f)
+            count += len(updates)
+        return count
+
+    def add(self, session: int, card: int, streak: int, review_at: Optional[int]):
+        with self.lock:
+            journal = self.journals[-1]
+            journal.write(json.dumps([session, card, streak, review_at]) + '\n')
+            journal.flush()
+            self.pending.append((session, card, streak, review_at))
+
+    def flush(self, db: Optional[Database] = None):
+        db_ = db or self.db
+        # one flush at a time, so journals are removed in order
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                pending, self.pending = self.pending, []
+                journals, self.journals = self.journals, [self.next_journal()]
+            try:
+                # upserts, so safe to retry
+                db_.retry(lambda cur: cur.update_session_cards(pending))
+            except:
+                # keep them (and their journals) for the next flush
+                with self.lock:
+                    self.pending = pending + self.pending
+                    self.journals = journals + self.journals
+                raise
+            for journal in journals:
+                remove_journal(journal)
+
+    def run(self):
+        db = Database(self.db.path, self.db.profile, cache_size=0)
+        try:
+            while not self.stop.wait(self.flush_interval_s):
+                try:
+                    self.flush(db)
+                except sqlite3.Error:
+                    # keep the answers buffered (and journaled) for the next flush
+                    LOG.exception('flushing answers to %s failed', self.db.path)
+        finally:
+            db.close()
+
+    def close(self):
+        if getattr(self, 'journals', None) is None:
+            return
+        self.stop.set()
+        self.thread.join()
+        self.flush()
+        for journal in self.journals:
+            remove_journal(journal)
+        self.journals = None
@@ -0,0 +1,67 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures the latency of a single practice answer (one transaction running
+# get_session_counter + update_session_card, as cmd_start does) under each
+# database profile.
+#
+# usage: python -m tools.bench_db_profiles [--answers N] [--cards N]
+
+import os, sys, tempfile, time
+from argparse import ArgumentParser
+from typing import List
+
+from flashcards_lib.database import Database, PROFILES
+
+def percentile(samples: List[float], p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def bench_profile(path: str, profile: str, cards: int, answers: int) -> List[float]:
+    db = Database(path, profile)
+    with db as cur:
+        deck_id = cur.create_deck('deck')
+        cur.add_cards(deck_id, [(f'front {i}', f'back {i}') for i in range(cards)])
+        session_id = cur.create_session('session')
+        cur.add_session_decks(session_id, [deck_id])
+
+    samples = []
+    for i in range(answers):
+        t0 = time.perf_counter()
+        with db as cur:
+            counter = cur.get_session_counter(session_id)
+            cur.update_session_card(session_id, i % cards + 1, 1, counter + 2)
+        samples.append(time.perf_counter() - t0)
+
+    db.close()
+    return samples
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--answers', type=int, default=1000)
+    parse.add_argument('--cards', type=int, default=1000)
+    parse.add_argument('--dir', help='directory for the temporary database (defaults to the system temp dir)')
+    args = parse.parse_args(argv[1:])
+
+    print(f'{"profile":10} {"mean ms":>10} {"p50 ms":>10} {"p99 ms":>10} {"answers/s":>10}')
+    for profile in PROFILES:
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            samples = bench_profile(os.path.join(tmp, 'bench.db'), profile, args.cards, args.answers)
+        mean = sum(samples) / len(samples)
+        print(f'{profile:10} {mean*1e3:10.3f} {percentile(samples, 0.5)*1e3:10.3f} {percentile(samples, 0.99)*1e3:10.3f} {1/mean:10.0f}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,74 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Microbenchmark of the queries the card editor runs: scrolling the card
+# browser (one list_cards page per transaction) and submitting a card
+# (update_card followed by a list_cards page).
+#
+# usage: python -m tools.bench_editor_queries [--cards N] [--seconds S]
+
+import os, sys, tempfile, time
+from argparse import ArgumentParser
+from typing import Callable, List
+
+from flashcards_lib.database import Database, PROFILES
+
+PAGE_SIZE = 3 # len(EditorApp.CARD_BROWSER)
+
+def calls_per_second(f: Callable[[int], None], seconds: float) -> float:
+    n = 0
+    t0 = time.perf_counter()
+    t1 = t0
+    while t1 - t0 < seconds:
+        f(n)
+        n += 1
+        t1 = time.perf_counter()
+    return n / (t1 - t0)
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--cards', type=int, default=10000)
+    parse.add_argument('--seconds', type=float, default=2.0)
+    parse.add_argument('--profile', choices=tuple(PROFILES), default='balanced')
+    parse.add_argument('--cached-statements', type=int, default=256)
+    args = parse.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'), args.profile, args.cached_statements)
+        with db as cur:
+            deck_id = cur.create_deck('deck')
+            cur.add_cards(deck_id, [(f'front {i}', f'back {i}') for i in range(args.cards)])
+
+        def scroll(i: int):
+            with db as cur:
+                if i % 2:
+                    cur.list_cards(deck_id=deck_id, before_id=i % args.cards + PAGE_SIZE, limit=PAGE_SIZE)
+                else:
+                    cur.list_cards(deck_id=deck_id, after_id=i % args.cards, limit=PAGE_SIZE)
+
+        def submit(i: int):
+            card_id = i % args.cards + 1
+            with db as cur:
+                cur.update_card(card_id, f'front {i}', f'back {i}')
+            with db as cur:
+                cur.list_cards(deck_id=deck_id, after_id=card_id - 1, limit=PAGE_SIZE)
+
+        print(f'scroll: {calls_per_second(scroll, args.seconds):10.0f} calls/s')
+        print(f'submit: {calls_per_second(submit, args.seconds):10.0f} calls/s')
+        db.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
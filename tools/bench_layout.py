@@ -0,0 +1,87 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures laying out long cards (markup.layout, including flattening the
+# result's items, as MarkupDrawer.draw_list does) by number of words.  The
+# concat used before TextGroups kept their parts, which copied both groups'
+# items every time, is timed on the same cards for comparison.
+#
+# usage: python -m tools.bench_layout [--words 250,500,1000,2000] [--width 115]
+
+import logging, random, statistics, sys, time
+from argparse import ArgumentParser
+from typing import List, Optional
+
+from flashcards_lib.markup import layout, scan, MarkupLogHandler, Text, TextBox, TextGroup
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet,', 'consectetur', 'adipiscing', 'elit.', 'x^2', '\\fgcolor{red}{rouge}')
+
+def legacy_concat(self: TextGroup,
+    other: TextGroup,
+    x_offset: Optional[int] = None,
+    y_offset: Optional[int] = None,
+    baseline: Optional[int] = None
+) -> TextGroup:
+    if x_offset is None:
+        x_offset = self.box.width
+    if y_offset is None:
+        y_offset = self.box.baseline - other.box.baseline
+    x0 = min(0, x_offset)
+    x1 = max(self.box.width, other.box.width + x_offset)
+    y0 = min(0, y_offset)
+    y1 = max(self.box.height, other.box.height + y_offset)
+    if baseline is None:
+        baseline = self.box.baseline - y0
+    items = [
+        *(Text(item.x - x0, item.y - y0, item.text) for item in self.items),
+        *(Text(item.x + x_offset - x0, item.y + y_offset - y0, item.text) for item in other.items)]
+    return TextGroup(TextBox(x1 - x0, y1 - y0, baseline), items)
+
+def layout_ms(text: str, width: int, samples: int) -> float:
+    times = []
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        _, group = layout(iter(scan(text)), width, True)
+        group.items
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1e3
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--words', default='250,500,1000,2000')
+    parse.add_argument('--width', type=int, default=115)
+    parse.add_argument('--samples', type=int, default=5)
+    args = parse.parse_args(argv[1:])
+
+    # layout needs the handler; skip its debug logging
+    MarkupLogHandler(100000)
+    logging.getLogger('flashcards_lib.markup').setLevel(logging.INFO)
+
+    random.seed(0)
+    concat = TextGroup.concat
+    print(f'{"words":>8} {"layout ms":>12} {"legacy ms":>12}')
+    for words in (int(words) for words in args.words.split(',')):
+        text = ' '.join(random.choice(WORDS) for _ in range(words))
+        current = layout_ms(text, args.width, args.samples)
+        TextGroup.concat = legacy_concat # type: ignore
+        try:
+            legacy = layout_ms(text, args.width, args.samples)
+        finally:
+            TextGroup.concat = concat # type: ignore
+        print(f'{words:8} {current:12.2f} {legacy:12.2f}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
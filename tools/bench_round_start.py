@@ -0,0 +1,97 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures practice round-start latency (the queries cmd_start runs in
+# start_round) as the deck grows, with half of the deck already seen.  The
+# anti-join query get_new_cards used before frontier tracking is timed on the
+# same data for comparison.
+#
+# usage: python -m tools.bench_round_start [--sizes 10000,100000,1000000,10000000]
+
+import os, statistics, sys, tempfile, time
+from argparse import ArgumentParser
+from typing import List
+
+from flashcards_lib.database import Database
+from flashcards_lib.deck_io import import_cards
+
+ROUND_CARDS = 10
+
+LEGACY_NEW_CARDS = '''
+    SELECT cards.id, decks.name, cards.front, cards.back
+        FROM cards
+        LEFT JOIN decks ON
+            cards.deck_id == decks.id
+        WHERE EXISTS (
+            SELECT 1 FROM session_decks
+                WHERE session_decks.session_id=:session
+                AND session_decks.deck_id=cards.deck_id
+        ) AND NOT EXISTS (
+            SELECT 1 FROM session_cards
+                WHERE session_cards.session_id=:session
+                AND session_cards.card_id=cards.id
+        )
+        LIMIT :limit'''
+
+def bench_size(path: str, size: int, rounds: int) -> None:
+    db = Database(path, 'bulk')
+    with db as cur:
+        deck_id = cur.create_deck('deck')
+        import_cards(cur, deck_id, ((f'front {i}', f'back {i}') for i in range(size)), 10000)
+        session_id = cur.create_session('session')
+        cur.add_session_decks(session_id, [deck_id])
+        cur.cur.execute('''
+            INSERT INTO session_cards (session_id, card_id, streak, review_at)
+                SELECT ?, id, 31, 1 << 40 FROM cards WHERE id <= ?''',
+            (session_id, size // 2))
+
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        with db as cur:
+            cur.increment_session_counter(session_id)
+            review_cards = cur.get_review_cards(session_id, ROUND_CARDS)
+            new_cards = cur.get_new_cards(session_id, ROUND_CARDS - len(review_cards))
+        samples.append(time.perf_counter() - t0)
+        with db as cur:
+            for card_id, _, _, _ in new_cards:
+                cur.update_session_card(session_id, card_id, 1, 1 << 40)
+
+    legacy = []
+    for _ in range(min(rounds, 5)):
+        t0 = time.perf_counter()
+        with db as cur:
+            cur.cur.execute(LEGACY_NEW_CARDS, {'session': session_id, 'limit': ROUND_CARDS})
+            cur.cur.fetchall()
+        legacy.append(time.perf_counter() - t0)
+
+    db.close()
+    print(f'{size:10} {statistics.median(samples)*1e3:12.3f} {statistics.median(legacy)*1e3:12.3f}')
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--sizes', default='10000,100000,1000000')
+    parse.add_argument('--rounds', type=int, default=50)
+    parse.add_argument('--dir', help='directory for the temporary databases (defaults to the system temp dir)')
+    args = parse.parse_args(argv[1:])
+
+    print(f'{"cards":>10} {"start ms":>12} {"legacy ms":>12}')
+    for size in (int(size) for size in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            bench_size(os.path.join(tmp, 'bench.db'), size, args.rounds)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,61 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Compares list cards --contains-text using the FTS5 trigram index against
+# the LIKE fallback.
+#
+# usage: python -m tools.bench_search [--cards N]
+
+import os, random, string, sys, tempfile, time
+from argparse import ArgumentParser
+from typing import List
+
+from flashcards_lib.database import Database
+
+def random_word(rng: random.Random) -> str:
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10)))
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--cards', type=int, default=200000)
+    parse.add_argument('--queries', type=int, default=20)
+    args = parse.parse_args(argv[1:])
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'), 'bulk')
+        cards = [
+            (' '.join(random_word(rng) for _ in range(4)), random_word(rng))
+            for _ in range(args.cards)]
+        with db as cur:
+            deck_id = cur.create_deck('deck')
+            cur.add_cards(deck_id, cards)
+        # words from the cards, so each query finds something
+        needles = [rng.choice(rng.choice(cards)[0].split()) for _ in range(args.queries)]
+
+        for fts in (True, False):
+            db.cur.fts = fts
+            t0 = time.perf_counter()
+            hits = 0
+            with db as cur:
+                for needle in needles:
+                    hits += len(cur.search_cards(needle, limit=100))
+            dt = (time.perf_counter() - t0) / len(needles)
+            print(f'{"fts5" if fts else "like":5} {dt*1e3:10.3f} ms/query ({hits} results)')
+        db.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
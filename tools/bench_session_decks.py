@@ -0,0 +1,110 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures changing a session's decks (Cursor.update_session_decks) as the
+# session's progress grows: adding a small deck, and removing one of four
+# equally sized decks.  The delete-everything-and-cleanup implementation used
+# before is timed on the same data for comparison.  Each change is rolled
+# back, so every sample starts from the same state.
+#
+# usage: python -m tools.bench_session_decks [--sizes 10000,100000,1000000]
+
+import os, statistics, sys, tempfile, time
+from argparse import ArgumentParser
+from typing import Callable, List
+
+from flashcards_lib.database import Cursor, Database
+from flashcards_lib.deck_io import import_cards
+
+DECKS = 4
+
+LEGACY_CLEANUP = '''
+    DELETE FROM session_cards
+        WHERE session_id=?
+        AND NOT EXISTS (
+            SELECT 1
+                FROM cards
+                INNER JOIN session_decks ON
+                    session_cards.card_id = cards.id AND
+                    session_decks.deck_id = cards.deck_id AND
+                    session_decks.session_id = session_cards.session_id
+        )'''
+
+def legacy_update_session_decks(cur: Cursor, session_id: int, deck_ids: List[int]):
+    cur.cur.execute('DELETE FROM session_decks WHERE session_id=?', (session_id,))
+    cur.add_session_decks(session_id, deck_ids)
+    cur.cur.execute(LEGACY_CLEANUP, (session_id,))
+
+class Rollback(Exception):
+    __slots__ = ()
+
+def time_change(db: Database, f: Callable[[Cursor], None], samples: int) -> float:
+    '''median seconds to run f(cur), rolling back after each sample'''
+    times = []
+    for _ in range(samples):
+        try:
+            with db.write() as cur:
+                t0 = time.perf_counter()
+                f(cur)
+                times.append(time.perf_counter() - t0)
+                raise Rollback()
+        except Rollback:
+            pass
+    return statistics.median(times)
+
+def bench_size(path: str, size: int, samples: int) -> None:
+    db = Database(path, 'bulk')
+    with db as cur:
+        deck_ids = []
+        for i in range(DECKS):
+            deck_id = cur.create_deck(f'deck {i}')
+            import_cards(cur, deck_id, ((f'front {j}', f'back {j}') for j in range(size // DECKS)), 10000)
+            deck_ids.append(deck_id)
+        extra_id = cur.create_deck('extra')
+        import_cards(cur, extra_id, ((f'front {j}', f'back {j}') for j in range(100)), 10000)
+        session_id = cur.create_session('session')
+        cur.add_session_decks(session_id, deck_ids)
+        # every card in the session's decks has been reviewed
+        cur.cur.execute('''
+            INSERT INTO session_cards (session_id, card_id, streak, review_at)
+                SELECT ?, id, 1, 1 << 40 FROM cards WHERE deck_id != ?''',
+            (session_id, extra_id))
+
+    add    = deck_ids + [extra_id]
+    remove = deck_ids[:-1]
+    results = (
+        time_change(db, lambda cur: cur.update_session_decks(session_id, add), samples),
+        time_change(db, lambda cur: legacy_update_session_decks(cur, session_id, add), samples),
+        time_change(db, lambda cur: cur.update_session_decks(session_id, remove), samples),
+        time_change(db, lambda cur: legacy_update_session_decks(cur, session_id, remove), samples))
+    db.close()
+    print(f'{size:10}' + ''.join(f' {t*1e3:12.3f}' for t in results))
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--sizes', default='10000,100000,1000000',
+        help='comma-separated numbers of reviewed cards in the session')
+    parse.add_argument('--samples', type=int, default=5)
+    parse.add_argument('--dir', help='directory for the temporary databases (defaults to the system temp dir)')
+    args = parse.parse_args(argv[1:])
+
+    print(f'{"reviewed":>10} {"add ms":>12} {"legacy ms":>12} {"remove ms":>12} {"legacy ms":>12}')
+    for size in (int(size) for size in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            bench_size(os.path.join(tmp, 'bench.db'), size, args.samples)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
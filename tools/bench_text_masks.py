@@ -0,0 +1,221 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures character classification and the StringMasks built from it
+# (util.line_break_opportunities and markup.token_boundaries), and
+# markup.scan, on long Latin and CJK texts.  The per-character
+# implementation used before classification tables (setting mask bits one
+# at a time) is timed on the same text for comparison, as is the
+# Token-at-a-time tokenize and normalize that scan replaced.
+#
+# usage: python -m tools.bench_text_masks [--size 100000] [--samples 5] [--no-legacy]
+
+import random, statistics, sys, time, unicodedata
+from argparse import ArgumentParser
+from typing import Any, Callable, Generator, Iterator, List, Optional
+
+from flashcards_lib.markup import Function, InfixOperator, Macro, scan, Token, token_boundaries
+from flashcards_lib.util import (
+    classify,
+    is_breaking_hyphen,
+    is_breaking_space,
+    is_ending_punctuation,
+    is_inner_punctuation,
+    is_starting_punctuation,
+    line_break_opportunities,
+    StringMask)
+
+LATIN_WORDS = (
+    'lorem', 'ipsum', 'dolor', 'sit', 'amet,', 'consectetur', 'adipiscing', 'elit.',
+    'x^{2}', '\\fgcolor{red}{rouge}', '(parenthetical)', 'well-known', 'café', 'naïve')
+
+# ideographs and kana, with CJK punctuation now and then
+CJK_CHARS = (
+    [chr(c) for c in range(0x4e00, 0x4e00 + 2000)] +
+    [chr(c) for c in range(0x3041, 0x3097)] +
+    [chr(c) for c in range(0x30a1, 0x30fb)])
+CJK_PUNCTUATION = ('、', '。', '「', '」', '・', '！', '？')
+
+def latin_text(size: int) -> str:
+    words: List[str] = []
+    length = 0
+    while length < size:
+        word = random.choice(LATIN_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+def cjk_text(size: int) -> str:
+    return ''.join(
+        random.choice(CJK_PUNCTUATION) if random.random() < 0.1 else random.choice(CJK_CHARS)
+        for _ in range(size))
+
+def legacy_collect(gen: Generator[bool, None, None]) -> StringMask:
+    mask = StringMask()
+    for i, bit in enumerate(gen):
+        mask[i] = bit
+    return mask
+
+def legacy_line_break_opportunities(s: str) -> StringMask:
+    cats = [unicodedata.category(c) for c in s]
+    breaking = legacy_collect(is_breaking_space(c, cat) or is_breaking_hyphen(c, cat) for c, cat in zip(s, cats))
+    cjk_ideograms = legacy_collect(
+        (c >=     '\u3200' and c <=     '\u9fff') or
+        (c >= '\U00020000' and c <= '\U0002ffff')
+        for c in s)
+    kana = legacy_collect(c >= '\u3040' and c <= '\u30ff' for c in s)
+    punctuation_inner  = legacy_collect(is_inner_punctuation   (cat) for cat in cats)
+    punctuation_before = legacy_collect(is_starting_punctuation(cat) for cat in cats)
+    punctuation_after  = legacy_collect(is_ending_punctuation  (cat) for cat in cats)
+    modifier = legacy_collect(cat == 'Sk' for cat in cats)
+    maybe_break_after = breaking | cjk_ideograms | cjk_ideograms << 1 | kana | kana << 1
+    maybe_break_after &= ~punctuation_inner
+    maybe_break_after &= ~(punctuation_inner << 1)
+    maybe_break_after &= ~punctuation_before
+    maybe_break_after &= ~(punctuation_after << 1)
+    maybe_break_after &= ~(modifier << 1)
+    return maybe_break_after
+
+def legacy_token_boundaries(s: str) -> StringMask:
+    cats = [unicodedata.category(c) for c in s]
+    delim = legacy_collect(
+        c in ('\\', '{', '}', '^', '_') or
+        is_breaking_space(c, cat) or
+        is_inner_punctuation(cat) or
+        is_starting_punctuation(cat) or
+        is_ending_punctuation(cat)
+        for c, cat in zip(s, cats))
+    number_sign = legacy_collect(c == '#' for c in s)
+    return (legacy_line_break_opportunities(s) | delim | delim << 1) & ~number_sign
+
+def legacy_tokenize(s: str, scope: Optional[str] = None) -> Generator[Token, None, None]:
+    breaks = token_boundaries(s).flags(len(s))
+    i = 0
+    j = breaks.find(1)
+    while j >= 0:
+        yield Token(Token.LITERAL, scope, (i, j+1), s[i:j+1])
+        i = j+1
+        j = breaks.find(1, i)
+    if i < len(s):
+        yield Token(Token.LITERAL, scope, (i, len(s)), s[i:])
+
+def legacy_normalize(tokens: Iterator[Token]) -> Generator[Token, None, None]:
+    t0: Optional[Token] = None
+
+    VALUE_LIKE = (Token.LITERAL, Token.FUNCTION, Token.MACRO, Token.RBRACKET)
+
+    while True:
+        try:
+            t1 = next(tokens)
+        except StopIteration:
+            break
+
+        if t0 and t0.type == Token.ESCAPE:
+            if t1.value in Function.lookup:
+                t1 = t1.with_type(Token.FUNCTION)
+            elif t1.value in Macro.lookup:
+                t1 = t1.with_type(Token.MACRO)
+            t0 = t1
+        elif t1.value == '\\':
+            t1 = t1.with_type(Token.ESCAPE)
+            if t0:
+                yield t0
+                if t0.type in VALUE_LIKE:
+                    yield Token(Token.SPACE, t1.scope, None, '')
+            t0 = t1
+        elif t1.value in InfixOperator.lookup:
+            t1 = t1.with_type(Token.INFIX)
+            if not t0 or t0.type not in VALUE_LIKE:
+                yield Token(Token.LITERAL, t1.scope, None, '')
+            if t0:
+                yield t0
+            t0 = t1
+        elif t1.value == '{':
+            t1 = t1.with_type(Token.LBRACKET)
+            if t0:
+                yield t0
+                if t0.type in VALUE_LIKE:
+                    yield Token(Token.SPACE, t1.scope, None, '')
+            t0 = t1
+        elif t1.value == '}':
+            t1 = t1.with_type(Token.RBRACKET)
+            if t0:
+                yield t0
+                if t0.type not in VALUE_LIKE:
+                    yield Token(Token.LITERAL, t1.scope, None, '')
+            t0 = t1
+        elif all(is_breaking_space(c) for c in t1.value):
+            if t0 and t0.type == Token.SPACE:
+                assert t0.range and t1.range
+                t0 = Token(Token.SPACE,
+                    t1.scope,
+                    (
+                        min(t0.range[0], t1.range[0]),
+                        max(t0.range[1], t1.range[1])
+                    ),
+                    t0.value + t1.value)
+            else:
+                if t0 and t0.type in VALUE_LIKE:
+                    t1 = t1.with_type(Token.SPACE)
+                else:
+                    t1 = t1.with_type(Token.LITERAL)
+                if t0:
+                    yield t0
+                t0 = t1
+        else:
+            t1 = t1.with_type(Token.LITERAL)
+            if t0:
+                yield t0
+                if t0.type in VALUE_LIKE:
+                    yield Token(Token.SPACE, t1.scope, None, '')
+            t0 = t1
+
+    if t0:
+        if t0.type not in VALUE_LIKE:
+            yield t0
+            yield Token(Token.LITERAL, t1.scope, None, '')
+        else:
+            yield t0
+
+def median_ms(f: Callable[[], Any], samples: int) -> float:
+    times = []
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1e3
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--size', type=int, default=100000, help='characters of text')
+    parse.add_argument('--samples', type=int, default=5)
+    parse.add_argument('--no-legacy', action='store_true', help="don't time the old implementation (it takes a while)")
+    args = parse.parse_args(argv[1:])
+
+    random.seed(0)
+    print(f'{"text":>6} {"case":>24} {"ms":>10} {"legacy ms":>10}')
+    for name, text in (('latin', latin_text(args.size)), ('cjk', cjk_text(args.size))):
+        cases = (
+            ('classify', lambda: classify(text), None),
+            ('line_break_opportunities', lambda: line_break_opportunities(text), lambda: legacy_line_break_opportunities(text)),
+            ('token_boundaries', lambda: token_boundaries(text), lambda: legacy_token_boundaries(text)),
+            ('scan', lambda: scan(text), lambda: [*legacy_normalize(legacy_tokenize(text))]))
+        for case, f, legacy in cases:
+            legacy_ms = '' if legacy is None or args.no_legacy else f'{median_ms(legacy, 1):10.1f}'
+            print(f'{name:>6} {case:>24} {median_ms(f, args.samples):10.2f} {legacy_ms:>10}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
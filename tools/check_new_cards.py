@@ -0,0 +1,103 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Checks that new-card frontier tracking (Cursor.get_new_cards) finds the
+# same new cards as the anti-join it replaced, through random sequences of
+# adding, answering and deleting cards in several decks, starting with a
+# sequence that used to hide a card whose id was reused.
+#
+# usage: python -m tools.check_new_cards [--runs 200] [--steps 200]
+
+import random, sys
+from argparse import ArgumentParser
+from typing import List, Set
+
+from flashcards_lib.database import Cursor, Database
+from tools.bench_round_start import LEGACY_NEW_CARDS
+
+ALL = 1 << 30
+
+def new_cards(cur: Cursor, session_id: int) -> Set[int]:
+    return {card[0] for card in cur.get_new_cards(session_id, ALL)}
+
+def legacy_new_cards(cur: Cursor, session_id: int) -> Set[int]:
+    cur.cur.execute(LEGACY_NEW_CARDS, {'session': session_id, 'limit': ALL})
+    return {card[0] for card in cur.cur.fetchall()}
+
+def check_reused_id() -> List[str]:
+    '''a deleted card of another deck leaves a gap below the frontier, and its id is reused'''
+    db = Database(':memory:')
+    with db as cur:
+        deck_a = cur.create_deck('a')
+        deck_b = cur.create_deck('b')
+        session_id = cur.create_session('session')
+        cur.add_session_decks(session_id, [deck_a])
+        card_1 = cur.add_card(deck_a, 'front', 'back')
+        cur.update_session_card(session_id, card_1, 1, 1)
+        card_2 = cur.add_card(deck_b, 'front', 'back')
+        card_3 = cur.add_card(deck_a, 'front', 'back')
+        new_cards(cur, session_id)
+        cur.delete_card(card_3)
+        cur.delete_card(card_2)
+        card_4 = cur.add_card(deck_a, 'front', 'back')
+        found = new_cards(cur, session_id)
+    db.close()
+    return [] if found == {card_4} else [f'reused id: expected {{{card_4}}}, found {found}']
+
+def check_random(rng: random.Random, steps: int) -> List[str]:
+    db = Database(':memory:')
+    failures = []
+    with db as cur:
+        decks = [cur.create_deck(f'deck {i}') for i in range(3)]
+        session_id = cur.create_session('session')
+        cur.add_session_decks(session_id, decks[:2])
+        cards: List[int] = []
+        for step in range(steps):
+            op = rng.random()
+            if op < 0.4 or not cards:
+                cards.append(cur.add_card(rng.choice(decks), 'front', 'back'))
+            elif op < 0.6:
+                card_id = rng.choice(cards)
+                cards.remove(card_id)
+                cur.delete_card(card_id)
+            else:
+                found = new_cards(cur, session_id)
+                expected = legacy_new_cards(cur, session_id)
+                if found != expected:
+                    failures.append(f'step {step}: expected {sorted(expected)}, found {sorted(found)}')
+                    break
+                if found:
+                    cur.update_session_card(session_id, rng.choice(sorted(found)), 1, 1)
+    db.close()
+    return failures
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--runs', type=int, default=200)
+    parse.add_argument('--steps', type=int, default=200)
+    parse.add_argument('--seed', type=int, default=0)
+    args = parse.parse_args(argv[1:])
+
+    rng = random.Random(args.seed)
+    failures = check_reused_id()
+    for _ in range(args.runs):
+        failures += check_random(rng, args.steps)
+    for failure in failures:
+        print(failure)
+    print(f'{args.runs + 1} runs, {len(failures)} mismatches')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,117 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Runs every Cursor query against a small seeded database and checks the
+# query plans with EXPLAIN QUERY PLAN, failing on any full table scan that
+# isn't expected (i.e. listing every row of a table).
+#
+# usage: python -m tools.check_query_plans
+
+import re, sys
+from typing import Any, Callable, List, Tuple
+
+from flashcards_lib.database import Cursor, Database
+
+TABLES = ('cards', 'decks', 'sessions', 'session_decks', 'session_cards', 'macros', 'render_cache')
+
+SCAN_RE = re.compile(r'^SCAN (\w+)')
+
+CASES: Tuple[Tuple[str, Callable[[Cursor], Any], Tuple[str, ...]], ...] = (
+    ('list_sessions'           , lambda cur: cur.list_sessions(), ('sessions',)),
+    ('list_decks'              , lambda cur: cur.list_decks(), ('decks',)),
+    ('list_decks(session)'     , lambda cur: cur.list_decks(session=1), ()),
+    ('list_cards'              , lambda cur: cur.list_cards(), ('cards',)),
+    ('list_cards(get_tail)'    , lambda cur: cur.list_cards(limit=3, get_tail=True), ('cards',)),
+    ('list_cards(contains)'    , lambda cur: cur.list_cards(contains_text='a'), ('cards',)),
+    ('list_cards(session)'     , lambda cur: cur.list_cards(session_id=1), ()),
+    ('list_cards(deck)'        , lambda cur: cur.list_cards(deck_id=1), ()),
+    ('list_cards(deck,contains)', lambda cur: cur.list_cards(deck_id=1, contains_text='a'), ()),
+    ('list_cards(contains,fts)', lambda cur: cur.list_cards(contains_text='ont'), ()),
+    ('search_cards'            , lambda cur: cur.search_cards('ont'), ()),
+    ('search_cards(deck)'      , lambda cur: cur.search_cards('ont', deck_id=1, limit=3), ()),
+    ('search_cards(session)'   , lambda cur: cur.search_cards('ont', session_id=1), ()),
+    ('list_cards(deck,after)'  , lambda cur: cur.list_cards(deck_id=1, after_id=2, limit=3), ()),
+    ('list_cards(deck,before)' , lambda cur: cur.list_cards(deck_id=1, before_id=5, limit=3), ()),
+    ('get_deck_id'             , lambda cur: cur.get_deck_id('deck 1'), ()),
+    ('get_card'                , lambda cur: cur.get_card(1), ()),
+    ('update_card'             , lambda cur: cur.update_card(1, 'front', 'back'), ()),
+    ('add_card'                , lambda cur: cur.add_card(1, 'front', 'back'), ()),
+    ('delete_card'             , lambda cur: cur.delete_card(2), ()),
+    ('iter_deck_cards'         , lambda cur: [*cur.iter_deck_cards(1, 4)], ()),
+    ('get_session_id'          , lambda cur: cur.get_session_id('session 1'), ()),
+    ('get_session_counter'     , lambda cur: cur.get_session_counter(1), ()),
+    ('get_session_decks'       , lambda cur: cur.get_session_decks(1), ()),
+    ('update_session_decks'    , lambda cur: cur.update_session_decks(1, [1, 2]), ()),
+    ('update_session_decks(remove)', lambda cur: cur.update_session_decks(1, [2]), ()),
+    ('cleanup_session_cards'   , lambda cur: cur.cleanup_session_cards(1), ()),
+    ('advance_new_card_frontier', lambda cur: cur.advance_new_card_frontier(1), ()),
+    ('get_new_cards'           , lambda cur: cur.get_new_cards(1, 10), ()),
+    ('get_review_cards'        , lambda cur: cur.get_review_cards(1, 10), ()),
+    ('increment_session_counter', lambda cur: cur.increment_session_counter(1), ()),
+    ('update_session_card'     , lambda cur: cur.update_session_card(1, 3, 1, 4), ()),
+    ('list_macros'             , lambda cur: cur.list_macros(), ('macros',)),
+    ('create_macro'            , lambda cur: cur.create_macro('m', '#1'), ('render_cache',)),
+    ('get_macro'               , lambda cur: cur.get_macro(1), ()),
+    ('delete_macro'            , lambda cur: cur.delete_macro(1), ('render_cache',)),
+    ('get_render_cache'        , lambda cur: cur.get_render_cache([b'a', b'b'], 80, True, b'm'), ()),
+    ('put_render_cache'        , lambda cur: cur.put_render_cache([(b'a', '{}')], 80, True, b'm'), ()),
+    ('invalidate_render_cache' , lambda cur: cur.invalidate_render_cache(['front 1']), ()),
+)
+
+def seed(cur: Cursor):
+    for i in range(1, 3):
+        deck_id = cur.create_deck(f'deck {i}')
+        cur.add_cards(deck_id, [(f'front {j}', f'back {j}') for j in range(10)])
+    session_id = cur.create_session('session 1')
+    cur.add_session_decks(session_id, [1])
+    for card_id in range(1, 6):
+        cur.update_session_card(session_id, card_id, 1, card_id)
+
+def check_plans(db: Database) -> List[str]:
+    statements: List[str] = []
+    failures: List[str] = []
+
+    def trace(sql: str):
+        if sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+            statements.append(sql)
+
+    for name, f, allowed in CASES:
+        statements.clear()
+        db.db.set_trace_callback(trace)
+        try:
+            with db as cur:
+                f(cur)
+        finally:
+            db.db.set_trace_callback(None)
+
+        for sql in statements:
+            for _, _, _, detail in db.db.execute('EXPLAIN QUERY PLAN ' + sql):
+                match = SCAN_RE.match(detail)
+                if match and match.group(1) in TABLES and match.group(1) not in allowed:
+                    failures.append(f'{name}: {detail}\n\t{" ".join(sql.split())}')
+    return failures
+
+def main() -> int:
+    db = Database(':memory:')
+    with db as cur:
+        seed(cur)
+    failures = check_plans(db)
+    for failure in failures:
+        print(failure)
+    print(f'{len(CASES)} cases, {len(failures)} unexpected full scans')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# Contention load test: N simulated learners practice against one database
+# file at the same time, each on its own connection, running what cmd_start
+# does for each round: start_round (PracticeRound.start), then an answer per
+# card (update_card), revising some of them afterwards (on_revise).
+#
+# Prints a JSON report (throughput, latency percentiles per operation,
+# busy/retry counts and database growth) that can be diffed between versions.
+#
+# usage: python -m tools.load_learners [--learners 8] [--mode thread|process] [--rounds 20] [--output report.json]
+
+import json, multiprocessing, os, platform, random, sqlite3, sys, tempfile, threading, time
+from argparse import ArgumentParser, Namespace
+from typing import Any, Dict, List, Tuple
+
+from flashcards_lib.database import Cursor, Database, SCHEMA_VERSION
+from flashcards_lib.deck_io import import_cards
+from flashcards_lib.practice import schedule, PracticeRound, QuestionResult, RESULT_PASS, RESULT_FAIL
+
+OPERATIONS = ('start_round', 'update_card', 'on_revise')
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    def p(q: float) -> float:
+        return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1e3, 3)
+    return {'p50_ms': p(0.50), 'p90_ms': p(0.90), 'p99_ms': p(0.99), 'max_ms': round(samples[-1] * 1e3, 3)}
+
+def database_size(path: str) -> Dict[str, int]:
+    size = {'bytes': sum(
+        os.path.getsize(path + suffix)
+        for suffix in ('', '-wal', '-journal')
+        if os.path.exists(path + suffix))}
+    db = sqlite3.connect(path)
+    try:
+        for pragma in ('page_count', 'freelist_count', 'page_size'):
+            size[pragma] = db.execute(f'PRAGMA {pragma}').fetchone()[0]
+        size['session_cards'] = db.execute('SELECT COUNT(*) FROM session_cards').fetchone()[0]
+    finally:
+        db.close()
+    return size
+
+def create_fixture(path: str, args: Namespace):
+    db = Database(path, args.profile)
+    with db.write() as cur:
+        deck_id = cur.create_deck('deck')
+        import_cards(cur, deck_id, ((f'front {i}', f'back {i}') for i in range(args.cards)))
+        for learner in range(args.learners):
+            session_id = cur.create_session(f'learner {learner}')
+            cur.add_session_decks(session_id, [deck_id])
+    db.close()
+
+def run_learner(path: str, learner: int, args: Namespace, start_at: float) -> Dict[str, Any]:
+    '''one learner's practice; returns latency samples and contention counters'''
+    rng = random.Random(learner)
+    samples: Dict[str, List[float]] = {operation: [] for operation in OPERATIONS}
+    errors = 0
+
+    db = Database(path, args.profile, busy_timeout_s=args.busy_timeout)
+    with db as cur:
+        session_id = cur.get_session_id(f'learner {learner}')
+
+    def timed(operation: str, f):
+        nonlocal errors
+        t0 = time.perf_counter()
+        try:
+            db.retry(f)
+        except sqlite3.OperationalError:
+            errors += 1
+            return
+        samples[operation].append(time.perf_counter() - t0)
+
+    def update_card(card_id: int, streak: int, result: QuestionResult):
+        def update(cur: Cursor):
+            streak_, review_at = schedule(cur.get_session_counter(session_id), streak, result)
+            cur.update_session_card(session_id, card_id, streak_, review_at)
+        return update
+
+    time.sleep(max(0.0, start_at - time.time()))
+    for _ in range(args.rounds):
+        round_ = PracticeRound(session_id, args.round_cards)
+        timed('start_round', round_.start)
+        while True:
+            card = round_.next()
+            if card is None:
+                break
+            (card_id, _, _, back, streak), result = round_.answer(card[3] if rng.random() < args.pass_rate else '')
+            timed('update_card', update_card(card_id, streak, result))
+            if args.think_time:
+                time.sleep(rng.expovariate(1.0 / args.think_time))
+        for card_id, streak in round_.done:
+            if rng.random() < args.revise_rate:
+                timed('on_revise', update_card(card_id, streak, RESULT_PASS if rng.random() < 0.5 else RESULT_FAIL))
+
+    contention = db.contention
+    db.close()
+    return {
+        'samples': samples,
+        'errors': errors,
+        'transactions': contention.transactions,
+        'busy': contention.busy,
+        'retries': contention.retries,
+        'lock_wait_s': contention.wait_s,
+        'max_lock_wait_s': contention.max_wait_s,
+    }
+
+def run_learner_star(job: Tuple[str, int, Namespace, float]) -> Dict[str, Any]:
+    return run_learner(*job)
+
+def run(path: str, args: Namespace) -> Tuple[List[Dict[str, Any]], float]:
+    # give every learner time to connect, so they start together
+    start_at = time.time() + 0.5
+    jobs = [(path, learner, args, start_at) for learner in range(args.learners)]
+    if args.mode == 'process':
+        with multiprocessing.Pool(args.learners) as pool:
+            results = pool.map(run_learner_star, jobs)
+    else:
+        results = [{}] * args.learners
+        def run_thread(learner: int):
+            results[learner] = run_learner_star(jobs[learner])
+        threads = [threading.Thread(target=run_thread, args=(learner,)) for learner in range(args.learners)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results, time.time() - start_at
+
+def report(args: Namespace, results: List[Dict[str, Any]], elapsed_s: float, before: Dict[str, int], after: Dict[str, int]) -> Dict[str, Any]:
+    samples = {operation: [t for result in results for t in result['samples'][operation]] for operation in OPERATIONS}
+    operations = sum(len(times) for times in samples.values())
+    return {
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'schema_version': SCHEMA_VERSION,
+        },
+        'elapsed_s': round(elapsed_s, 3),
+        'throughput': {
+            'operations_per_s': round(operations / elapsed_s, 1),
+            'answers_per_s': round(len(samples['update_card']) / elapsed_s, 1),
+            'rounds_per_s': round(len(samples['start_round']) / elapsed_s, 1),
+        },
+        'latency': {operation: {'count': len(samples[operation]), **percentiles(samples[operation])} for operation in OPERATIONS},
+        'contention': {
+            'transactions': sum(result['transactions'] for result in results),
+            'busy': sum(result['busy'] for result in results),
+            'retries': sum(result['retries'] for result in results),
+            'failed': sum(result['errors'] for result in results),
+            'lock_wait_s': round(sum(result['lock_wait_s'] for result in results), 3),
+            'max_lock_wait_ms': round(max(result['max_lock_wait_s'] for result in results) * 1e3, 3),
+        },
+        'database': {
+            'before': before,
+            'after': after,
+            'growth_bytes': after['bytes'] - before['bytes'],
+        },
+    }
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--learners', type=int, default=8)
+    parse.add_argument('--mode', choices=('thread', 'process'), default='process',
+        help='run learners as threads or as processes (processes behave like separate CLI instances)')
+    parse.add_argument('--rounds', type=int, default=20, help='rounds per learner')
+    parse.add_argument('--round-cards', type=int, default=10)
+    parse.add_argument('--cards', type=int, default=10000, help='deck size')
+    parse.add_argument('--profile', default='balanced')
+    parse.add_argument('--busy-timeout', type=float, default=5.0)
+    parse.add_argument('--pass-rate', type=float, default=0.7)
+    parse.add_argument('--revise-rate', type=float, default=0.1, help='fraction of answers revised after each round')
+    parse.add_argument('--think-time', type=float, default=0.0, help='mean seconds between answers')
+    parse.add_argument('--dir', help='directory for the temporary database (defaults to the system temp dir)')
+    parse.add_argument('--output', help='write the report here instead of stdout')
+    args = parse.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = os.path.join(tmp, 'load.db')
+        create_fixture(path, args)
+        before = database_size(path)
+        results, elapsed_s = run(path, args)
+        after = database_size(path)
+
+    result = json.dumps(report(args, results, elapsed_s, before, after), indent='\t')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(result + '\n')
+    else:
+        print(result)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
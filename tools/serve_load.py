@@ -0,0 +1,163 @@
+# Copyright 2020 Michael Lodato <zvxryb@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# Load generator for "flashcards.py serve".  Each client thread keeps one
+# HTTP/1.1 connection open and repeatedly plays rounds: start a round, then
+# fetch/answer cards until it's finished.  Answers don't depend on the deck:
+# each card is answered wrongly, then about half are revised to a pass.
+# Reports requests/s and latency percentiles per endpoint.
+#
+# By default a server is started in-process on a temporary database with a
+# generated deck; use --url and --session to load an existing server instead.
+#
+# usage: python -m tools.serve_load [--clients 200] [--duration 10] [--url http://127.0.0.1:8080 --session name]
+
+import http.client, json, logging, os, random, sys, tempfile, threading, time
+from argparse import ArgumentParser
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+from urllib.parse import quote, urlsplit
+
+from flashcards_lib.database import Database, DatabasePool
+from flashcards_lib.deck_io import import_cards
+from flashcards_lib.markup import MarkupLogHandler
+from flashcards_lib.server import Server
+
+class Client:
+    __slots__ = 'conn', 'samples', 'errors'
+
+    samples: Dict[str, List[float]]
+
+    def __init__(self, host: str, port: int):
+        self.conn    = http.client.HTTPConnection(host, port, timeout=60)
+        self.samples = defaultdict(list)
+        self.errors  = 0
+
+    def request(self, name: str, method: str, path: str, body: Any = None) -> Any:
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+        start = time.perf_counter()
+        self.conn.request(method, path, data, headers)
+        response = self.conn.getresponse()
+        result = json.loads(response.read())
+        self.samples[name].append(time.perf_counter() - start)
+        if response.status != 200:
+            self.errors += 1
+            return None
+        return result
+
+    def play_round(self, session: str):
+        started = self.request('start', 'POST', f'/sessions/{quote(session, safe="")}/rounds', {})
+        if started is None:
+            return
+        round_id = started['round']
+        while True:
+            next_ = self.request('next', 'GET', f'/rounds/{round_id}/next?width=115')
+            if next_ is None or next_['card'] is None:
+                break
+            card_id = next_['card']['id']
+            answered = self.request('answer', 'POST', f'/rounds/{round_id}/answer', {'answer': 'wrong'})
+            if answered is not None and random.random() < 0.5:
+                self.request('revise', 'POST', f'/rounds/{round_id}/revise', {'card_id': card_id, 'result': 'pass'})
+        self.request('end', 'DELETE', f'/rounds/{round_id}')
+
+def run_clients(host: str, port: int, session: str, clients: int, duration_s: float) -> Tuple[List[Client], float]:
+    deadline = time.monotonic() + duration_s
+    clients_ = [Client(host, port) for _ in range(clients)]
+
+    def run(client: Client):
+        try:
+            while time.monotonic() < deadline:
+                client.play_round(session)
+        except Exception as e:
+            print(f'client failed: {e!r}', file=sys.stderr)
+            client.errors += 1
+
+    threads = [threading.Thread(target=run, args=(client,)) for client in clients_]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients_, time.perf_counter() - start
+
+def report(clients: List[Client], elapsed_s: float):
+    samples: Dict[str, List[float]] = defaultdict(list)
+    for client in clients:
+        for name, times in client.samples.items():
+            samples[name] += times
+    samples['all'] = [t for times in samples.values() for t in times]
+
+    print(f'{len(clients)} clients, {elapsed_s:.1f}s, {sum(c.errors for c in clients)} errors')
+    print(f'{"endpoint":>8} {"requests":>9} {"req/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for name in ('start', 'next', 'answer', 'revise', 'end', 'all'):
+        times = sorted(samples[name])
+        if not times:
+            continue
+        p50 = times[len(times)//2]
+        p99 = times[min(len(times) - 1, int(len(times)*0.99))]
+        print(f'{name:>8} {len(times):>9} {len(times)/elapsed_s:>9.0f} {p50*1e3:>8.2f} {p99*1e3:>8.2f} {times[-1]*1e3:>8.2f}')
+
+def create_fixture(path: str, cards: int, profile: str) -> str:
+    db = Database(path, profile)
+    with db as cur:
+        deck_id = cur.create_deck('deck')
+        import_cards(cur, deck_id, ((f'front {i} x^{{2}} \\fgcolor{{red}}{{y}}', f'back {i}') for i in range(cards)))
+        session_id = cur.create_session('session')
+        cur.add_session_decks(session_id, [deck_id])
+    db.close()
+    return 'session'
+
+def main(argv: List[str]) -> int:
+    parse = ArgumentParser()
+    parse.add_argument('--clients', type=int, default=200)
+    parse.add_argument('--duration', type=float, default=10.0)
+    parse.add_argument('--url', help='server to load (default: start one on a temporary database)')
+    parse.add_argument('--session', help='session to practice (required with --url)')
+    parse.add_argument('--cards', type=int, default=10000, help='deck size for the temporary database')
+    parse.add_argument('--profile', default='balanced')
+    parse.add_argument('--readers', type=int, default=8)
+    args = parse.parse_args(argv[1:])
+
+    if args.url:
+        if not args.session:
+            parse.error('--session is required with --url')
+        url = urlsplit(args.url)
+        clients, elapsed_s = run_clients(url.hostname or '127.0.0.1', url.port or 80, args.session, args.clients, args.duration)
+        report(clients, elapsed_s)
+        return 0
+
+    # normally configured by logging.cfg; layout requires the handler to exist
+    MarkupLogHandler(100000)
+    logging.getLogger('flashcards_lib.markup').setLevel(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'serve_load.db')
+        session = create_fixture(path, args.cards, args.profile)
+        pool = DatabasePool(path, args.profile, args.readers)
+        server = Server(('127.0.0.1', 0), pool)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            host, port = server.server_address[:2]
+            clients, elapsed_s = run_clients(host, port, session, args.clients, args.duration)
+            report(clients, elapsed_s)
+        finally:
+            server.shutdown()
+            server.server_close()
+            pool.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))